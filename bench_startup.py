@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Cold-start benchmark for the Streamlit apps: runs each script once in a fresh interpreter
+# (Streamlit "bare" mode, no widgets interacted with) and profiles its imports with -X importtime.
+# Fails when a stack that is supposed to load lazily is imported at startup.
+
+APPS = ["final_gui.py", "info_re.py", "final_cng.py"]
+LAZY_MODULES = [
+    "matplotlib.pyplot",
+    "matplotlib.backends.backend_pdf",
+    "PIL.Image",
+    "gspread",
+    "gspread_dataframe",
+    "oauth2client.service_account",
+]
+
+RUNNER = """
+import json, runpy, sys, time
+start = time.perf_counter()
+error = None
+try:
+    runpy.run_path(sys.argv[1], run_name="__main__")
+except BaseException as e:
+    error = f"{type(e).__name__}: {e}"
+elapsed = time.perf_counter() - start
+lazy = [m for m in json.loads(sys.argv[2]) if m in sys.modules]
+print("BENCH " + json.dumps({"seconds": elapsed, "eager_lazy_modules": lazy, "error": error}))
+"""
+
+
+def parse_importtime(stderr, top):
+    # Lines look like: "import time:   self [us] |   cumulative | imported package"
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|").split("|")]
+        if name == name.lstrip():
+            rows.append((int(cumulative_us), name))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def bench_app(app, top):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", RUNNER, app, json.dumps(LAZY_MODULES)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    line = next((l for l in result.stdout.splitlines() if l.startswith("BENCH ")), None)
+    if line is None:
+        raise RuntimeError(f"{app} did not report: {result.stderr[-500:]}")
+    report = json.loads(line[len("BENCH "):])
+    report["top_imports"] = parse_importtime(result.stderr, top)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import profile of the Streamlit apps")
+    parser.add_argument("apps", nargs="*", default=APPS)
+    parser.add_argument("--top", type=int, default=8, help="slowest top-level imports to show")
+    parser.add_argument("--budget", type=float, default=None, help="fail when an app takes longer (seconds)")
+    args = parser.parse_args()
+
+    failed = False
+    for app in args.apps:
+        report = bench_app(app, args.top)
+        print(f"=== {app}: {report['seconds']:.3f}s")
+        for cumulative_us, name in report["top_imports"]:
+            print(f"    {cumulative_us / 1000:8.1f} ms  {name}")
+        if report["error"]:
+            print(f"    (script stopped early: {report['error']})")
+        if report["eager_lazy_modules"]:
+            failed = True
+            print(f"    ❌ loaded at startup: {', '.join(report['eager_lazy_modules'])}")
+        if args.budget is not None and report["seconds"] > args.budget:
+            failed = True
+            print(f"    ❌ over budget ({args.budget:.2f}s)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
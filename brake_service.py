@@ -1,6 +1,10 @@
 import logging
 import time
 from openobd import *
+from uds_engine import send_request as uds_send_request
+from tester_present import keepalive
+from session_trace import openobd_client
+from scan_client import SCAN_SERVICE_URL, ScanServiceClient
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
@@ -11,23 +15,9 @@ def log_response(data):
         log_file.write(data + "\n")
 
 def send_request(adb, command, expected_prefix):
-    try:
-        response = adb.request(uds_command=command, silent=True)
-        logging.info(f"Raw Response: {response}")
-        log_response(f"{command} => {response}")
-        if response.startswith(expected_prefix):
-            return response[len(expected_prefix):]
-        else:
-            logging.warning(f"Unexpected response for {command}: {response}")
-            return None
-    except ResponseException as e:
-        logging.error(f"Request failed: {e}")
-        return None
-    except Exception as e:
-        logging.error(f"Unexpected error: {e}")
-        return None
+    return uds_send_request(adb, command, expected_prefix, log=log_response)
 
-def perform_brake_service_exit(adb):
+def confirm_conditions():
     print("\n--- Brake Service Mode Exit ---")
     print("⚠️ Make sure the following conditions are met:")
     print("- All repairs completed")
@@ -37,30 +27,31 @@ def perform_brake_service_exit(adb):
     print("- Parking brake released\n")
     input("Press ENTER to continue...")
 
+def perform_brake_service_exit(adb, channel):
     print("🔧 Entering extended diagnostic session...")
-    send_request(adb, "1003", "50")
+    if send_request(adb, "1003", "50") is not None:
+        keepalive.register(adb, channel)
     time.sleep(0.5)
 
     print("🔧 Starting routine: Move pistons forward...")
-    start_response = send_request(adb, "310103A0", "71")
-    if start_response:
+    if send_request(adb, "310103A0", "7101") is not None:
         print("✅ Routine Start accepted.")
     else:
-        print("⚠️ Routine Start failed or not acknowledged.")
-        return
+        print("⚠️ Routine Start failed or not acknowledged (see log for the reason).")
+        return False
 
     time.sleep(1)
 
     print("🔧 Finishing routine: Confirm piston movement...")
-    stop_response = send_request(adb, "310203A0", "71")
-    if stop_response:
+    if send_request(adb, "310203A0", "7102") is not None:
         print("✅ Routine Stop accepted. Brake service mode exited.")
-    else:
-        print("⚠️ Routine Stop failed. Check vehicle conditions.")
+        return True
+    print("⚠️ Routine Stop failed. Check vehicle conditions (see log for the reason).")
+    return False
 
 def run_brake_exit(ticket_id):
     print("\nStarting session...")
-    obd = OpenOBD()
+    obd = openobd_client()
     session = obd.start_session_on_ticket(ticket_id)
     SessionTokenHandler(session)
 
@@ -86,11 +77,12 @@ def run_brake_exit(ticket_id):
     )
     brake_ecu = IsotpSocket(session, brake_channel)
 
-    perform_brake_service_exit(brake_ecu)
+    success = perform_brake_service_exit(brake_ecu, brake_channel)
 
-    brake_ecu.stop_stream()
+    keepalive.stop_stream(brake_ecu)
     session.finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
     print("\n✅ Session completed successfully.")
+    return success
 
 if __name__ == "__main__":
     print("=== Brake Service Mode Exit ===")
@@ -98,4 +90,10 @@ if __name__ == "__main__":
     if not ticket_id.isdigit():
         print("\033[91mInvalid ticket ID. Must be numeric.\033[0m")
     else:
-        run_brake_exit(ticket_id)
+        confirm_conditions()
+        if SCAN_SERVICE_URL:
+            # Let the scan service do the vehicle I/O, this script only follows the job
+            result = ScanServiceClient(SCAN_SERVICE_URL).run("brake_service_exit", ticket_id=ticket_id)
+            print("\n✅ Brake service mode exited." if result.get("success") else "\n⚠️ Brake service exit failed.")
+        else:
+            run_brake_exit(ticket_id)
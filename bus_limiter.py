@@ -0,0 +1,139 @@
+import math
+import os
+import threading
+import time
+import weakref
+from openobd import *
+from metrics import record_nrc, record_uds_request
+
+# Request pacing per CAN bus. Each bus gets a token bucket refilled in CAN frames per second and a
+# window of concurrent requests, both adjusted AIMD style from what the bus reports back:
+#   fast answers (close to the best latency seen)  -> rate + RATE_STEP, window grows by ~1 per round
+#   NRC 21 busyRepeatRequest or slow answers       -> rate and window halved
+# No response at all says nothing about bus load (the ECU is simply absent), so it is neutral.
+
+INITIAL_RATE = float(os.getenv("BUS_INITIAL_FRAME_RATE", "200"))  # frames/s
+MIN_RATE = 20.0
+MAX_RATE = float(os.getenv("BUS_MAX_FRAME_RATE", "1500"))
+RATE_STEP = 25.0
+BURST = 16
+MAX_CONCURRENCY = int(os.getenv("BUS_MAX_CONCURRENCY", "8"))
+SLOW_FACTOR = 3.0  # latency above SLOW_FACTOR x best latency counts as congestion
+SLOW_FLOOR = 0.05  # ... but never below 50 ms, ECUs jitter that much on an idle bus
+
+
+def isotp_frames(payload_length):
+    # Single frame up to 7 bytes, else first frame (6 bytes) plus consecutive frames of 7
+    if payload_length <= 7:
+        return 1
+    return 1 + math.ceil((payload_length - 6) / 7)
+
+
+class BusLimiter:
+
+    def __init__(self, rate=INITIAL_RATE, max_concurrency=MAX_CONCURRENCY, window=1.0):
+        self.rate = rate
+        self.max_concurrency = max_concurrency
+        self.window = float(window)
+        self.active = 0
+        self.best_latency = None
+        self._tokens = float(BURST)
+        self._refilled = time.monotonic()
+        self._cond = threading.Condition()
+
+    @property
+    def concurrency(self):
+        return int(self.window)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(BURST, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def acquire(self, frames=1):
+        with self._cond:
+            while self.active >= self.concurrency:
+                self._cond.wait()
+            self.active += 1
+            while True:
+                self._refill()
+                if self._tokens >= frames:
+                    self._tokens -= frames
+                    return
+                self._cond.wait((frames - self._tokens) / self.rate)
+
+    def release(self, latency=None, busy=False):
+        with self._cond:
+            self.active -= 1
+            if busy:
+                self._back_off()
+            elif latency is not None:
+                if self.best_latency is None or latency < self.best_latency:
+                    self.best_latency = latency
+                if latency > max(self.best_latency * SLOW_FACTOR, SLOW_FLOOR):
+                    self._back_off()
+                else:
+                    self.rate = min(self.rate + RATE_STEP, MAX_RATE)
+                    self.window = min(self.window + 1 / self.window, self.max_concurrency)
+            self._cond.notify_all()
+
+    def _back_off(self):
+        self.rate = max(self.rate / 2, MIN_RATE)
+        self.window = max(self.window / 2, 1.0)
+
+    def stats(self):
+        return {"rate": round(self.rate, 1), "concurrency": self.concurrency, "active": self.active,
+                "best_latency": self.best_latency}
+
+
+_limiters = weakref.WeakKeyDictionary()
+_limiters_lock = threading.Lock()
+
+
+def bus_limiter(session, bus_name):
+    # One limiter per (session, bus); dropped together with the session
+    with _limiters_lock:
+        return _limiters.setdefault(session, {}).setdefault(bus_name, BusLimiter())
+
+
+def is_busy_response(response):
+    # openobd returns negative responses as hex text when silent=True: 7F <sid> 21
+    return bool(response) and response.upper().startswith("7F") and response[4:6] == "21"
+
+
+def _is_negative_response(response):
+    return bool(response) and response.upper().startswith("7F") and len(response) >= 6
+
+
+def limited_request(limiter, sock, payload, **kwargs):
+    # IsotpSocket.request paced by the bus limiter. Pass silent=True where NRC 21 should slow the bus
+    # down: without it a negative response raises and only its NRC is counted.
+    limiter.acquire(isotp_frames(len(payload) // 2))
+    start = time.monotonic()
+    latency = None
+    busy = False
+    outcome = "error"
+    try:
+        response = sock.request(payload, **kwargs)
+        latency = time.monotonic() - start if response else None
+        busy = is_busy_response(response)
+        if not response:
+            outcome = "no_response"
+        elif _is_negative_response(response):
+            outcome = "negative_response"
+            record_nrc(payload, int(response[4:6], 16))
+        else:
+            outcome = "positive"
+        return response
+    except NoResponseException:
+        outcome = "no_response"
+        raise
+    except NegativeResponseException as e:
+        outcome = "negative_response"
+        busy = isinstance(e, BusyRepeatRequestException)
+        if _is_negative_response(e.response):
+            record_nrc(payload, int(e.response[4:6], 16))
+        raise
+    finally:
+        limiter.release(latency, busy)
+        record_uds_request(getattr(sock, "_channel", None), payload, latency, outcome)
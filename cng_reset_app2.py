@@ -1,6 +1,14 @@
 import logging
 import streamlit as st
 from openobd import *
+from uds_codec import decode_counter, decode_dtcs, decode_text
+from uds_engine import send_request
+from scan_records import ResetResult, to_frame, to_row
+from vag_vehicle import guess_vag_brand
+from session_admin import render_exit_session_expander
+from session_trace import openobd_client
+from reset_analytics import render_reset_dashboard
+from reset_verify import CounterProbe, verification_note, verify_counters
 import pandas as pd
 from datetime import datetime
 import pytz
@@ -20,61 +28,9 @@ RESET_OPTIONS = {
 SKODA_CMD = "2E0C380E90"
 SKODA_RESP = "6E0C38"
 session_csv_path = "cng_reset_sessions.csv"
-openobd = OpenOBD()
+openobd = openobd_client()
 
 # === Helpers ===
-def send_request(sock, command, expected_prefix):
-    try:
-        response = sock.request(command, silent=True)
-        logging.info(f"Raw Response: {response}")
-        if response.startswith(expected_prefix):
-            return response[len(expected_prefix):]
-        else:
-            logging.warning(f"Unexpected response format for {command}")
-            return None
-    except Exception as e:
-        logging.error(f"Request failed: {e}")
-        return None
-
-def decode_utf8(hex_string):
-    try:
-        return bytes.fromhex(hex_string).decode("utf-8").strip("\x00")
-    except:
-        return ""
-
-def decode_service_counter(hex_response):
-    try:
-        return int(hex_response[-4:], 16)
-    except:
-        return None
-
-def decode_dtc_bytes(dtc_data):
-    dtcs = []
-    dtc_bytes = dtc_data[6:]
-    for i in range(0, len(dtc_bytes), 6):
-        if i + 6 <= len(dtc_bytes):
-            raw = dtc_bytes[i:i+6]
-            b1 = int(raw[0:2], 16)
-            b2 = raw[2:4]
-            b3 = raw[4:6]
-            type_code = (b1 & 0xC0) >> 6
-            type_char = ["P", "C", "B", "U"][type_code]
-            dtc = f"{type_char}{(b1 & 0x3F):02X}{b2}{b3}"
-            dtcs.append(dtc)
-    return dtcs
-
-def guess_vag_brand(vin):
-    if not vin or len(vin) < 3:
-        return "Unknown"
-    wmi = vin[:3].upper()
-    return {
-        "WVW": "Volkswagen", "WV1": "Volkswagen Commercial",
-        "WAU": "Audi", "TRU": "Audi (Hungary)",
-        "SKZ": "Skoda", "TMB": "Skoda",
-        "VSS": "SEAT", "3VW": "Volkswagen (Mexico)",
-        "9BW": "Volkswagen (Brazil)"
-    }.get(wmi, "Unknown")
-
 def perform_cng_reset(ticket_id, reset_option):
     try:
         session = openobd.start_session_on_ticket(ticket_id)
@@ -100,7 +56,7 @@ def perform_cng_reset(ticket_id, reset_option):
         ))
 
         vin_hex = send_request(sock, "22F190", "62F190")
-        vin = decode_utf8(vin_hex) if vin_hex else "Unknown"
+        vin = decode_text(vin_hex) if vin_hex else "Unknown"
 
         cng_pre = send_request(sock, "22F18C", "62F18C")
         gateway_pre = send_request(sock, "22F187", "62F187")
@@ -116,29 +72,35 @@ def perform_cng_reset(ticket_id, reset_option):
 
         reset_result = send_request(sock, reset_cmd, reset_resp)
 
-        cng_post = send_request(sock, "22F18C", "62F18C")
-        gateway_post = send_request(sock, "22F187", "62F187")
+        verification = verify_counters([
+            CounterProbe("CNG", sock, lambda: decode_counter(send_request(sock, "22F18C", "62F18C")), decode_counter(cng_pre)),
+            # 22F187 does not change with the reset: accepted as soon as it reads back
+            CounterProbe("Gateway", sock, lambda: decode_counter(send_request(sock, "22F187", "62F187")), decode_counter(gateway_pre),
+                         accept=lambda value, baseline: value is not None),
+        ])
 
         brand = guess_vag_brand(vin)
         now = datetime.now(pytz.timezone("Europe/Brussels")).strftime("%Y-%m-%d %H:%M:%S")
 
-        row = {
-            "timestamp": now,
-            "ticket_id": ticket_id,
-            "CNG_pre_days": decode_service_counter(cng_pre),
-            "CNG_post_days": decode_service_counter(cng_post),
-            "Gateway_pre_days": decode_service_counter(gateway_pre),
-            "Gateway_post_days": decode_service_counter(gateway_post),
-            "vin": vin,
-            "brand_guess": brand,
-            "reset_period_years": RESET_OPTIONS[reset_option],
-            "Kolom 1": ""
-        }
-
-        df = pd.DataFrame([row])
-        df.to_csv(session_csv_path, index=False, mode='a', header=not os.path.exists(session_csv_path))
-        st.success("✅ Reset completed and logged.")
-        st.json(row)
+        result = ResetResult(
+            timestamp=now,
+            ticket_id=ticket_id,
+            cng_pre_days=decode_counter(cng_pre),
+            cng_post_days=verification["CNG"].post,
+            gateway_pre_days=decode_counter(gateway_pre),
+            gateway_post_days=verification["Gateway"].post,
+            vin=vin,
+            brand_guess=brand,
+            reset_period_years=RESET_OPTIONS[reset_option],
+            note=verification_note(verification),
+        )
+
+        to_frame([result]).to_csv(session_csv_path, index=False, mode='a', header=not os.path.exists(session_csv_path))
+        if not verification["CNG"].converged:
+            st.warning("⚠️ Reset written but the CNG counter did not change; logged.")
+        else:
+            st.success(f"✅ Reset verified after {verification['CNG'].settle_time:.2f}s and logged.")
+        st.json(to_row(result, missing=None))
 
         sock.stop_stream()
         session.finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
@@ -203,7 +165,7 @@ with tabs[1]:
                         vin_resp = send_request(test_socket, "22F190", "62F190")
                         if vin_resp:
                             dtc_socket = test_socket
-                            vin = decode_utf8(vin_resp)
+                            vin = decode_text(vin_resp)
                             break
                         else:
                             test_socket.stop_stream()
@@ -215,8 +177,8 @@ with tabs[1]:
                 else:
                     st.success("✅ ECM communication established.")
 
-                    partnr = decode_utf8(send_request(dtc_socket, "22F19E", "62F19E") or "")
-                    swver = decode_utf8(send_request(dtc_socket, "22F1A2", "62F1A2") or "")
+                    partnr = decode_text(send_request(dtc_socket, "22F19E", "62F19E"))
+                    swver = decode_text(send_request(dtc_socket, "22F1A2", "62F1A2"))
 
                     st.markdown(f"**VIN:** `{vin}`  \n**Part Number:** `{partnr}`  \n**Software Version:** `{swver}`")
 
@@ -224,26 +186,22 @@ with tabs[1]:
 
                     raw_dtc = send_request(dtc_socket, "190204", "5902")
 
-                    if not raw_dtc:
+                    if raw_dtc is None:
                         st.error("❌ No DTC response received.")
-                    elif raw_dtc.startswith("FF"):
-                        st.success("✅ No DTCs stored.")
-                    elif raw_dtc.startswith("FF00"):
-                        st.success("✅ No active or stored DTCs.")
                     else:
-                        decoded_dtcs = decode_dtc_bytes("5902" + raw_dtc if not raw_dtc.startswith("5902") else raw_dtc)
+                        decoded_dtcs = decode_dtcs(raw_dtc)
                         if decoded_dtcs:
                             st.warning("⚠️ DTCs Found:")
                             for dtc in decoded_dtcs:
                                 st.markdown(f"- **{dtc}**")
                             if st.button("Clear All DTCs"):
                                 clear_response = send_request(dtc_socket, "14FFFFFF", "54")
-                                if clear_response:
+                                if clear_response is not None:
                                     st.success("✅ DTCs cleared successfully.")
                                 else:
                                     st.error("❌ DTC clear command failed.")
                         else:
-                            st.success("✅ No valid DTCs decoded.")
+                            st.success("✅ No DTCs stored.")
 
                     dtc_socket.stop_stream()
 
@@ -269,6 +227,7 @@ with tabs[2]:
             st.info("🕳️ No reset logs available yet.")
     else:
         st.warning("⚠️ No CSV log file found.")
+    render_reset_dashboard(session_csv_path)
     if st.button("🔄 Refresh Logs"):
         st.experimental_rerun()
 
@@ -310,9 +269,9 @@ with tabs[3]:
 
                 st.markdown("🔍 Reading IPC VIN and Part Number...")
                 vin_hex = send_request(ipc_sock, "22F190", "62F190")
-                vin = decode_utf8(vin_hex) if vin_hex else "Unknown"
+                vin = decode_text(vin_hex) if vin_hex else "Unknown"
                 partnr_hex = send_request(ipc_sock, "22F19E", "62F19E")
-                partnr = decode_utf8(partnr_hex) if partnr_hex else "Unknown"
+                partnr = decode_text(partnr_hex) if partnr_hex else "Unknown"
 
                 col1, col2 = st.columns(2)
                 col1.markdown(f"**VIN:** `{vin}`")
@@ -361,31 +320,5 @@ with tabs[3]:
 
 
 
-    # Exit session management
-with st.expander("🚪 Exit Session OpenOBD (if stuck...)"):
-    openobd = OpenOBD()
-    session_list = openobd.get_session_list()
-
-    if not session_list.sessions:
-        st.success("✅ No active OpenOBD sessions.")
-    else:
-        st.warning("⚠️ Active OpenOBD sessions detected:")
-        session_display = [
-            f"{i + 1}. ID: {s.id} | State: {s.state} | Created: {s.created_at}"
-            for i, s in enumerate(session_list.sessions)
-        ]
-        selected_display = st.multiselect("Select session(s) to close:", options=session_display)
-
-        if selected_display:
-            for display in selected_display:
-                try:
-                    idx = int(display.split(".")[0]) - 1
-                    sid = session_list.sessions[idx].id
-                    openobd.interrupt_session(session_id=SessionId(value=sid))
-                    st.success(f"✅ Session {sid} closed.")
-                except Exception as e:
-                    st.error(f"❌ Failed to close session: {e}")
-
-    if st.button("Logout and Exit"):
-        st.success("👋 Logged out. Application will now exit.")
-        st.stop()
\ No newline at end of file
+# Exit session management
+render_exit_session_expander(OpenOBD)
@@ -1,9 +1,14 @@
 import logging
 import streamlit as st
 from openobd import *
+from uds_codec import decode_counter, decode_text
+from uds_engine import send_request
 from datetime import datetime
 import pytz
 import os
+from tester_present import keepalive
+from session_trace import openobd_client
+from reset_verify import CounterProbe, verify_counters
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO)
@@ -26,41 +31,15 @@ def save_session_data(ticket_id, vin, ecu_name, pre_days, post_days, status):
     with open(save_path, "a") as f:
         f.write(line)
 
-def send_request(cng, command, expected_prefix):
-    try:
-        response = cng.request(command, silent=True)
-        logging.info(f"Raw Response: {response}")
-        if response.startswith(expected_prefix):
-            return response[len(expected_prefix):]
-        else:
-            logging.warning(f"Unexpected response format for {command}")
-            return None
-    except ResponseException as e:
-        logging.error(f"Request failed: {e}")
-        return None
-    except Exception as e:
-        logging.error(f"Unexpected error: {e}")
-        return None
-
-def decode_utf8(hex_string):
-    try:
-        return bytes.fromhex(hex_string).decode("utf-8").strip("\x00")
-    except Exception:
-        return ""
-
-def decode_service_counter(hex_response):
-    try:
-        return int(hex_response[-4:], 16)
-    except:
-        return None
-
 def perform_cng_reset(ticket_id):
     session = None
     sockets = []
+    probes = []
+    vins = {}
 
     try:
         logging.info("Starting session...")
-        obd = OpenOBD()
+        obd = openobd_client()
         session = obd.start_session_on_ticket(ticket_id)
         SessionTokenHandler(session)
 
@@ -85,11 +64,12 @@ def perform_cng_reset(ticket_id):
 
         for ecu in ecus:
             st.markdown(f"### Communicating with {ecu['name']} ECU")
-            cng = IsotpSocket(session, IsotpChannel(
+            channel = IsotpChannel(
                 bus_name="vag_bus",
                 request_id=ecu["req_id"],
                 response_id=ecu["res_id"],
-                padding=Padding.PADDING_ENABLED))
+                padding=Padding.PADDING_ENABLED)
+            cng = IsotpSocket(session, channel)
             sockets.append(cng)
 
             vin = ""
@@ -97,37 +77,42 @@ def perform_cng_reset(ticket_id):
                 ecu_info = send_request(cng, "22F19E", "62F19E")
                 sw_version = send_request(cng, "22F1A2", "62F1A2")
                 vin_id = send_request(cng, "22F190", "62F190")
-                vin = decode_utf8(vin_id or "")
+                vin = decode_text(vin_id)
 
-                st.write("ECU Info:", decode_utf8(ecu_info or ""))
-                st.write("SW Version:", decode_utf8(sw_version or ""))
+                st.write("ECU Info:", decode_text(ecu_info))
+                st.write("SW Version:", decode_text(sw_version))
                 st.write("VIN:", vin)
             except Exception as e:
                 logging.warning(f"Could not read data from {ecu['name']}: {e}")
 
-            send_request(cng, "1003", "50")
+            if send_request(cng, "1003", "50") is not None:
+                keepalive.register(cng, channel)
 
             if ecu["reset"]:
                 send_request(cng, "2EF1988000000E5D23", "6EF198")
                 send_request(cng, "2EF199250409", "6EF199")
 
                 pre_reset = send_request(cng, "220C38", "620C38")
-                pre_days = decode_service_counter(pre_reset)
+                pre_days = decode_counter(pre_reset)
                 st.write(f"{ecu['name']} pre-reset counter: {pre_days} days")
 
                 send_request(cng, "2E0C3401", "6E0C34")
-
-                post_reset = send_request(cng, "220C38", "620C38")
-                post_days = decode_service_counter(post_reset)
-                st.write(f"{ecu['name']} post-reset counter: {post_days} days")
-
-                status = "Success" if post_days is not None and pre_days is not None and post_days < pre_days else "Failed"
-                save_session_data(ticket_id, vin, ecu["name"], pre_days, post_days, status)
-
-                if status == "Success":
-                    st.success(f"✅ Reset successful for {ecu['name']} ECU!")
-                else:
-                    st.error(f"❌ Reset failed or counter unchanged on {ecu['name']} ECU.")
+                probes.append(CounterProbe(
+                    ecu["name"], cng, lambda cng=cng: decode_counter(send_request(cng, "220C38", "620C38")),
+                    pre_days, accept=lambda post, pre: pre is not None and post < pre,
+                ))
+                vins[ecu["name"]] = vin
+
+        # Confirm all resets together: the counters are polled on every ECU at once until they settle
+        for name, result in verify_counters(probes).items():
+            st.write(f"{name} post-reset counter: {result.post} days")
+            status = "Success" if result.converged else "Failed"
+            save_session_data(ticket_id, vins[name], name, result.pre, result.post, status)
+
+            if status == "Success":
+                st.success(f"✅ Reset successful for {name} ECU! (settled after {result.settle_time:.2f}s)")
+            else:
+                st.error(f"❌ Reset failed or counter unchanged on {name} ECU.")
 
     except Exception as e:
         logging.error(f"Error: {e}")
@@ -137,7 +122,7 @@ def perform_cng_reset(ticket_id):
         if session:
             session.finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
         for sock in sockets:
-            sock.stop_stream()
+            keepalive.stop_stream(sock)
 
 st.title("🚘 VAG CNG Service Reset Tool")
 ticket_id = st.text_input("Enter Ticket ID")
@@ -6,11 +6,21 @@ import requests
 from functools import lru_cache
 import os
 from werkzeug.utils import secure_filename
+from report_archive import REPORTS_DIR, ReportArchive
+from report_worker import report_worker, report_download_button
+from uds_codec import READ_VIN, decode_dtcs, decode_text, parse_response
+from scan_stream import PRIMARY_BUS, configure_vag_buses
+from session_trace import openobd_client
+from perf import phase, render_performance_expander, timed
+from metrics import REPORT_RENDER, start_metrics_server
+from scan_client import SCAN_SERVICE_URL, ScanServiceClient
 
 # --- Replit Secrets ---
 RAPIDAPI_KEY = os.environ["RAPIDAPI_KEY"]
 RAPIDAPI_HOST = os.environ["RAPIDAPI_HOST"]
 
+start_metrics_server(9103)
+
 @lru_cache(maxsize=256)
 def translate_dtc_online(dtc_code):
     url = f"https://{RAPIDAPI_HOST}/dtc/{dtc_code}"
@@ -29,71 +39,48 @@ def translate_dtc_online(dtc_code):
     except Exception as e:
         return f"API error: {e}"
 
-def decode_dtc_response(hex_data):
-    dtcs = []
-    try:
-        hex_data = hex_data[4:]  # Remove 5902 or service ID prefix
-        while len(hex_data) >= 6:
-            raw_dtc = hex_data[:6]
-            hex_data = hex_data[6:]
-            dtc_type = raw_dtc[0]
-            code_type = {"0": "P", "1": "C", "2": "B", "3": "U"}.get(dtc_type, "P")
-            dtc = code_type + raw_dtc[1:]
-            dtcs.append(dtc)
-    except Exception as e:
-        dtcs.append(f"Error decoding DTCs: {e}")
-    return dtcs
-
+@timed("Pre-scan")
 def run_prescan(ticket_number):
     logs = []
     dtc_list = []
     try:
-        openobd = OpenOBD()
-        session = openobd.start_session_on_ticket(ticket_number)
-        SessionTokenHandler(session)
+        with phase("Session setup"):
+            openobd = openobd_client()
+            session = openobd.start_session_on_ticket(ticket_number)
+            SessionTokenHandler(session)
         logs.append("OpenOBD session started.")
 
         logs.append("Configuring buses...")
-        bus_configs = [
-            BusConfiguration(bus_name="bus_6_14",
-                             can_bus=CanBus(pin_plus=6, pin_min=14, can_protocol=CanProtocol.CAN_PROTOCOL_ISOTP,
-                                            can_bit_rate=CanBitRate.CAN_BIT_RATE_500,
-                                            transceiver=TransceiverSpeed.TRANSCEIVER_SPEED_HIGH)),
-            BusConfiguration(bus_name="bus_3_11",
-                             can_bus=CanBus(pin_plus=3, pin_min=11, can_protocol=CanProtocol.CAN_PROTOCOL_ISOTP,
-                                            can_bit_rate=CanBitRate.CAN_BIT_RATE_500,
-                                            transceiver=TransceiverSpeed.TRANSCEIVER_SPEED_HIGH))
-        ]
-        bus_config_stream = StreamHandler(session.configure_bus)
-        bus_config_stream.send_and_close(bus_configs)
-        logs.append("Buses configured successfully.")
-
-        ecm_channel = IsotpChannel(bus_name="bus_6_14", request_id=0x7E6, response_id=0x7EE, padding=Padding.PADDING_ENABLED)
-        ecm = IsotpSocket(session, ecm_channel)
+        with phase("Bus config"):
+            buses = configure_vag_buses(session)
+        logs.append(f"Buses configured: {', '.join(buses)}")
 
-        logs.append("Sending 1003 (Extended Diagnostic Session)...")
-        response = ecm.request("1003", silent=True)
-        logs.append(f"1003 Response: {response}")
-
-        logs.append("Sending 22F190 (VIN request)...")
-        response = ecm.request("22F190", tries=2, timeout=5)
-        logs.append(f"22F190 Response: {response}")
-        vin = bytes.fromhex(response[6:]).decode("utf-8") if response else "Unknown"
-        logs.append(f"VIN: {vin}")
-
-        logs.append("Reading DTCs with 1902...")
-        dtc_response = ecm.request("1902", tries=2, timeout=5)
-        logs.append(f"Raw DTC Response: {dtc_response}")
+        ecm_channel = IsotpChannel(bus_name=PRIMARY_BUS, request_id=0x7E6, response_id=0x7EE, padding=Padding.PADDING_ENABLED)
+        ecm = IsotpSocket(session, ecm_channel)
 
-        dtcs = decode_dtc_response(dtc_response)
-        for dtc in dtcs:
-            if dtc.startswith("Error"):
-                dtc_list.append(dtc)
-                logs.append(dtc)
-            else:
+        with phase("ECU I/O"):
+            logs.append("Sending 1003 (Extended Diagnostic Session)...")
+            response = ecm.request("1003", silent=True)
+            logs.append(f"1003 Response: {response}")
+
+            logs.append("Sending 22F190 (VIN request)...")
+            response = parse_response(ecm.request(READ_VIN.request, tries=2, timeout=5))
+            logs.append(f"22F190 Response: {response}")
+            vin = decode_text(response.after(READ_VIN.positive), default="Unknown") if response else "Unknown"
+            logs.append(f"VIN: {vin}")
+
+            logs.append("Reading DTCs with 1902...")
+            dtc_response = parse_response(ecm.request("1902", tries=2, timeout=5))
+            logs.append(f"Raw DTC Response: {dtc_response}")
+
+        dtc_payload = dtc_response.after("5902") if dtc_response else None
+        if dtc_payload is None:
+            logs.append(f"Unexpected DTC response: {dtc_response}")
+        for dtc in decode_dtcs(dtc_payload):
+            with phase("DTC translation"):
                 desc = translate_dtc_online(dtc)
-                dtc_list.append(f"{dtc} - {desc}")
-                logs.append(f"DTC: {dtc} - {desc}")
+            dtc_list.append(f"{dtc} - {desc}")
+            logs.append(f"DTC: {dtc} - {desc}")
 
         ecm.stop_stream()
         session.finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
@@ -107,15 +94,36 @@ def run_prescan(ticket_number):
         logs.append(f"Unexpected error: {e}")
         return "ERROR", dtc_list, logs
 
-def generate_pdf(ticket_number, vin, dtcs, logs):
-    sanitized_ticket = secure_filename(ticket_number)
-    filename = f"pre_scan_report_{sanitized_ticket}.pdf"
+@timed("Pre-scan")
+def run_prescan_service(ticket_number):
+    # Same output as run_prescan, with the vehicle I/O done by scan_service (dtc_read job)
+    logs = [f"Submitting DTC read to the scan service ({SCAN_SERVICE_URL})..."]
+    dtc_list = []
+    try:
+        result = ScanServiceClient(SCAN_SERVICE_URL).run("dtc_read", ticket_id=ticket_number)
+    except Exception as e:
+        logs.append(f"Scan service error: {e}")
+        return "ERROR", dtc_list, logs
+    vin = result["vin"]
+    logs.append(f"VIN: {vin}")
+    logs.append(f"Raw DTC Response: {result['raw']}")
+    for dtc in result["dtcs"]:
+        with phase("DTC translation"):
+            desc = translate_dtc_online(dtc)
+        dtc_list.append(f"{dtc} - {desc}")
+        logs.append(f"DTC: {dtc} - {desc}")
+    return vin, dtc_list, logs
+
+@timed("PDF render")
+@REPORT_RENDER.time(report="prescan")
+def generate_pdf(ticket_number, vin, dtcs, logs, scanned_at=None):
+    # Rendered in memory; nothing is written to the working directory
     pdf = FPDF()
     pdf.add_page()
     pdf.set_font("Arial", size=12)
 
     pdf.cell(200, 10, txt=f"Pre-Scan Report - Ticket #{ticket_number}", ln=True)
-    pdf.cell(200, 10, txt=f"Scan Time: {time.ctime()}", ln=True)
+    pdf.cell(200, 10, txt=f"Scan Time: {scanned_at or time.ctime()}", ln=True)
     pdf.cell(200, 10, txt=f"VIN: {vin}", ln=True)
     pdf.ln(10)
 
@@ -132,27 +140,45 @@ def generate_pdf(ticket_number, vin, dtcs, logs):
     pdf.set_font("Arial", style='B', size=12)
     pdf.cell(200, 10, txt="Logs:", ln=True)
     pdf.set_font("Arial", size=10)
-    for log in logs:
-        pdf.multi_cell(0, 10, log)
-    pdf.output(filename)
-    return filename
+    pdf.multi_cell(0, 6, "\n".join(logs))
+    return pdf.output(dest="S").encode("latin-1")
+
+def build_report(ticket_number, vin, dtcs, logs, scanned_at, archive):
+    report_pdf = generate_pdf(ticket_number, vin, dtcs, logs, scanned_at)
+    if archive:
+        report_archive = ReportArchive()
+        report_archive.store(report_pdf, ticket_number, vin, scan_id=f"{ticket_number}:{scanned_at}")
+        report_archive.prune()
+    return report_pdf
 
 # --- Streamlit UI ---
 st.set_page_config(page_title="Remote Pre-Scan Tool", page_icon="🔧")
 st.title("🔧 Remote Vehicle Pre-Scan Tool")
 
 ticket = st.text_input("Enter Ticket Number")
+archive_reports = st.checkbox(f"🗄️ Archive reports in '{REPORTS_DIR}/'", value=True)
 
 if st.button("Run Pre-Scan") and ticket:
     with st.spinner("Scanning..."):
-        vin, dtcs, log_entries = run_prescan(ticket)
-        report_file = generate_pdf(ticket, vin, dtcs, log_entries)
+        vin, dtcs, log_entries = run_prescan_service(ticket) if SCAN_SERVICE_URL else run_prescan(ticket)
+    st.session_state["prescan"] = {
+        "ticket": ticket, "vin": vin, "dtcs": dtcs, "logs": log_entries,
+        "scanned_at": time.ctime(), "archive": archive_reports,
+    }
     st.success("Pre-scan completed!")
-    st.download_button("Download PDF Report", open(report_file, "rb"), file_name=report_file)
 
-    if dtcs:
+prescan = st.session_state.get("prescan")
+if prescan:
+    # Same inputs give the same worker key, so reruns reuse the PDF rendered for this scan
+    report_key = report_worker.submit(
+        build_report, prescan["ticket"], prescan["vin"], prescan["dtcs"], prescan["logs"],
+        prescan["scanned_at"], prescan["archive"],
+    )
+    report_download_button(report_key, "Download PDF Report", f"pre_scan_report_{secure_filename(prescan['ticket'])}.pdf")
+
+    if prescan["dtcs"]:
         st.subheader("❗ Detected DTCs")
-        for dtc in dtcs:
+        for dtc in prescan["dtcs"]:
             st.write(f"- {dtc}")
             if "API error" in dtc or "No info" in dtc:
                 st.error(f"⚠️ Issue translating DTC: {dtc}")
@@ -160,5 +186,24 @@ if st.button("Run Pre-Scan") and ticket:
         st.success("No DTCs found!")
 
     with st.expander("📄 Scan Log"):
-        for entry in log_entries:
+        for entry in prescan["logs"]:
             st.text(entry)
+
+with st.expander("🗄️ Archived Reports"):
+    search = st.text_input("Ticket number or VIN", key="archive_search").strip()
+    if search:
+        archive = ReportArchive()
+        matches = archive.find(ticket=search) or archive.find(vin=search.upper())
+        if not matches:
+            st.info("No archived reports found.")
+        for entry in matches[:20]:
+            created = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["created"]))
+            st.download_button(
+                f"📥 {created} | Ticket {entry['ticket']} | VIN {entry['vin']}",
+                archive.load(entry["digest"]),
+                file_name=f"pre_scan_report_{secure_filename(entry['ticket'])}_{entry['digest'][:8]}.pdf",
+                mime="application/pdf",
+                key=f"archived_{entry['digest']}_{entry['created']}",
+            )
+
+render_performance_expander()
@@ -0,0 +1,93 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from openobd import *
+from bus_limiter import BusLimiter, limited_request
+
+# Address sweep: finds every ECU that answers on a range of request IDs, including modules that
+# are not in any list (retrofits, aftermarket units). openobd only offers request/response channel
+# pairs, so there is no functional broadcast with a promiscuous listen window; instead each
+# candidate gets a single-frame probe (3E00) with a short timeout and many probes run at once,
+# paced by a dedicated bus limiter. Any answer counts, a negative response (7F 3E 11/7F) included.
+# Targeted identification then only runs on the responders.
+
+SWEEP_TIMEOUT = float(os.getenv("ECU_SWEEP_TIMEOUT", "0.15"))
+SWEEP_WORKERS = int(os.getenv("ECU_SWEEP_WORKERS", "32"))
+SWEEP_11BIT_RANGES = os.getenv("ECU_SWEEP_11BIT_RANGES", "0x700-0x7FF")
+SWEEP_29BIT_RANGES = os.getenv("ECU_SWEEP_29BIT_RANGES", "")  # e.g. "0x17FC0000-0x17FC00FF"
+PROBE_REQUEST = "3E00"
+FALLBACK_REQUEST = "1001"
+
+VAG_RESPONSE_OFFSET = 0x6A  # 0x710 -> 0x77A, 0x714 -> 0x77E, ...
+OBD_REQUEST_IDS = range(0x7E0, 0x7E8)  # 0x7E0 -> 0x7E8
+VAG_29BIT_RESPONSE_OFFSET = 0x20000  # 0x17FC007C -> 0x17FE007C
+
+
+def parse_ranges(text):
+    # "0x700-0x7FF,0x17FC0000-0x17FC00FF" -> [range(...), ...]
+    ranges = []
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        start, _, end = part.partition("-")
+        ranges.append(range(int(start, 0), int(end or start, 0) + 1))
+    return ranges
+
+
+def vag_response_id(request_id):
+    # Response ID VAG uses for a request ID, or None when the mapping leaves the address space
+    if request_id > 0x7FF:
+        response_id = request_id + VAG_29BIT_RESPONSE_OFFSET
+        return response_id if response_id <= 0x1FFFFFFF else None
+    if request_id in OBD_REQUEST_IDS:
+        return request_id + 8
+    response_id = request_id + VAG_RESPONSE_OFFSET
+    return response_id if response_id <= 0x7FF else None
+
+
+def sweep_candidates(ranges_11bit=SWEEP_11BIT_RANGES, ranges_29bit=SWEEP_29BIT_RANGES):
+    candidates = []
+    for id_range in parse_ranges(ranges_11bit) + parse_ranges(ranges_29bit):
+        for request_id in id_range:
+            response_id = vag_response_id(request_id)
+            if response_id is not None:
+                candidates.append((request_id, response_id))
+    return candidates
+
+
+def probe_address(session, bus_name, request_id, response_id, limiter, timeout=SWEEP_TIMEOUT, fallback=None):
+    # Returns the raw answer (hex) of a responder or None
+    sock = IsotpSocket(session, IsotpChannel(
+        bus_name=bus_name,
+        request_id=request_id,
+        response_id=response_id,
+        padding=Padding.PADDING_ENABLED,
+    ), timeout=timeout)
+    try:
+        response = limited_request(limiter, sock, PROBE_REQUEST, silent=True)
+        if not response and fallback:
+            response = limited_request(limiter, sock, fallback, silent=True)
+        return response or None
+    except Exception as e:
+        logging.debug(f"Probe 0x{request_id:X} failed: {e}")
+        return None
+    finally:
+        # The probe has been answered or given up: a flushing stop waits out openobd's 10 s timeout
+        sock.stream_handler.stop_stream(send_remaining_messages=False)
+
+
+def sweep_addresses(session, bus_name, candidates=None, timeout=SWEEP_TIMEOUT, workers=SWEEP_WORKERS, fallback=None):
+    # Probes all candidates concurrently; returns [(request_id, response_id, response_hex)] sorted by ID
+    candidates = sweep_candidates() if candidates is None else candidates
+    if not candidates:
+        return []
+    limiter = BusLimiter(max_concurrency=workers, window=workers)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=min(workers, len(candidates)), thread_name_prefix="ecu-sweep") as pool:
+        answers = pool.map(
+            lambda ids: probe_address(session, bus_name, *ids, limiter, timeout=timeout, fallback=fallback),
+            candidates,
+        )
+        responders = [(req, res, answer) for (req, res), answer in zip(candidates, answers) if answer]
+    logging.info(f"Swept {len(candidates)} addresses on {bus_name} in {time.monotonic() - start:.2f}s: "
+                 f"{len(responders)} responders, limiter {limiter.stats()}")
+    return responders
@@ -1,13 +1,27 @@
 import logging
 import streamlit as st
 from openobd import *
+from uds_codec import decode_counter, decode_dtcs, decode_text
+from uds_engine import RequestFailure, request_payload, send_request
+from scan_records import ResetResult, to_frame, to_row
+from vag_vehicle import guess_vag_brand
+from session_admin import render_exit_session_expander
+from session_trace import openobd_client
+from reset_analytics import render_reset_dashboard
+from reset_verify import CounterProbe, verification_note, verify_counters
 import pandas as pd
 from datetime import datetime
 import pytz
 import os
+import threading
+from tester_present import keepalive
+from perf import phase, render_performance_expander, timed
+from metrics import start_metrics_server
+from scan_client import SCAN_SERVICE_URL, ScanServiceClient
 
 # === Setup ===
 logging.basicConfig(level=logging.INFO)
+start_metrics_server(9102)
 st.set_page_config(page_title="VAG CNG Reset Tool", layout="wide")
 st.title("🚗 VAG CNG Reset & Diagnostic Tool")
 
@@ -20,63 +34,15 @@ RESET_OPTIONS = {
 SKODA_CMD = "2E0C380E90"
 SKODA_RESP = "6E0C38"
 session_csv_path = "cng_reset_sessions.csv"
-openobd = OpenOBD()
-
-# === Helpers ===
-def send_request(sock, command, expected_prefix):
-    try:
-        response = sock.request(command, silent=True)
-        logging.info(f"Raw Response: {response}")
-        if response.startswith(expected_prefix):
-            return response[len(expected_prefix):]
-        else:
-            logging.warning(f"Unexpected response format for {command}")
-            return None
-    except Exception as e:
-        logging.error(f"Request failed: {e}")
-        return None
-
-def decode_utf8(hex_string):
-    try:
-        return bytes.fromhex(hex_string).decode("utf-8").strip("\x00")
-    except:
-        return ""
-
-def decode_service_counter(hex_response):
-    try:
-        return int(hex_response[-4:], 16)
-    except:
-        return None
-
-def decode_dtc_bytes(dtc_data):
-    dtcs = []
-    dtc_bytes = dtc_data[6:]
-    for i in range(0, len(dtc_bytes), 6):
-        if i + 6 <= len(dtc_bytes):
-            raw = dtc_bytes[i:i+6]
-            b1 = int(raw[0:2], 16)
-            b2 = raw[2:4]
-            b3 = raw[4:6]
-            type_code = (b1 & 0xC0) >> 6
-            type_char = ["P", "C", "B", "U"][type_code]
-            dtc = f"{type_char}{(b1 & 0x3F):02X}{b2}{b3}"
-            dtcs.append(dtc)
-    return dtcs
-
-def guess_vag_brand(vin):
-    if not vin or len(vin) < 3:
-        return "Unknown"
-    wmi = vin[:3].upper()
-    return {
-        "WVW": "Volkswagen", "WV1": "Volkswagen Commercial",
-        "WAU": "Audi", "TRU": "Audi (Hungary)",
-        "SKZ": "Skoda", "TMB": "Skoda",
-        "VSS": "SEAT", "3VW": "Volkswagen (Mexico)",
-        "9BW": "Volkswagen (Brazil)"
-    }.get(wmi, "Unknown")
-
+# A DTC session nobody touched for this long is finished (closed tab, technician gone)
+DTC_IDLE_TIMEOUT = float(os.getenv("DTC_SESSION_IDLE_TIMEOUT", "600"))
 
+# One OpenOBD client per server process instead of one per script rerun
+@st.cache_resource
+def get_openobd():
+    return openobd_client()
 
+# === Helpers ===
 def log_ipc_reset(ticket_id, vin, partnr):
     now = datetime.now(pytz.timezone("Europe/Brussels")).strftime("%Y-%m-%d %H:%M:%S")
     brand = guess_vag_brand(vin)
@@ -131,10 +97,13 @@ def append_google_sheet(sheet_name, row):
 
 
 
+@timed("CNG Reset")
 def perform_cng_reset(ticket_id, reset_option):
+    sock = None
     try:
-        session = openobd.start_session_on_ticket(ticket_id)
-        SessionTokenHandler(session)
+        with phase("Session setup"):
+            session = get_openobd().start_session_on_ticket(ticket_id)
+            SessionTokenHandler(session)
 
         bus = BusConfiguration(
             bus_name="vag_bus",
@@ -146,22 +115,25 @@ def perform_cng_reset(ticket_id, reset_option):
                 transceiver=TransceiverSpeed.TRANSCEIVER_SPEED_HIGH
             )
         )
-        StreamHandler(session.configure_bus).send_and_close([bus])
+        with phase("Bus config"):
+            StreamHandler(session.configure_bus).send_and_close([bus])
 
-        sock = IsotpSocket(session, IsotpChannel(
+        channel = IsotpChannel(
             bus_name="vag_bus",
             request_id=0x7E0,
             response_id=0x7E8,
             padding=Padding.PADDING_ENABLED
-        ))
+        )
+        sock = IsotpSocket(session, channel)
 
         vin_hex = send_request(sock, "22F190", "62F190")
-        vin = decode_utf8(vin_hex) if vin_hex else "Unknown"
+        vin = decode_text(vin_hex) if vin_hex else "Unknown"
 
         cng_pre = send_request(sock, "22F18C", "62F18C")
         gateway_pre = send_request(sock, "22F187", "62F187")
 
-        send_request(sock, "1003", "50")
+        if send_request(sock, "1003", "50") is not None:
+            keepalive.register(sock, channel)
 
         if "SKODA" in reset_option.upper():
             reset_cmd = SKODA_CMD
@@ -170,37 +142,55 @@ def perform_cng_reset(ticket_id, reset_option):
             reset_cmd = "2E0C380E8C000000"
             reset_resp = "6E0C38"
 
-        reset_result = send_request(sock, reset_cmd, reset_resp)
-
-        cng_post = send_request(sock, "22F18C", "62F18C")
-        gateway_post = send_request(sock, "22F187", "62F187")
+        try:
+            with phase("ECU I/O"), keepalive.busy(sock):
+                request_payload(sock, reset_cmd, reset_resp)
+            reset_error = None
+        except RequestFailure as e:
+            logging.warning(f"Reset write failed: {e}")
+            reset_error = e
+
+        with phase("Verification"):
+            verification = verify_counters([
+                CounterProbe("CNG", sock, lambda: decode_counter(send_request(sock, "22F18C", "62F18C")), decode_counter(cng_pre)),
+                # 22F187 does not change with the reset: accepted as soon as it reads back
+                CounterProbe("Gateway", sock, lambda: decode_counter(send_request(sock, "22F187", "62F187")), decode_counter(gateway_pre),
+                             accept=lambda value, baseline: value is not None),
+            ])
 
         brand = guess_vag_brand(vin)
         now = datetime.now(pytz.timezone("Europe/Brussels")).strftime("%Y-%m-%d %H:%M:%S")
 
-        row = {
-            "timestamp": now,
-            "ticket_id": ticket_id,
-            "CNG_pre_days": decode_service_counter(cng_pre),
-            "CNG_post_days": decode_service_counter(cng_post),
-            "Gateway_pre_days": decode_service_counter(gateway_pre),
-            "Gateway_post_days": decode_service_counter(gateway_post),
-            "vin": vin,
-            "brand_guess": brand,
-            "reset_period_years": RESET_OPTIONS[reset_option],
-            "Kolom 1": ""
-        }
-
-        df = pd.DataFrame([row])
-        df.to_csv(session_csv_path, index=False, mode='a', header=not os.path.exists(session_csv_path))
-        st.success("✅ Reset completed and logged.")
-        st.json(row)
-
-        sock.stop_stream()
+        result = ResetResult(
+            timestamp=now,
+            ticket_id=ticket_id,
+            cng_pre_days=decode_counter(cng_pre),
+            cng_post_days=verification["CNG"].post,
+            gateway_pre_days=decode_counter(gateway_pre),
+            gateway_post_days=verification["Gateway"].post,
+            vin=vin,
+            brand_guess=brand,
+            reset_period_years=RESET_OPTIONS[reset_option],
+            note=verification_note(verification),
+        )
+
+        with phase("CSV write"):
+            to_frame([result]).to_csv(session_csv_path, index=False, mode='a', header=not os.path.exists(session_csv_path))
+        if reset_error:
+            st.error(f"❌ Reset write rejected ({reset_error.summary}); counters logged.")
+        elif not verification["CNG"].converged:
+            st.warning("⚠️ Reset written but the CNG counter did not change; logged.")
+        else:
+            st.success(f"✅ Reset verified after {verification['CNG'].settle_time:.2f}s and logged.")
+        st.json(to_row(result, missing=None))
+
+        keepalive.stop_stream(sock)
         session.finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
     except Exception as e:
         logging.error(f"Reset Error: {e}")
         st.error(f"❌ Reset failed: {e}")
+        if sock:
+            keepalive.unregister(sock)
 
 
 ##########################################################
@@ -224,14 +214,53 @@ with tabs[1]:
     st.subheader("🛠️ Read & Clear DTCs")
     ticket_id_dtc = st.text_input("Enter Ticket ID", key="dtc_ticket")
 
+    def release_dtc_context(ctx):
+        # From "End DTC Session" or the keep-alive idle timeout, whichever comes first
+        with ctx["lock"]:
+            if ctx["released"]:
+                return
+            ctx["released"] = True
+        try:
+            keepalive.stop_stream(ctx["socket"])
+        except Exception as e:
+            logging.error(f"DTC socket close failed: {e}")
+        try:
+            ctx["session"].finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
+        except Exception as e:
+            logging.error(f"Session close failed: {e}")
+
+    def close_dtc_session():
+        ctx = st.session_state.pop("dtc_ctx", None)
+        if not ctx or not ctx["session"]:
+            return  # Nothing held locally for scan service reads
+        release_dtc_context(ctx)
+
     if st.button("Start DTC Session"):
         if not ticket_id_dtc.isdigit():
             st.error("Ticket ID must be numeric.")
+        elif SCAN_SERVICE_URL:
+            close_dtc_session()
+            try:
+                with st.spinner("Reading DTCs through the scan service..."):
+                    result = ScanServiceClient(SCAN_SERVICE_URL).run("dtc_read", ticket_id=ticket_id_dtc)
+                st.session_state["dtc_ctx"] = {
+                    "session": None,
+                    "socket": None,
+                    "ticket_id": ticket_id_dtc,
+                    "vin": result["vin"],
+                    "partnr": result.get("asam_file_id"),
+                    "swver": result.get("asam_file_version"),
+                    "dtcs": result["dtcs"],
+                }
+            except Exception as e:
+                logging.error(f"DTC Read Error: {e}")
+                st.error(f"❌ DTC read failed: {e}")
         else:
+            close_dtc_session()
             session = None
             dtc_socket = None
             try:
-                session = openobd.start_session_on_ticket(ticket_id_dtc)
+                session = get_openobd().start_session_on_ticket(ticket_id_dtc)
                 SessionTokenHandler(session)
 
                 bus = BusConfiguration(
@@ -250,16 +279,18 @@ with tabs[1]:
 
                 for req_id, res_id in fallback_ids:
                     try:
-                        test_socket = IsotpSocket(session, IsotpChannel(
+                        test_channel = IsotpChannel(
                             bus_name="vag_bus",
                             request_id=req_id,
                             response_id=res_id,
                             padding=Padding.PADDING_ENABLED
-                        ))
+                        )
+                        test_socket = IsotpSocket(session, test_channel)
                         vin_resp = send_request(test_socket, "22F190", "62F190")
                         if vin_resp:
                             dtc_socket = test_socket
-                            vin = decode_utf8(vin_resp)
+                            dtc_channel = test_channel
+                            vin = decode_text(vin_resp)
                             break
                         else:
                             test_socket.stop_stream()
@@ -268,51 +299,82 @@ with tabs[1]:
 
                 if not dtc_socket:
                     st.error("❌ ECM not responding on any known ID pair.")
+                    session.finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
                 else:
-                    st.success("✅ ECM communication established.")
-
-                    partnr = decode_utf8(send_request(dtc_socket, "22F19E", "62F19E") or "")
-                    swver = decode_utf8(send_request(dtc_socket, "22F1A2", "62F1A2") or "")
-
-                    st.markdown(f"**VIN:** `{vin}`  \n**Part Number:** `{partnr}`  \n**Software Version:** `{swver}`")
-
-                    send_request(dtc_socket, "1003", "50")
+                    partnr = decode_text(send_request(dtc_socket, "22F19E", "62F19E"))
+                    swver = decode_text(send_request(dtc_socket, "22F1A2", "62F1A2"))
 
+                    if send_request(dtc_socket, "1003", "50") is None:
+                        logging.warning("Extended session not entered for the DTC session")
                     raw_dtc = send_request(dtc_socket, "190204", "5902")
 
-                    if not raw_dtc:
-                        st.error("❌ No DTC response received.")
-                    elif raw_dtc.startswith("FF"):
-                        st.success("✅ No DTCs stored.")
-                    elif raw_dtc.startswith("FF00"):
-                        st.success("✅ No active or stored DTCs.")
-                    else:
-                        decoded_dtcs = decode_dtc_bytes("5902" + raw_dtc if not raw_dtc.startswith("5902") else raw_dtc)
-                        if decoded_dtcs:
-                            st.warning("⚠️ DTCs Found:")
-                            for dtc in decoded_dtcs:
-                                st.markdown(f"- **{dtc}**")
-                            if st.button("Clear All DTCs"):
-                                clear_response = send_request(dtc_socket, "14FFFFFF", "54")
-                                if clear_response:
-                                    st.success("✅ DTCs cleared successfully.")
-                                else:
-                                    st.error("❌ DTC clear command failed.")
-                        else:
-                            st.success("✅ No valid DTCs decoded.")
-
-                    dtc_socket.stop_stream()
+                    dtc_ctx = {
+                        "session": session,
+                        "socket": dtc_socket,
+                        "ticket_id": ticket_id_dtc,
+                        "vin": vin,
+                        "partnr": partnr,
+                        "swver": swver,
+                        "dtcs": decode_dtcs(raw_dtc) if raw_dtc is not None else None,
+                        "lock": threading.Lock(),
+                        "released": False,
+                    }
+                    # Hold the session while the technician reviews the DTCs, released after DTC_IDLE_TIMEOUT
+                    keepalive.register(dtc_socket, dtc_channel, idle_timeout=DTC_IDLE_TIMEOUT,
+                                       on_expire=lambda ctx=dtc_ctx: release_dtc_context(ctx))
+                    st.session_state["dtc_ctx"] = dtc_ctx
 
             except Exception as e:
                 logging.error(f"DTC Read Error: {e}")
                 st.error(f"❌ Unexpected error: {e}")
-            finally:
+                if dtc_socket:
+                    keepalive.stop_stream(dtc_socket)
                 try:
                     if session:
                         session.finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
                 except Exception as e:
                     logging.error(f"Session close failed: {e}")
 
+    dtc_ctx = st.session_state.get("dtc_ctx")
+    if dtc_ctx and dtc_ctx.get("released"):
+        st.session_state.pop("dtc_ctx")
+        st.warning(f"⚠️ DTC session closed after {DTC_IDLE_TIMEOUT / 60:.0f} minutes without use. Start a new one.")
+    elif dtc_ctx:
+        dtc_socket = dtc_ctx["socket"]
+        if dtc_socket:
+            keepalive.touch(dtc_socket)
+        decoded_dtcs = dtc_ctx["dtcs"]
+
+        st.success("✅ ECM communication established.")
+        st.markdown(f"**VIN:** `{dtc_ctx['vin']}`  \n**Part Number:** `{dtc_ctx['partnr']}`  \n**Software Version:** `{dtc_ctx['swver']}`")
+
+        if decoded_dtcs is None:
+            st.error("❌ No DTC response received.")
+        else:
+            if decoded_dtcs:
+                st.warning("⚠️ DTCs Found:")
+                for dtc in decoded_dtcs:
+                    st.markdown(f"- **{dtc}**")
+                if st.button("Clear All DTCs"):
+                    if dtc_socket is None:
+                        try:
+                            cleared = ScanServiceClient(SCAN_SERVICE_URL).run("dtc_clear", ticket_id=dtc_ctx["ticket_id"])["cleared"]
+                        except Exception as e:
+                            logging.error(f"DTC clear failed: {e}")
+                            cleared = False
+                    else:
+                        cleared = send_request(dtc_socket, "14FFFFFF", "54") is not None
+                    if cleared:
+                        st.success("✅ DTCs cleared successfully.")
+                    else:
+                        st.error("❌ DTC clear command failed.")
+            else:
+                st.success("✅ No DTCs stored.")
+
+        if st.button("End DTC Session"):
+            close_dtc_session()
+            st.success("✅ DTC session closed.")
+
 
 # === TAB 3: HISTORY ===
 with tabs[2]:
@@ -325,6 +387,7 @@ with tabs[2]:
             st.info("🕳️ No reset logs available yet.")
     else:
         st.warning("⚠️ No CSV log file found.")
+    render_reset_dashboard(session_csv_path)
     if st.button("🔄 Refresh Logs"):
         st.experimental_rerun()
 
@@ -341,8 +404,9 @@ with tabs[3]:
         if not ticket_id_ipc.isdigit():
             st.error("Ticket ID must be numeric.")
         else:
+            ipc_sock = None
             try:
-                session = openobd.start_session_on_ticket(ticket_id_ipc)
+                session = get_openobd().start_session_on_ticket(ticket_id_ipc)
                 SessionTokenHandler(session)
 
                 bus = BusConfiguration(
@@ -357,18 +421,19 @@ with tabs[3]:
                 )
                 StreamHandler(session.configure_bus).send_and_close([bus])
 
-                ipc_sock = IsotpSocket(session, IsotpChannel(
+                ipc_channel = IsotpChannel(
                     bus_name="ipc_bus",
                     request_id=0x0714,
                     response_id=0x077E,
                     padding=Padding.PADDING_ENABLED
-                ))
+                )
+                ipc_sock = IsotpSocket(session, ipc_channel)
 
                 st.markdown("🔍 Reading IPC VIN and Part Number...")
                 vin_hex = send_request(ipc_sock, "22F190", "62F190")
-                vin = decode_utf8(vin_hex) if vin_hex else "Unknown"
+                vin = decode_text(vin_hex) if vin_hex else "Unknown"
                 partnr_hex = send_request(ipc_sock, "22F19E", "62F19E")
-                partnr = decode_utf8(partnr_hex) if partnr_hex else "Unknown"
+                partnr = decode_text(partnr_hex) if partnr_hex else "Unknown"
 
                 col1, col2 = st.columns(2)
                 col1.markdown(f"**VIN:** `{vin}`")
@@ -377,18 +442,22 @@ with tabs[3]:
                 st.markdown("⚙️ Entering Diagnostic Session...")
                 diag_result = send_request(ipc_sock, "1003", "50")
                 st.success("✅ Extended session OK") if diag_result else st.error("❌ Failed to enter diagnostic session")
+                if diag_result is not None:
+                    keepalive.register(ipc_sock, ipc_channel)
 
                 #st.markdown("---")
                 st.markdown("🔧 Sending IPC reset sequence...")
 
                 def show_cmd_result(cmd, expected_prefix, label):
-                    resp = send_request(ipc_sock, cmd, expected_prefix)
-                    if resp is not None:
-                        st.success(f"✅ {label} acknowledged")
-                        return True
-                    else:
-                        st.error(f"❌ {label} failed")
+                    try:
+                        with keepalive.busy(ipc_sock):
+                            request_payload(ipc_sock, cmd, expected_prefix)
+                    except RequestFailure as e:
+                        logging.warning(f"IPC {label} failed: {e}")
+                        st.error(f"❌ {label} failed ({e.summary})")
                         return False
+                    st.success(f"✅ {label} acknowledged")
+                    return True
 
                 results = {
                     "F198 Write": show_cmd_result("2EF1988000000CC333", "6EF198", "Write to F198"),
@@ -402,12 +471,14 @@ with tabs[3]:
                 else:
                     st.warning("⚠️ Some IPC reset steps failed. Review communication status above.")
 
-                ipc_sock.stop_stream()
+                keepalive.stop_stream(ipc_sock)
                 session.finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
 
             except Exception as e:
                 logging.error(f"IPC Reset Error: {e}")
                 st.error(f"❌ IPC Reset failed: {e}")
+                if ipc_sock:
+                    keepalive.unregister(ipc_sock)
 
 
 
@@ -417,31 +488,6 @@ with tabs[3]:
 
 
 
-    # Exit session management
-with st.expander("🚪 Exit Session OpenOBD (if stuck...)"):
-    openobd = OpenOBD()
-    session_list = openobd.get_session_list()
-
-    if not session_list.sessions:
-        st.success("✅ No active OpenOBD sessions.")
-    else:
-        st.warning("⚠️ Active OpenOBD sessions detected:")
-        session_display = [
-            f"{i + 1}. ID: {s.id} | State: {s.state} | Created: {s.created_at}"
-            for i, s in enumerate(session_list.sessions)
-        ]
-        selected_display = st.multiselect("Select session(s) to close:", options=session_display)
-
-        if selected_display:
-            for display in selected_display:
-                try:
-                    idx = int(display.split(".")[0]) - 1
-                    sid = session_list.sessions[idx].id
-                    openobd.interrupt_session(session_id=SessionId(value=sid))
-                    st.success(f"✅ Session {sid} closed.")
-                except Exception as e:
-                    st.error(f"❌ Failed to close session: {e}")
-
-    if st.button("Logout and Exit"):
-        st.success("👋 Logged out. Application will now exit.")
-        st.stop()
\ No newline at end of file
+# Exit session management
+render_performance_expander()
+render_exit_session_expander(get_openobd)
@@ -1,184 +1,43 @@
-import binascii
-import json
 import logging
-import os
-import io
-import gspread
 import pandas as pd
 import streamlit as st
-import matplotlib.pyplot as plt
 from datetime import datetime
 from pytz import timezone
-from matplotlib.backends.backend_pdf import PdfPages
-from gspread_dataframe import set_with_dataframe, get_as_dataframe
-from oauth2client.service_account import ServiceAccountCredentials
 from openobd import *
-from PIL import Image
+from session_admin import render_exit_session_expander
+from session_trace import openobd_client
+from perf import operation, phase, render_performance_expander, timed_iter
+from metrics import start_metrics_server
+from sheets import append_new_sheet3_versions, get_google_sheet, load_sheet3_db, save_data_to_google_sheets
+from scan_stream import ModuleLatencyHistory, configure_vag_buses, read_vehicle_vin, scan_modules
+from snapshot_store import SnapshotStore
+from vag_modules import all_modules, registry
+from vag_vehicle import guess_vag_platform
+from scan_records import MISSING, VersionComparison, report_rows, to_frame
+from version_catalog import NEWER, OLDER, VersionCatalog
+from scan_client import SCAN_SERVICE_URL, ScanServiceClient
+from report_worker import report_worker, report_download_button
+from fleet_analytics import FleetStore
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
 logging.info("Author: yayra.osias@lkqbelgium.be")
 logging.info("VAG Information Retrieval")
+start_metrics_server(9101)
 
-google_credentials_str = os.getenv("GOOGLE_DRIVE_CREDENTIALS")
-
-if not google_credentials_str:
-    print("❌ ERROR: Missing Google Drive Credentials! Set 'GOOGLE_DRIVE_CREDENTIALS' in Replit Secrets.")
-    exit(1)
-
-GOOGLE_CREDENTIALS = json.loads(google_credentials_str)
-
-
-
-#########################################################
-# Load Google Drive credentials
-#credentials_str = st.secrets["GOOGLE_DRIVE_CREDENTIALS"]
-#if not credentials_str:
-    #st.error("❌ Missing Google Drive Credentials!")
-    #st.stop()
-#GOOGLE_CREDENTIALS = json.loads(credentials_str)
-#######################################################
-
-
-
-# Authenticate Google Drive
-def authenticate_google_drive():
-    scopes = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    credentials = ServiceAccountCredentials.from_json_keyfile_dict(GOOGLE_CREDENTIALS, scopes)
-    return gspread.authorize(credentials)
-
-# Get worksheet
-def get_google_sheet(sheet_name, worksheet_name):
-    try:
-        client = authenticate_google_drive()
-        sheet = client.open(sheet_name).worksheet(worksheet_name)
-        return sheet
-    except gspread.exceptions.WorksheetNotFound:
-        st.warning(f"⚠ Worksheet '{worksheet_name}' not found. Creating it...")
-        sheet = client.open(sheet_name).add_worksheet(title=worksheet_name, rows="1000", cols="20")
-        return sheet
-    except Exception as e:
-        st.error(f"❌ ERROR accessing Google Sheets: {e}")
-        st.stop()
-
-# Save data to Google Sheets
-def save_data_to_google_sheets(data, sheet_name, worksheet_name):
-    try:
-        if not data:
-            return
-        timestamp = datetime.now(timezone("Europe/Brussels")).strftime("%Y-%m-%d %H:%M:%S")
-        for entry in data:
-            entry["Timestamp"] = timestamp
-        df_new = pd.DataFrame(data)
-        df_new.fillna("N/A", inplace=True)
-        sheet = get_google_sheet(sheet_name, worksheet_name)
-        existing_data = get_as_dataframe(sheet, evaluate_formulas=True, header=0)
-        existing_data.dropna(how="all", inplace=True)
-        combined_data = pd.concat([existing_data, df_new], ignore_index=True)
-        set_with_dataframe(sheet, combined_data)
-        st.success(f"✅ Data saved to {worksheet_name}")
-        st.session_state["last_scan_raw"] = data
-        if data:
-            vin = next((item["VIN"] for item in data if "VIN" in item), "N/A")
-            st.session_state["last_vin"] = vin
-            st.session_state["last_modules"] = [entry.get("Module", "") for entry in data]
-    except Exception as e:
-        st.error(f"❌ ERROR saving data to {worksheet_name}: {e}")
-
-# Load Sheet3 database
-def load_sheet3_db(sheet_name, worksheet_name):
-    try:
-        sheet = get_google_sheet(sheet_name, worksheet_name)
-        db = pd.DataFrame(sheet.get_all_records())
-        db.fillna("", inplace=True)
-        return db
-    except Exception as e:
-        st.error(f"❌ ERROR loading Sheet3 database: {e}")
-        return pd.DataFrame()
-
-# Update Sheet3 dynamically if needed
-def update_sheet3_if_needed(sheet_name, worksheet_name, comparison_data):
-    sheet3 = get_google_sheet(sheet_name, worksheet_name)
-    existing_df = pd.DataFrame(sheet3.get_all_records())
-    existing_df.fillna("", inplace=True)
-
-    # Normalize types to strings
-    existing_df["VAG Part Number"] = existing_df["VAG Part Number"].astype(str)
-    existing_df["Available Versions"] = existing_df["Available Versions"].astype(str)
-
-    to_add = []
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    for entry in comparison_data:
-        part_no = str(entry["VAG Part Number"])
-        versions = entry.get("Available Versions", "")
-        version_list = [v.strip() for v in versions.split(",") if v.strip().isdigit()]
-
-        for version in version_list:
-            match = existing_df[
-                (existing_df["VAG Part Number"] == part_no) &
-                (existing_df["Available Versions"] == version)
-            ]
-            if match.empty:
-                to_add.append({
-                    "VAG Part Number": part_no,
-                    "Available Versions": version,
-                    "Timestamp": timestamp
-                })
-
-    if to_add:
-        st.info("➕ Updating Sheet3 with new entries...")
-        updated_df = pd.concat([existing_df, pd.DataFrame(to_add)], ignore_index=True)
-        set_with_dataframe(sheet3, updated_df)
-        st.success("✅ Sheet3 updated.")
-    else:
-        st.info("✅ Sheet3 already contains all entries. No update needed.")
+# Clients are created once per server process through st.cache_resource instead of on every
+# script rerun; the Sheets helpers live in sheets.py.
+@st.cache_resource
+def get_openobd():
+    return openobd_client()
 
+@st.cache_resource
+def get_snapshot_store():
+    return SnapshotStore()
 
 
 ##############################################################
 
-# Define modules
-all_modules = {
-    "01_ECM": {"request_id": 0x07E0, "response_id": 0x07E8}, # 0x0710, 0x077A (new models golf 8)
-    "51_E_Drivetrain": {"request_id": 0x17FC007C, "response_id":0x17FE007C, "skip_1003": True},
-    "03_ABS_ESP": {"request_id": 0x0713, "response_id": 0x077D},
-    "C6_EV_OBC": {"request_id": 0x0744, "response_id": 0x07AE},
-    "23_BKV": {"request_id": 0x073B, "response_id": 0x07A5},
-    "16_Steering Wheel": {"request_id": 0x070C, "response_id": 0x0776},
-    "15_SRS_Airbag": {"request_id": 0x0715, "response_id": 0x077F},
-    "23_EBKV": {"request_id": 0x073B, "response_id": 0x07A5},
-    "75_SOS-MODULE": {"request_id": 0x0767, "response_id": 0x07D1},
-    "44_EPS": {"request_id": 0x0712, "response_id": 0x077C},
-    "AC_SCR": {"request_id": 0x0794, "response_id": 0x072A},
-    #"8C_BECM": {"request_id": 0x07ED, "response_id": 0x07E5},
-    "55_AFS_LIGHT": {"request_id": 0x0754, "response_id": 0x07BE},
-    "02_TCM": {"request_id": 0x07E1, "response_id": 0x07E9},
-    "17_IPC": {"request_id": 0x0714, "response_id": 0x077E},
-    "19_GTW": {"request_id": 0x0710, "response_id": 0x077A},
-    "09_BCM": {"request_id": 0x070E, "response_id": 0x0778},
-    "15_SRS": {"request_id": 0x0715, "response_id": 0x077F},
-    "13_ACC": {"request_id": 0x0757, "response_id": 0x07C1},
-    "A5_FRONTSENSORS": {"request_id": 0x074F, "response_id": 0x07B9},
-}
-
-# Decode response helper
-def decode_utf8(response):
-    if response and response.startswith("62"):
-        try:
-            return binascii.unhexlify(response[6:]).decode("utf-8").strip()
-        except Exception:
-            return "N/A"
-    return "No response"
-
-def get_valid_response(socket, command, tries=2, timeout=5):
-    responses = socket.request_multiple(command, tries=tries, timeout=timeout)
-    for r in responses:
-        if r and r.startswith("62"):
-            return r
-    return None
-
-
 st.title("🚗 VAG Module Scanner")
 st.write("Scan VAG vehicle modules and log data to the cloud.")
 
@@ -186,292 +45,252 @@ ticket_id = st.text_input("Enter Remote Ticket ID", "", max_chars=20)
 
 if ticket_id and ticket_id.isdigit():
     scan_mode = st.radio("Select Scan Mode:", ["Full Scan", "Scan by Module"])
-    selected_modules = {}
+    selected_keys = []
 
     if scan_mode == "Full Scan":
-        selected_modules = all_modules
+        selected_keys = list(all_modules)
     elif scan_mode == "Scan by Module":
         selected_keys = st.multiselect("Choose modules to scan:", options=list(all_modules.keys()))
-        selected_modules = {k: all_modules[k] for k in selected_keys}
+    # Modules sharing an address are read once
+    selected_modules, module_aliases = registry.scan_plan(selected_keys)
+
+    delta_scan = not SCAN_SERVICE_URL and st.checkbox(
+        "⚡ Delta scan (only re-read modules whose part number or software version changed since this car's last scan)"
+    )
 
     if st.button("Run Scan"):
-        try:
-            st.write("Starting OpenOBD Session...")
-            openobd = OpenOBD()
-            openobd_session = openobd.start_session_on_ticket(ticket_id)
-            SessionTokenHandler(openobd_session)
-
-            bus_config = BusConfiguration(
-                bus_name="VAG_bus",
-                can_bus=CanBus(
-                    pin_plus=6,
-                    pin_min=14,
-                    can_protocol=CanProtocol.CAN_PROTOCOL_ISOTP,
-                    can_bit_rate=CanBitRate.CAN_BIT_RATE_500,
-                    transceiver=TransceiverSpeed.TRANSCEIVER_SPEED_HIGH,
-                ),
-            )
-            StreamHandler(openobd_session.configure_bus).send_and_close([bus_config])
-            st.success("✅ CAN bus configured.")
-
-            sheet3_db = load_sheet3_db("VAG_data", "Sheet3")
-
-            def decode_utf8(response):
-                if response and not response.startswith("7F"):
-                    try:
-                        return binascii.unhexlify(response[6:]).decode("utf-8").strip()
-                    except Exception:
-                        return "N/A"
-                return "No response"
-
-            def check_sheet3_versions(part_number):
-                rows = sheet3_db[sheet3_db["VAG Part Number"] == part_number]
-                if rows.empty:
-                    return []
-
-                # Ensure we're working with a clean Series
-                versions_series = pd.Series(rows["Available Versions"])
-                versions_clean = versions_series.dropna().astype(str).unique().tolist()
-
-                try:
-                    # Sort versions numerically if possible
-                    return sorted(versions_clean, key=lambda x: int(x))
-                except ValueError:
-                    # Fall back to alphanumeric sort
-                    return sorted(versions_clean)
-
-
-
-            raw_data = []
-            version_data = []
-
-            for module_name, module_info in selected_modules.items():
-                st.write(f"\n===== Scanning {module_name} =====")
-                try:
-                    channel = IsotpChannel(
-                        bus_name="VAG_bus",
-                        request_id=module_info["request_id"],
-                        response_id=module_info["response_id"],
-                        padding=Padding.PADDING_ENABLED,
-                    )
-                    module_socket = IsotpSocket(openobd_session, channel)
-                    if not module_info.get("skip_1003"):
-                        module_socket.request("1003", tries=2, timeout=5)
-
-                    module_entry = {"Module": module_name}
-                    part_no = ""
-                    sw_ver = ""
-
-                    for label, cmd in {"VIN": "22F190", "VAG Part Number": "22F187", "Software Version": "22F189"}.items():
-                        response = module_socket.request(cmd, tries=2, timeout=5)
-                        decoded = decode_utf8(response)
-                        module_entry[label] = decoded
-                        if label == "VAG Part Number":
-                            part_no = decoded
-                        if label == "Software Version":
-                            sw_ver = decoded
+        with operation("Run Scan"):
+            try:
+                openobd_session = None
+                snapshot_vin = None
+                previous_modules = None
+                scan_details = None
+                if SCAN_SERVICE_URL:
+                    st.write("Submitting scan to the scan service...")
+                    scan_events = ScanServiceClient(SCAN_SERVICE_URL).scan(ticket_id, list(selected_modules))
+                else:
+                    st.write("Starting OpenOBD Session...")
+                    with phase("Session setup"):
+                        openobd = get_openobd()
+                        openobd_session = openobd.start_session_on_ticket(ticket_id)
+                        SessionTokenHandler(openobd_session)
+
+                    with phase("Bus config"):
+                        buses = configure_vag_buses(openobd_session)
+                    st.success(f"✅ CAN buses configured: {', '.join(buses)}")
+                    if delta_scan:
+                        snapshot_vin = read_vehicle_vin(openobd_session, all_modules["01_ECM"])
+                        if snapshot_vin:
+                            selected_modules, module_aliases = registry.scan_plan(selected_keys, guess_vag_platform(snapshot_vin))
+                            previous_modules = SnapshotStore.module_results(get_snapshot_store().load(snapshot_vin))
+                            scan_details = {}
+                            st.info(f"⚡ Delta scan for {snapshot_vin}: {len(previous_modules)} modules in the last snapshot")
+                        else:
+                            st.warning("⚠ VIN not readable from the ECM, running a full scan.")
+                    scan_events = scan_modules(openobd_session, selected_modules, buses, previous_modules, scan_details, snapshot_vin)
+                if module_aliases:
+                    st.caption("Same address, read once: " + ", ".join(
+                        f"{name} ({', '.join(skipped)})" for name, skipped in module_aliases.items()))
+
+                with phase("Sheet3 load"):
+                    version_catalog = VersionCatalog.from_frame(load_sheet3_db("VAG_data", "Sheet3"))
+                new_versions = []
+
+                raw_data = []
+                version_data = []
+                unchanged_modules = set()
+                failed_modules = []
+
+                # Live results: status chips, progress with ETA and a table that grows per module
+                latency_history = ModuleLatencyHistory()
+                module_status = {name: "⏳" for name in selected_modules}
+                pending_modules = list(selected_modules)
+                chips_placeholder = st.empty()
+                progress_bar = st.progress(0.0, text="Starting scan...")
+                table_placeholder = st.empty()
+
+                def render_status_chips():
+                    chips_placeholder.markdown("  ".join(f"`{status} {name}`" for name, status in module_status.items()))
+
+                render_status_chips()
+
+                for event, module_name, result, elapsed in timed_iter(scan_events, "ECU I/O"):
+                    if event == "started":
+                        module_status[module_name] = "🔄"
+                        render_status_chips()
+                        continue
+
+                    pending_modules.remove(module_name)
+                    latency_history.record(module_name, elapsed)
+                    done = len(selected_modules) - len(pending_modules)
+                    eta = latency_history.remaining(pending_modules)
+                    progress_bar.progress(done / len(selected_modules), text=f"{done}/{len(selected_modules)} modules | ETA {eta:.0f}s")
+
+                    if event == "failed":
+                        module_status[module_name] = "❌"
+                        failed_modules.append(module_name)
+                        render_status_chips()
+                        st.error(f"❌ Error during communication with {module_name}: {result}")
+                        continue
+
+                    module_status[module_name] = "♻️" if event == "unchanged" else "✅"
+                    render_status_chips()
+                    module_entry = result
+                    part_no = module_entry.part_number
+                    sw_ver = module_entry.software_version
 
                     raw_data.append(module_entry)
+                    with phase("DataFrame"):
+                        table_placeholder.dataframe(to_frame(raw_data, missing=MISSING), use_container_width=True)
+                    if event == "unchanged":
+                        # Same software as in the last scan: already compared and logged then
+                        unchanged_modules.add(module_name)
+                        continue
 
                     if part_no and sw_ver:
-                        available_versions = check_sheet3_versions(part_no)
+                        available_versions = version_catalog.versions(part_no)
+                        latest = version_catalog.latest(part_no)
+                        status = version_catalog.compare(part_no, sw_ver)
 
                         if available_versions:
-                            
-                            # Cast versions to integers only if they are digit strings
-                            numeric_versions = [int(v) for v in available_versions if v.isdigit()]
-                            current_version_int = int(sw_ver) if sw_ver.isdigit() else None
-
-                            if numeric_versions and current_version_int is not None:
-                                highest_version = max(numeric_versions)
-                                is_newer = current_version_int > highest_version
-                                is_older = current_version_int < highest_version
-                                highest_version_display = str(highest_version)
-                            else:
-                                highest_version = "N/A"
-                                is_newer = False
-                                is_older = False
-                                highest_version_display = "N/A"
-
-                            comparison_entry = {
-                                "VAG Part Number": part_no,
-                                "Current Version": sw_ver,
-                                "Available Versions": ", ".join(available_versions),
-                                "Highest Known Version": highest_version_display,
-                                "Note": "⚠️ Vehicle version is newer!" if is_newer else "",
-
-                            }
+                            comparison_entry = VersionComparison(
+                                part_number=part_no,
+                                current_version=sw_ver,
+                                available_versions=tuple(available_versions),
+                                highest_known_version=latest,
+                                note=(
+                                    "⚠️ Vehicle version is newer!" if status == NEWER else
+                                    f"✅ Update available: {latest}" if status == OLDER else ""
+                                ),
+                            )
 
                             info_msg = (
                                 f"📢 {part_no} | Current: {sw_ver} | "
                                 f"Available: {', '.join(available_versions)} | "
-                                f"Highest: {highest_version_display}"
+                                f"Highest: {latest}"
                             )
 
-                            if is_newer:
+                            if status == NEWER:
                                 info_msg += " 🔺 Vehicle version is newer than Sheet3!"
-                            elif is_older:
-                                info_msg += f" ✅ ECU can be updated to version {highest_version_display}"
+                            elif status == OLDER:
+                                info_msg += f" ✅ ECU can be updated to version {latest}"
 
                             st.info(info_msg)
 
                         else:
-                            comparison_entry = {
-                                "VAG Part Number": part_no,
-                                "Current Version": sw_ver,
-                                "Available Versions": ", ".join(available_versions),
-                                "Highest Known Version": highest_version_display,
-                                "Note": (
-                                    "⚠️ Vehicle version is newer!" if is_newer else
-                                    f"✅ Update available: {highest_version_display}" if is_older else ""
-                                )
-                            }
-
+                            comparison_entry = VersionComparison(part_number=part_no, current_version=sw_ver)
                             st.warning(f"📢 {part_no} | Current: {sw_ver} | No known versions in Sheet3.")
 
+                        if version_catalog.observe(part_no, sw_ver):
+                            new_versions.append((part_no, sw_ver))
                         version_data.append(comparison_entry)
 
-                    module_socket.stop_stream()
-
-                except Exception as e:
-                    st.error(f"❌ Error during communication with {module_name}: {e}")
+                latency_history.save()
+                progress_bar.progress(1.0, text="Scan finished.")
 
-            if raw_data:
-                save_data_to_google_sheets(raw_data, "VAG_data", "Sheet1")
-            if version_data:
-                save_data_to_google_sheets(version_data, "VAG_data", "Sheet2")
-                update_sheet3_if_needed("VAG_data", "Sheet3", version_data)
-                st.session_state["last_versions"] = version_data
+                if raw_data:
+                    st.session_state["last_scan_raw"] = raw_data
+                    st.session_state["last_vin"] = next((m.vin for m in raw_data if m.vin), "N/A")
+                    st.session_state["last_modules"] = [m.module for m in raw_data]
+                if snapshot_vin:
+                    scanned_at = datetime.now(timezone("Europe/Brussels")).strftime("%Y-%m-%d %H:%M:%S")
+                    with phase("Snapshot"):
+                        changes = get_snapshot_store().save(snapshot_vin, raw_data, scan_details, scanned_at, failed_modules)
+                    st.subheader("🔀 Changes since the last scan")
+                    if changes:
+                        st.dataframe(pd.DataFrame(changes), hide_index=True)
+                    else:
+                        st.info("No changes since the last scan.")
+                # Unchanged modules are already in Sheet1 from the scan that first saw them
+                changed_data = [m for m in raw_data if m.module not in unchanged_modules]
+                if changed_data:
+                    save_data_to_google_sheets(changed_data, "VAG_data", "Sheet1")
+                if version_data:
+                    save_data_to_google_sheets(version_data, "VAG_data", "Sheet2")
+                    append_new_sheet3_versions("VAG_data", "Sheet3", new_versions)
+                    st.session_state["last_versions"] = version_data
 
 
-            openobd_session.finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
-            st.success("✅ Module info request completed.")
+                if openobd_session:
+                    openobd_session.finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
+                st.success("✅ Module info request completed.")
 
-        except Exception as e:
-            st.error(f"❌ Failed to complete scan: {e}")
+            except Exception as e:
+                st.error(f"❌ Failed to complete scan: {e}")
 
 
 
 
 def export_scan_to_pdf():
+    from scan_report import render_scan_report  # fpdf pulls in PIL; load it on first export only
+
     raw = st.session_state.get("last_scan_raw", [])
     if not raw:
         st.warning("No scan data available yet.")
         return
 
-    df = pd.DataFrame(raw)
-
-    # Include version comparison if available
-    if "last_versions" in st.session_state:
-        version_df = pd.DataFrame(st.session_state["last_versions"])
-        if not version_df.empty:
-            df = pd.merge(df, version_df, on="VAG Part Number", how="left")
+    # Attach the version comparison (if available) to each module row
+    rows = report_rows(raw, st.session_state.get("last_versions", []))
 
-    pdf_buffer = io.BytesIO()
-    with PdfPages(pdf_buffer) as pdf:
-        fig, ax = plt.subplots(figsize=(8.5, 11))
-        ax.axis('off')
+    report_key = report_worker.submit(
+        render_scan_report,
+        rows,
+        vin=st.session_state.get("last_vin", "N/A"),
+        modules=list(st.session_state.get("last_modules", [])),
+    )
+    report_download_button(
+        report_key,
+        label="📥 Download PDF",
+        file_name=f"vag_scan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+    )
 
-        # Optional logo
-        logo_path = "logo2.png"
-        if os.path.exists(logo_path):
-            img = Image.open(logo_path)
-            ax.imshow(img, aspect='auto', extent=[0, 1, 0.9, 1.1], zorder=-1, alpha=0.6)
 
-        # Header
-        header = f"Scan Report\nVIN: {st.session_state.get('last_vin', 'N/A')}\nModules: {', '.join(st.session_state.get('last_modules', []))}"
-        ax.text(0.5, 1.02, header, ha='center', fontsize=10, transform=ax.transAxes)
+@st.cache_resource
+def get_fleet_store():
+    return FleetStore()
 
-        # Clean columns
-        display_columns = [col for col in df.columns if col not in ["Timestamp"]]
-        display_df = df[display_columns]
 
-        table = ax.table(cellText=display_df.values, colLabels=display_df.columns, loc='center')
-        table.scale(1, 1.5)
-        pdf.savefig(fig)
-        plt.close()
+# Fleet analytics over all scans logged to Sheet1/Sheet2
+with st.expander("📊 Fleet Analytics"):
+    fleet = get_fleet_store()
+    if st.button("🔄 Sync scan history"):
+        with st.spinner("Fetching new rows from Google Sheets..."):
+            new_modules = fleet.sync_worksheet(get_google_sheet("VAG_data", "Sheet1"), "modules")
+            new_versions = fleet.sync_worksheet(get_google_sheet("VAG_data", "Sheet2"), "versions")
+        st.success(f"✅ Ingested {new_modules} module rows and {new_versions} version rows")
 
-    st.download_button(
-        label="📥 Download PDF",
-        data=pdf_buffer.getvalue(),
-        file_name=f"vag_scan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-        mime="application/pdf"
-    )
+    outdated = fleet.outdated_rates_by_brand()
+    if not outdated:
+        st.info("No scan history ingested yet.")
+    else:
+        st.subheader("Outdated ECUs per brand")
+        st.dataframe(pd.DataFrame(
+            [{"Brand": brand, "Outdated": o, "Modules": total, "Outdated %": round(rate * 100, 1)}
+             for brand, (o, total, rate) in sorted(outdated.items())]
+        ), hide_index=True)
+
+        st.subheader("Version distribution")
+        distribution = fleet.version_distribution()
+        part = st.selectbox("VAG Part Number", sorted(distribution))
+        if part:
+            st.bar_chart(pd.DataFrame(distribution[part], columns=["Version", "Count"]).set_index("Version"))
+
+        st.subheader("Module presence per platform")
+        presence = fleet.module_presence_by_platform()
+        platform = st.selectbox("Platform (VIN model code)", sorted(presence))
+        if platform:
+            stats = presence[platform]
+            st.caption(f"{stats['vehicles']} vehicles")
+            st.dataframe(pd.DataFrame(
+                [{"Module": m, "Present %": round(rate * 100, 1)} for m, rate in stats["modules"].items()]
+            ), hide_index=True)
 
 
 # PDF Export toggle
 if st.checkbox("📄 Export last scan to PDF (if available)"):
-    def export_scan_to_pdf():
-        raw = st.session_state.get("last_scan_raw", [])
-        if not raw:
-            st.warning("No scan data available yet.")
-            return
-
-        df = pd.DataFrame(raw)
-
-        # Merge with version comparison if available
-        if "last_versions" in st.session_state:
-            version_df = pd.DataFrame(st.session_state["last_versions"])
-            if not version_df.empty:
-                df = pd.merge(df, version_df, on="VAG Part Number", how="left")
-
-        pdf_buffer = io.BytesIO()
-        with PdfPages(pdf_buffer) as pdf:
-            fig, ax = plt.subplots(figsize=(8.5, 11))
-            ax.axis('off')
-
-            # Optional logo
-            logo_path = "logo2.png"
-            if os.path.exists(logo_path):
-                img = Image.open(logo_path)
-                ax.imshow(img, aspect='auto', extent=[0, 1, 0.9, 1.1], zorder=-1, alpha=0.6)
-
-            header = f"Scan Report\nVIN: {st.session_state.get('last_vin', 'N/A')}\nModules: {', '.join(st.session_state.get('last_modules', []))}"
-            ax.text(0.5, 1.02, header, ha='center', fontsize=10, transform=ax.transAxes)
-
-            display_columns = [col for col in df.columns if col not in ["Timestamp"]]
-            display_df = df[display_columns]
-
-            table = ax.table(cellText=display_df.values, colLabels=display_df.columns, loc='center')
-            table.scale(1, 1.5)
-            pdf.savefig(fig)
-            plt.close()
-
-        st.download_button(
-            label="📥 Download PDF",
-            data=pdf_buffer.getvalue(),
-            file_name=f"vag_scan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-            mime="application/pdf"
-        )
-
-    # Run export
     export_scan_to_pdf()
 
-# Exit session management
-with st.expander("🚪 Exit Session OpenOBD (if stuck...)"):
-    openobd = OpenOBD()
-    session_list = openobd.get_session_list()
+render_performance_expander()
 
-    if not session_list.sessions:
-        st.success("✅ No active OpenOBD sessions.")
-    else:
-        st.warning("⚠️ Active OpenOBD sessions detected:")
-        session_display = [
-            f"{i + 1}. ID: {s.id} | State: {s.state} | Created: {s.created_at}"
-            for i, s in enumerate(session_list.sessions)
-        ]
-        selected_display = st.multiselect("Select session(s) to close:", options=session_display)
-
-        if selected_display:
-            for display in selected_display:
-                try:
-                    idx = int(display.split(".")[0]) - 1
-                    sid = session_list.sessions[idx].id
-                    openobd.interrupt_session(session_id=SessionId(value=sid))
-                    st.success(f"✅ Session {sid} closed.")
-                except Exception as e:
-                    st.error(f"❌ Failed to close session: {e}")
-
-    if st.button("Logout and Exit"):
-        st.success("👋 Logged out. Application will now exit.")
-        st.stop()
+# Exit session management
+render_exit_session_expander(get_openobd)
@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from version_catalog import VersionCatalog, version_key
+from vag_vehicle import guess_vag_brand, guess_vag_platform, is_valid_vin
+
+# Fleet analytics over the scan history in Sheet1 (module readings) and Sheet2 (version
+# comparisons). Sheets are append-only, so each sync only downloads the rows after the last
+# ingested one. New rows are written as Parquet parts (the raw columnar history) and folded
+# into small rollups kept next to them, which answer the dashboard queries without touching
+# the raw rows:
+#   version counts per (part number, software version, brand)
+#   known versions per part number (for "outdated" = older than the latest known version)
+#   distinct VINs per platform and per (platform, module) for module presence rates
+
+FLEET_DIR = os.getenv("FLEET_STORE_DIR", "fleet_store")
+PLACEHOLDERS = {"", "N/A", "NO RESPONSE", "NAN", "NONE"}
+
+
+def _clean(value):
+    text = "" if value is None else str(value).strip()
+    return None if text.upper() in PLACEHOLDERS else text
+
+
+class FleetStore:
+
+    def __init__(self, root=FLEET_DIR):
+        self.root = root
+        self.state_path = os.path.join(root, "state.json")
+        self.rollup_path = os.path.join(root, "rollups.json")
+        os.makedirs(root, exist_ok=True)
+
+        self.offsets = {}
+        self.version_counts = Counter()
+        self.known_versions = defaultdict(set)
+        self.platform_vehicles = defaultdict(set)
+        self.platform_modules = defaultdict(lambda: defaultdict(set))
+        self._load()
+        self._catalog = None
+
+    # === Persistence ===
+
+    def _load(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.offsets = json.load(f).get("offsets", {})
+        if not os.path.exists(self.rollup_path):
+            return
+        with open(self.rollup_path) as f:
+            rollups = json.load(f)
+        for part, version, brand, count in rollups.get("version_counts", []):
+            self.version_counts[(part, version, brand)] = count
+        for part, versions in rollups.get("known_versions", {}).items():
+            self.known_versions[part] = set(versions)
+        for platform, vins in rollups.get("platform_vehicles", {}).items():
+            self.platform_vehicles[platform] = set(vins)
+        for platform, modules in rollups.get("platform_modules", {}).items():
+            for module, vins in modules.items():
+                self.platform_modules[platform][module] = set(vins)
+
+    def save(self):
+        rollups = {
+            "version_counts": [[*key, count] for key, count in self.version_counts.items()],
+            "known_versions": {part: sorted(versions) for part, versions in self.known_versions.items()},
+            "platform_vehicles": {p: sorted(vins) for p, vins in self.platform_vehicles.items()},
+            "platform_modules": {
+                p: {m: sorted(vins) for m, vins in modules.items()} for p, modules in self.platform_modules.items()
+            },
+        }
+        for path, data in ((self.rollup_path, rollups), (self.state_path, {"offsets": self.offsets})):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+
+    def _write_part(self, kind, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        directory = os.path.join(self.root, kind)
+        os.makedirs(directory, exist_ok=True)
+        pq.write_table(pa.table(columns), os.path.join(directory, f"part-{time.time_ns()}.parquet"))
+
+    def history(self, kind="modules"):
+        # Full raw history as a DataFrame; for ad-hoc analysis, the dashboard only uses the rollups
+        import pyarrow.parquet as pq
+
+        directory = os.path.join(self.root, kind)
+        if not os.path.isdir(directory) or not os.listdir(directory):
+            return None
+        return pq.read_table(directory).to_pandas()
+
+    # === Ingest ===
+
+    def ingest_module_rows(self, rows):
+        # Sheet1 rows: Module, VIN, VAG Part Number, Software Version, Timestamp. Rows saved in the
+        # same call share a Timestamp; that scan's vehicle VIN is the VIN most modules reported.
+        scans = defaultdict(list)
+        for row in rows:
+            scans[str(row.get("Timestamp", ""))].append(row)
+
+        columns = defaultdict(list)
+        for scan_id, scan_rows in scans.items():
+            vins = Counter(v for v in (_clean(r.get("VIN")) for r in scan_rows) if is_valid_vin(v))
+            vin = vins.most_common(1)[0][0] if vins else None
+            brand = guess_vag_brand(vin)
+            platform = guess_vag_platform(vin)
+            if vin:
+                self.platform_vehicles[platform].add(vin)
+
+            for row in scan_rows:
+                module = _clean(row.get("Module"))
+                part = _clean(row.get("VAG Part Number"))
+                version = _clean(row.get("Software Version"))
+                if vin and module:
+                    self.platform_modules[platform][module].add(vin)
+                if part and version:
+                    self.version_counts[(part, version, brand)] += 1
+                    self.known_versions[part].add(version)
+                for name, value in (("scan_id", scan_id), ("module", module), ("vin", vin), ("part_number", part),
+                                    ("software_version", version), ("brand", brand), ("platform", platform)):
+                    columns[name].append(value)
+
+        if columns:
+            self._write_part("modules", columns)
+        self._catalog = None
+        return len(rows)
+
+    def ingest_version_rows(self, rows):
+        # Sheet2 rows only add to the known versions of each part
+        columns = defaultdict(list)
+        for row in rows:
+            part = _clean(row.get("VAG Part Number"))
+            if not part:
+                continue
+            versions = [_clean(v) for v in str(row.get("Available Versions", "")).split(",")]
+            versions += [_clean(row.get("Highest Known Version")), _clean(row.get("Current Version"))]
+            self.known_versions[part].update(v for v in versions if v)
+            columns["part_number"].append(part)
+            columns["current_version"].append(_clean(row.get("Current Version")))
+            columns["highest_known_version"].append(_clean(row.get("Highest Known Version")))
+            columns["timestamp"].append(str(row.get("Timestamp", "")))
+
+        if columns:
+            self._write_part("versions", columns)
+        self._catalog = None
+        return len(rows)
+
+    def sync_worksheet(self, worksheet, kind):
+        # Downloads and ingests only the rows appended since the previous sync
+        key = f"{worksheet.title}:{kind}"
+        offset = self.offsets.get(key, 0)
+        header = worksheet.row_values(1)
+        values = worksheet.get(f"A{offset + 2}:{_column_letter(len(header))}") if header else []
+        rows = [dict(zip(header, v)) for v in values if any(v)]
+        if not values:
+            return 0
+        ingest = self.ingest_module_rows if kind == "modules" else self.ingest_version_rows
+        ingest(rows)
+        self.offsets[key] = offset + len(values)
+        self.save()
+        logging.info(f"Fleet store: ingested {len(rows)} new {kind} rows from {worksheet.title}")
+        return len(rows)
+
+    # === Queries (rollups only) ===
+
+    @property
+    def catalog(self):
+        if self._catalog is None:
+            self._catalog = VersionCatalog()
+            for part, versions in self.known_versions.items():
+                for version in versions:
+                    self._catalog.observe(part, version)
+        return self._catalog
+
+    def version_distribution(self, part_number=None):
+        distribution = defaultdict(Counter)
+        for (part, version, brand), count in self.version_counts.items():
+            if part_number is None or part == part_number:
+                distribution[part][version] += count
+        return {
+            part: sorted(counts.items(), key=lambda item: version_key(item[0]))
+            for part, counts in distribution.items()
+        }
+
+    def outdated_rates_by_brand(self):
+        # Share of module readings running an older version than the latest one known for their part
+        totals = Counter()
+        outdated = Counter()
+        catalog = self.catalog
+        for (part, version, brand), count in self.version_counts.items():
+            totals[brand] += count
+            latest = catalog.latest(part)
+            if latest and version_key(version) < version_key(latest):
+                outdated[brand] += count
+        return {brand: (outdated[brand], total, outdated[brand] / total) for brand, total in totals.items()}
+
+    def module_presence_by_platform(self):
+        # Per platform: number of distinct vehicles and the share of them on which each module answered
+        presence = {}
+        for platform, vins in self.platform_vehicles.items():
+            vehicles = len(vins)
+            presence[platform] = {
+                "vehicles": vehicles,
+                "modules": {
+                    module: len(module_vins) / vehicles
+                    for module, module_vins in sorted(self.platform_modules[platform].items())
+                },
+            }
+        return presence
+
+
+def _column_letter(index):
+    letters = ""
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters or "A"
@@ -1,5 +1,9 @@
 import logging
 from openobd import *
+from uds_codec import decode_counter, decode_text
+from uds_engine import send_request
+from session_trace import openobd_client
+from scan_client import SCAN_SERVICE_URL, ScanServiceClient
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -9,33 +13,12 @@ def log_response(data):
     with open(log_file, "a") as f:
         f.write(data + "\n")
 
-def send_request(cng, command, expected_prefix):
-    try:
-        response = cng.request(command, silent=True)
-        logging.info(f"Response: {response}")
-        if response.startswith(expected_prefix):
-            return response[len(expected_prefix):]
-        return None
-    except ResponseException as e:
-        logging.error(f"Request failed: {e}")
-        return None
-    except Exception as e:
-        logging.error(f"Unexpected error: {e}")
-        return None
-
-def decode_utf8(hex_str):
-    try:
-        bytes_data = bytes.fromhex(hex_str)
-        return bytes_data.decode('utf-8').strip('\x00')
-    except Exception:
-        return "[Decode Error]"
-
 def perform_cng_reset(ticket_id):
     cng = None
     session = None
 
     try:
-        openobd = OpenOBD()
+        openobd = openobd_client()
         session = openobd.start_session_on_ticket(ticket_id)
         SessionTokenHandler(session)
 
@@ -62,8 +45,8 @@ def perform_cng_reset(ticket_id):
         # Step 1: Request VIN and Software Version
         vin_hex = send_request(cng, "22F19E", "62F19E")
         sw_hex = send_request(cng, "22F1A2", "62F1A2")
-        vin = decode_utf8(vin_hex) if vin_hex else "Unknown"
-        sw = decode_utf8(sw_hex) if sw_hex else "Unknown"
+        vin = decode_text(vin_hex, default="[Decode Error]") if vin_hex else "Unknown"
+        sw = decode_text(sw_hex, default="[Decode Error]") if sw_hex else "Unknown"
         logging.info(f"VIN: {vin}")
         logging.info(f"Software Version: {sw}")
         log_response(f"VIN: {vin}")
@@ -81,7 +64,7 @@ def perform_cng_reset(ticket_id):
 
         # Step 4: Read service data before reset
         initial_service = send_request(cng, "220C38", "620C38")
-        log_response(f"Initial Service Counter: {initial_service}")
+        log_response(f"Initial Service Counter: {decode_counter(initial_service)}")
 
         # Step 5: Send the actual reset command
         reset_resp = send_request(cng, "2E0C3401", "6E0C34")
@@ -91,7 +74,7 @@ def perform_cng_reset(ticket_id):
 
         # Step 6: Confirm reset
         confirm_service = send_request(cng, "220C38", "620C38")
-        log_response(f"Post-reset Service Counter: {confirm_service}")
+        log_response(f"Post-reset Service Counter: {decode_counter(confirm_service)}")
 
         print("\033[92mCNG Service Reset successfully performed!\033[0m")
         return True
@@ -114,7 +97,11 @@ if __name__ == "__main__":
         print("\033[91mInvalid Ticket ID. Must be numeric.\033[0m")
     else:
         print("\nStarting reset process...\n")
-        success = perform_cng_reset(ticket)
+        if SCAN_SERVICE_URL:
+            # Let the scan service do the vehicle I/O, this script only follows the job
+            success = ScanServiceClient(SCAN_SERVICE_URL).run("cng_service_reset", ticket_id=ticket)["success"]
+        else:
+            success = perform_cng_reset(ticket)
         print("\n=== RESULT ===")
         if success:
             print("\033[92mCNG Reset Completed Successfully.\033[0m")
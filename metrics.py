@@ -0,0 +1,220 @@
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from openobd import *
+
+# Process-wide counters and histograms in the Prometheus text format. Every app process serves
+# them on its own local port (GET /metrics); scan_service adds /metrics to its Tornado app instead.
+#   METRICS=0            no endpoint (the counters are still kept, they cost a lock and an add)
+#   METRICS_HOST         bind address, 127.0.0.1 by default
+#   METRICS_PORT         overrides the app's default port
+
+METRICS_ENABLED = os.getenv("METRICS", "1") != "0"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in values]
+        return lines
+
+
+class _Timer:
+    # histogram.time(...) as a context manager or decorator; as a decorator every call gets its own timer
+
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(self._histogram, self._labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += seconds
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        series = self._series.get(tuple(str(labels.get(name, "")) for name in self.labels))
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), values[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {values[-1]:.6f}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {cumulative}")
+        return lines
+
+
+SESSIONS_STARTED = Counter("vag_sessions_started_total", "OpenOBD sessions started")
+SESSIONS_FINISHED = Counter("vag_sessions_finished_total", "OpenOBD sessions finished, by service result", ["result"])
+UDS_REQUESTS = Counter("vag_uds_requests_total", "UDS requests by ECU request ID, service and outcome",
+                       ["ecu", "service", "outcome"])
+UDS_LATENCY = Histogram("vag_uds_request_seconds", "UDS request latency until the final answer", ["service"])
+UDS_NRCS = Counter("vag_uds_nrc_total", "Negative response codes received", ["service", "nrc"])
+SHEETS_LATENCY = Histogram("vag_sheets_request_seconds", "Google Sheets API call duration", ["operation"], SLOW_BUCKETS)
+REPORT_RENDER = Histogram("vag_report_render_seconds", "PDF report render time", ["report"], SLOW_BUCKETS)
+REGISTRY = [SESSIONS_STARTED, SESSIONS_FINISHED, UDS_REQUESTS, UDS_LATENCY, UDS_NRCS, SHEETS_LATENCY, REPORT_RENDER]
+
+
+def record_uds_request(channel, command, seconds, outcome):
+    # seconds: time to the final answer, None when there was none (timeouts would skew the latency)
+    service = command[:2].upper()
+    UDS_REQUESTS.inc(ecu=f"{channel.request_id:X}" if channel is not None else "", service=service, outcome=outcome)
+    if seconds is not None:
+        UDS_LATENCY.observe(seconds, service=service)
+
+
+def record_nrc(command, nrc):
+    UDS_NRCS.inc(service=command[:2].upper(), nrc=f"{nrc:02X}")
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# === Session counting ===
+
+class MeteredSession:
+
+    def __init__(self, session):
+        self._session = session
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def finish(self, service_result):
+        outcome = Result.Name(service_result.result[0]) if service_result.result else "UNKNOWN"
+        SESSIONS_FINISHED.inc(result=outcome)
+        return self._session.finish(service_result)
+
+
+class MeteredOpenOBD:
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def start_session_on_ticket(self, ticket_id):
+        session = self._client.start_session_on_ticket(ticket_id)
+        SESSIONS_STARTED.inc()
+        return MeteredSession(session)
+
+
+# === Endpoint ===
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the app log
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port):
+    # Once per process; Streamlit reruns and a port already taken by another process are harmless
+    global _server
+    if not METRICS_ENABLED:
+        return None
+    with _server_lock:
+        if _server is None:
+            port = int(os.getenv("METRICS_PORT", port))
+            try:
+                _server = ThreadingHTTPServer((METRICS_HOST, port), _MetricsHandler)
+            except OSError as e:
+                logging.warning(f"Metrics endpoint not started on {METRICS_HOST}:{port}: {e}")
+                _server = False
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+            logging.info(f"Metrics on http://{METRICS_HOST}:{port}/metrics")
+        return _server or None
@@ -3,8 +3,17 @@ import streamlit as st
 from openobd import *
 import pandas as pd
 from datetime import datetime
-import pytz
-import time
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Shared modules live in the repository root, one level up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bus_limiter import MAX_CONCURRENCY, bus_limiter
+from ecu_sweep import SWEEP_11BIT_RANGES, SWEEP_29BIT_RANGES, sweep_addresses
+from uds_codec import decode_text
+from uds_engine import send_request
+from vag_vehicle import guess_vag_brand
 
 # Setup
 logging.basicConfig(level=logging.INFO)
@@ -18,21 +27,7 @@ COMMON_VAG_ECU_IDS = [
     0x55, 0x56, 0x5F, 0x61, 0x65, 0x6C,
     0x6D, 0x76, 0x77, 0x7D
 ]
-
-def guess_vag_brand(vin):
-    if not vin or len(vin) < 3:
-        return "Unknown"
-    return {
-        "WVW": "Volkswagen", "WV1": "Volkswagen Commercial", "WAU": "Audi",
-        "TRU": "Audi (Hungary)", "SKZ": "Skoda", "TMB": "Skoda",
-        "VSS": "SEAT", "3VW": "Volkswagen (Mexico)", "9BW": "Volkswagen (Brazil)"
-    }.get(vin[:3].upper(), "Unknown")
-
-def decode_utf8(hex_string):
-    try:
-        return bytes.fromhex(hex_string).decode("utf-8").strip("\x00")
-    except Exception:
-        return ""
+PROBE_TIMEOUT = 0.2
 
 def decode_ecu_function(ecu_info):
     known_ecus = {
@@ -56,17 +51,42 @@ def decode_ecu_function(ecu_info):
             return label
     return "Unknown / Not Mapped"
 
-def send_request(gas, command, expected_prefix):
+def probe_ecu(session, req_id, res_id, limiter):
+    # Runs in a worker thread: no Streamlit calls here
+    gas = IsotpSocket(session, IsotpChannel(
+        bus_name="vag_bus",
+        request_id=req_id,
+        response_id=res_id,
+        padding=Padding.PADDING_ENABLED
+    ), timeout=PROBE_TIMEOUT)
     try:
-        response = gas.request(command, silent=True)
-        logging.info(f"Response for {command}: {response}")
-        if response.startswith(expected_prefix):
-            return response[len(expected_prefix):]
-    except Exception as e:
-        logging.debug(f"Request failed: {e}")
-    return None
+        # Try extended diagnostic session (1003), fallback to default (1001)
+        session_response = send_request(gas, "1003", "50", limiter=limiter, p2=PROBE_TIMEOUT)
+        if session_response is None:
+            session_response = send_request(gas, "1001", "50", limiter=limiter, p2=PROBE_TIMEOUT)
+        if session_response is None:
+            return None
+
+        vin_raw = send_request(gas, "22F190", "62F190", limiter=limiter, p2=PROBE_TIMEOUT)
+        sw_raw = send_request(gas, "22F1A2", "62F1A2", limiter=limiter, p2=PROBE_TIMEOUT)
+        name_raw = send_request(gas, "22F19E", "62F19E", limiter=limiter, p2=PROBE_TIMEOUT)
+        if vin_raw is None and sw_raw is None and name_raw is None:
+            return None
+
+        decoded_name = decode_text(name_raw)
+        return {
+            "ECU ID": hex(req_id - 0x700) if req_id <= 0x7FF else hex(req_id),
+            "Req ID": hex(req_id),
+            "Res ID": hex(res_id),
+            "VIN": decode_text(vin_raw),
+            "SW Version": decode_text(sw_raw),
+            "ECU Info": decoded_name,
+            "Function": decode_ecu_function(decoded_name)
+        }
+    finally:
+        gas.stop_stream()
 
-def fast_ecu_scan(ticket_id):
+def fast_ecu_scan(ticket_id, full_sweep=False):
     session = None
     try:
         st.info("🔌 Starting diagnostic session...")
@@ -88,67 +108,31 @@ def fast_ecu_scan(ticket_id):
         st.markdown("## 🔍 Scanning VAG ECUs...")
         detected = []
 
-        for ecu_id in COMMON_VAG_ECU_IDS:
-            req_id = 0x700 + ecu_id
-            res_id = 0x780 + ecu_id
-
-            try:
-                gas = IsotpSocket(session, IsotpChannel(
-                    bus_name="vag_bus",
-                    request_id=req_id,
-                    response_id=res_id,
-                    padding=Padding.PADDING_ENABLED,
-                    timeout_ms=200
-                ))
-
-                # Try extended diagnostic session (1003), fallback to default (1001)
-                session_response = send_request(gas, "1003", "50")
-                if not session_response:
-                    session_response = send_request(gas, "1001", "50")
-
-                if session_response:
-                    vin_raw = send_request(gas, "22F190", "62F190")
-                    sw_raw = send_request(gas, "22F1A2", "62F1A2")
-                    name_raw = send_request(gas, "22F19E", "62F19E")
-
-                    if vin_raw or sw_raw or name_raw:
-                        decoded_name = decode_utf8(name_raw or "")
-                        ecu_entry = {
-                            "ECU ID": hex(ecu_id),
-                            "Req ID": hex(req_id),
-                            "Res ID": hex(res_id),
-                            "VIN": decode_utf8(vin_raw or ""),
-                            "SW Version": decode_utf8(sw_raw or ""),
-                            "ECU Info": decoded_name,
-                            "Function": decode_ecu_function(decoded_name)
-                        }
-                        detected.append(ecu_entry)
-                        st.success(f"✅ ECU found at ID {hex(ecu_id)}")
-                        st.write(ecu_entry)
-
-
-                
-
-                    if vin_raw or sw_raw or name_raw:
-                        decoded_name = decode_utf8(name_raw or "")
-                        ecu_entry = {
-                        "ECU ID": hex(ecu_id),
-                        "Req ID": hex(req_id),
-                        "Res ID": hex(res_id),
-                        "VIN": decode_utf8(vin_raw or ""),
-                        "SW Version": decode_utf8(sw_raw or ""),
-                        "ECU Info": decoded_name,
-                        "Function": decode_ecu_function(decoded_name)
-                    }
-                    
-                        detected.append(ecu_entry)
-                        st.success(f"✅ ECU found at ID {hex(ecu_id)}")
-                        st.write(ecu_entry)
-
-                gas.stop_stream()
-                time.sleep(0.05)  # Prevent CAN flooding
-            except Exception as e:
-                logging.debug(f"No response from ECU ID {hex(ecu_id)}: {e}")
+        if full_sweep:
+            # Short probes over the whole range first, identification only on the responders
+            responders = sweep_addresses(session, "vag_bus")
+            st.info(f"📡 {len(responders)} responders found in the address sweep")
+            targets = [(req_id, res_id) for req_id, res_id, _ in responders]
+        else:
+            targets = [(0x700 + ecu_id, 0x780 + ecu_id) for ecu_id in COMMON_VAG_ECU_IDS]
+
+        # The bus limiter paces the probes and decides how many run at once
+        limiter = bus_limiter(session, "vag_bus")
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as pool:
+            futures = {pool.submit(probe_ecu, session, req_id, res_id, limiter): req_id for req_id, res_id in targets}
+            for future in as_completed(futures):
+                req_id = futures[future]
+                try:
+                    ecu_entry = future.result()
+                except Exception as e:
+                    logging.debug(f"No response from ECU {hex(req_id)}: {e}")
+                    continue
+                if ecu_entry:
+                    detected.append(ecu_entry)
+                    st.success(f"✅ ECU found at ID {hex(req_id)}")
+                    st.write(ecu_entry)
+        logging.info(f"Bus limiter after scan: {limiter.stats()}")
+        detected.sort(key=lambda entry: int(entry["Req ID"], 16))
 
         if detected:
             vin = detected[0]["VIN"]
@@ -175,9 +159,13 @@ def fast_ecu_scan(ticket_id):
 # Streamlit UI
 st.title("⚡ Fast VAG ECU Scanner with Function Mapping")
 ticket_id = st.text_input("Enter Ticket ID")
+full_sweep = st.checkbox(
+    "📡 Full address sweep",
+    help=f"Probe every request ID in {SWEEP_11BIT_RANGES} {SWEEP_29BIT_RANGES} instead of the common VAG ECU IDs",
+)
 
 if st.button("Start ECU Scan"):
     if ticket_id.isdigit():
-        fast_ecu_scan(ticket_id)
+        fast_ecu_scan(ticket_id, full_sweep)
     else:
         st.error("Ticket ID must be numeric.")
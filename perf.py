@@ -0,0 +1,171 @@
+import functools
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+# Per-phase timing of user operations ("Run Scan", "CNG Reset", ...), switched on from the environment:
+#   PERF_TIMERS=1                     phase timers, shown in the Performance expander and appended
+#                                     as JSON lines to PERF_METRICS_PATH
+#   PERF_CAPTURE=cprofile|pyinstrument  additionally profile each operation as a whole
+# Disabled, operation()/phase() cost one flag check.
+
+TIMERS_ENABLED = os.getenv("PERF_TIMERS", "") == "1"
+CAPTURE = os.getenv("PERF_CAPTURE", "").lower()
+METRICS_PATH = os.getenv("PERF_METRICS_PATH", "perf_metrics.jsonl")
+RECENT_OPERATIONS = 20
+
+_current = ContextVar("perf_operation", default=None)
+_recent = deque(maxlen=RECENT_OPERATIONS)
+_write_lock = threading.Lock()
+
+
+class Operation:
+    __slots__ = ("name", "started_at", "phases", "total", "profile", "_start")
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.phases = {}
+        self.total = None
+        self.profile = None
+        self._start = time.perf_counter()
+
+    def add(self, phase_name, seconds):
+        # Repeated phases (one per module, ...) accumulate
+        self.phases[phase_name] = self.phases.get(phase_name, 0.0) + seconds
+
+    def as_dict(self):
+        return {
+            "operation": self.name, "started_at": self.started_at, "total": round(self.total or 0.0, 4),
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+        }
+
+
+@contextmanager
+def _profiler(operation):
+    if CAPTURE == "cprofile":
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another operation is already being profiled (one profiler per process on 3.12+)
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(30)
+            operation.profile = out.getvalue()
+    elif CAPTURE == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            operation.profile = profiler.output_text(unicode=True)
+    else:
+        yield
+
+
+@contextmanager
+def operation(name):
+    if not TIMERS_ENABLED or _current.get() is not None:
+        yield _current.get()
+        return
+    op = Operation(name)
+    token = _current.set(op)
+    try:
+        with _profiler(op):
+            yield op
+    finally:
+        _current.reset(token)
+        op.total = time.perf_counter() - op._start
+        _finish(op)
+
+
+@contextmanager
+def phase(name):
+    op = _current.get()
+    if op is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        op.add(name, time.perf_counter() - start)
+
+
+def timed(name):
+    # Decorator: a phase inside a running operation, else an operation of its own (e.g. in a worker thread)
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is not None:
+                with phase(name):
+                    return func(*args, **kwargs)
+            with operation(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_iter(iterable, name):
+    # Times only the waits for the next item, not the caller's work in between
+    iterator = iter(iterable)
+    while True:
+        with phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def _finish(op):
+    _recent.append(op)
+    logging.info(f"⏱️ {op.name}: {op.total:.2f}s " + ", ".join(f"{k} {v:.2f}s" for k, v in op.phases.items()))
+    try:
+        with _write_lock, open(METRICS_PATH, "a") as f:
+            f.write(json.dumps(op.as_dict()) + "\n")
+    except OSError as e:
+        logging.warning(f"Could not write perf metrics: {e}")
+
+
+def recent_operations():
+    return list(_recent)
+
+
+def render_performance_expander():
+    import pandas as pd
+    import streamlit as st
+
+    if not TIMERS_ENABLED:
+        return
+    with st.expander("⏱️ Performance"):
+        operations = recent_operations()
+        if not operations:
+            st.info("No timed operations yet.")
+            return
+        rows = [{"Operation": op.name, "Started": op.started_at, "Total (s)": round(op.total, 3),
+                 **{name: round(seconds, 3) for name, seconds in op.phases.items()}} for op in reversed(operations)]
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+        profiled = next((op for op in reversed(operations) if op.profile), None)
+        if profiled:
+            st.caption(f"Profile of {profiled.name} ({profiled.started_at})")
+            st.code(profiled.profile)
@@ -0,0 +1,106 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+# Content-addressed report store: every report is saved once under its SHA-256, and an
+# append-only JSONL index maps ticket/VIN to report digests. Writers serialize on a file lock,
+# so concurrent pre-scans (threads or processes) never race on the same files.
+
+REPORTS_DIR = os.getenv("REPORTS_DIR", "reports")
+RETENTION_DAYS = float(os.getenv("REPORTS_RETENTION_DAYS", "90"))
+MAX_REPORTS = int(os.getenv("REPORTS_MAX", "5000"))
+
+
+class ReportArchive:
+
+    def __init__(self, root=REPORTS_DIR, retention_days=RETENTION_DAYS, max_reports=MAX_REPORTS):
+        self.root = root
+        self.retention_days = retention_days
+        self.max_reports = max_reports
+        self.index_path = os.path.join(root, "index.jsonl")
+        os.makedirs(root, exist_ok=True)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.pdf")
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.root, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def store(self, data, ticket, vin, kind="pre_scan", scan_id=None):
+        # scan_id identifies the scan a report was rendered from: fpdf stamps the render time into
+        # the PDF, so a re-render of the same scan has another digest but is not archived again
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        entry = {"digest": digest, "ticket": str(ticket), "vin": vin, "kind": kind,
+                 "created": time.time(), "size": len(data), "scan_id": scan_id}
+        with self._locked():
+            for existing in self.entries():
+                if existing["digest"] == digest or (scan_id and existing.get("scan_id") == scan_id):
+                    return existing["digest"]
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            with open(self.index_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        return digest
+
+    def entries(self):
+        if not os.path.exists(self.index_path):
+            return []
+        entries = []
+        with open(self.index_path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    logging.warning(f"Skipping corrupt report index line in {self.index_path}")
+        return entries
+
+    def find(self, ticket=None, vin=None):
+        matches = [
+            e for e in self.entries()
+            if (ticket is None or e["ticket"] == str(ticket)) and (vin is None or e["vin"] == vin)
+        ]
+        return sorted(matches, key=lambda e: e["created"], reverse=True)
+
+    def load(self, digest):
+        with open(self._blob_path(digest), "rb") as f:
+            return f.read()
+
+    def prune(self):
+        # Drops index entries past the retention window (and the oldest beyond max_reports),
+        # then deletes blobs no remaining entry points to
+        cutoff = time.time() - self.retention_days * 86400
+        with self._locked():
+            entries = self.entries()
+            kept = [e for e in entries if e["created"] >= cutoff]
+            kept = sorted(kept, key=lambda e: e["created"])[-self.max_reports:] if self.max_reports else kept
+            if len(kept) == len(entries):
+                return 0
+
+            tmp_index = f"{self.index_path}.tmp"
+            with open(tmp_index, "w") as f:
+                for entry in kept:
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_index, self.index_path)
+
+            removed = {e["digest"] for e in entries} - {e["digest"] for e in kept}
+            for digest in removed:
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+        return len(entries) - len(kept)
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as RenderTimeout
+import streamlit as st
+
+# Reports are rendered on a small worker pool, off the Streamlit script thread. Jobs are keyed
+# by a hash of the renderer and its inputs, so a rerun that asks for the same report again gets
+# the pending or finished job back instead of starting another render.
+
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "32"))
+REPORT_WAIT_TIMEOUT = float(os.getenv("REPORT_WAIT_TIMEOUT", "5"))
+
+
+def report_key(render, args, kwargs):
+    payload = json.dumps(
+        [render.__module__, render.__qualname__, args, kwargs], sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ReportWorker:
+
+    def __init__(self, max_workers=REPORT_WORKERS, max_cached=REPORT_CACHE_SIZE):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report")
+        self.max_cached = max_cached
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, render, *args, **kwargs):
+        key = report_key(render, args, kwargs)
+        with self._lock:
+            future = self._jobs.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self.pool.submit(self._render, key, render, args, kwargs)
+                self._jobs[key] = future
+            self._jobs.move_to_end(key)
+            self._evict()
+        return key
+
+    def _render(self, key, render, args, kwargs):
+        start = time.perf_counter()
+        data = render(*args, **kwargs)
+        logging.info(f"Rendered report {key[:12]} in {time.perf_counter() - start:.2f}s ({len(data)} bytes)")
+        return data
+
+    def _evict(self):
+        # Oldest finished reports go first; pending renders are never dropped
+        finished = [key for key, future in self._jobs.items() if future.done()]
+        for key in finished[:max(0, len(self._jobs) - self.max_cached)]:
+            del self._jobs[key]
+
+    def result(self, key, timeout=None):
+        # Bytes of the report, None once evicted; raises RenderTimeout while it is still rendering
+        # and re-raises render errors
+        with self._lock:
+            future = self._jobs.get(key)
+        if future is None:
+            return None
+        return future.result(timeout=timeout)
+
+
+report_worker = ReportWorker()
+
+
+@st.fragment
+def report_download_button(key, label, file_name, worker=report_worker):
+    # A fragment, so "Check again" reruns only this widget instead of the whole app
+    status = st.empty()
+    status.info("⏳ Rendering PDF report...")
+    try:
+        data = worker.result(key, timeout=REPORT_WAIT_TIMEOUT)
+    except RenderTimeout:
+        status.info("⏳ The PDF report is still rendering.")
+        st.button("🔄 Check again", key=f"report_check_{key}")
+        return
+    except Exception as e:
+        logging.error(f"Report render failed: {e}")
+        status.error(f"❌ Could not render PDF report: {e}")
+        return
+    if data is None:
+        # Evicted by newer reports since this widget was drawn; a full rerun submits it again
+        status.info("⏳ The PDF report is no longer cached.")
+        if st.button("🔄 Render again", key=f"report_rerender_{key}"):
+            st.rerun()
+        return
+    status.empty()
+    st.download_button(label=label, data=data, file_name=file_name, mime="application/pdf")
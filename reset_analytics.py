@@ -0,0 +1,136 @@
+import csv
+import os
+import threading
+from collections import Counter, defaultdict
+import streamlit as st
+from scan_records import ResetResult
+
+# Trend analytics over cng_reset_sessions.csv. The log is append-only, so the aggregates are
+# folded forward from the byte offset of the last complete line read; a rerun only parses the
+# rows written since. Per (brand, ECU) a reset counts as:
+#   effective  the counter was read before and after and changed
+#   no change  the counter was read before and after and is identical (e.g. 5998 -> 5998), flagged
+#   unverified one of the two readings is missing
+
+ECUS = {"CNG": ("cng_pre_days", "cng_post_days"), "Gateway": ("gateway_pre_days", "gateway_post_days")}
+DAYS_BUCKET = 500
+_FIELDS_BY_LABEL = {label: name for name, label in ResetResult.LABELS.items()}
+
+
+def _as_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class ResetAnalytics:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.offset = 0
+        self.header = None
+        self.rows = 0
+        self.outcomes = defaultdict(Counter)  # (brand, ecu) -> {"effective", "no_change", "unverified"}
+        self.pre_days = defaultdict(Counter)  # ecu -> bucket -> count
+        self.post_days = defaultdict(Counter)
+        self.anomalies = []
+
+    def update(self):
+        # Reads only the complete lines appended since the last call; returns the number of new rows
+        with self._lock:
+            if not os.path.exists(self.path):
+                return 0
+            if os.path.getsize(self.path) < self.offset:
+                self._reset()  # Log was truncated or replaced: start over
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                chunk = f.read()
+            end = chunk.rfind(b"\n") + 1
+            if not end:
+                return 0
+            self.offset += end
+
+            lines = chunk[:end].decode("utf-8").splitlines()
+            if self.header is None:
+                self.header = next(csv.reader(lines[:1]))
+                lines = lines[1:]
+            new_rows = 0
+            for values in csv.reader(lines):
+                if values:
+                    self._add(dict(zip(self.header, values)))
+                    new_rows += 1
+            self.rows += new_rows
+            return new_rows
+
+    def _add(self, row):
+        result = {_FIELDS_BY_LABEL.get(label, label): value for label, value in row.items()}
+        brand = result.get("brand_guess") or "Unknown"
+        for ecu, (pre_field, post_field) in ECUS.items():
+            pre, post = _as_int(result.get(pre_field)), _as_int(result.get(post_field))
+            if pre is None and post is None:
+                continue
+            if pre is not None:
+                self.pre_days[ecu][pre // DAYS_BUCKET * DAYS_BUCKET] += 1
+            if post is not None:
+                self.post_days[ecu][post // DAYS_BUCKET * DAYS_BUCKET] += 1
+
+            if pre is None or post is None:
+                outcome = "unverified"
+            elif pre == post:
+                outcome = "no_change"
+                self.anomalies.append({
+                    "timestamp": result.get("timestamp"), "ticket_id": result.get("ticket_id"),
+                    "vin": result.get("vin"), "brand": brand, "ecu": ecu, "days": pre,
+                })
+            else:
+                outcome = "effective"
+            self.outcomes[(brand, ecu)][outcome] += 1
+
+    def success_rates(self):
+        rows = []
+        for (brand, ecu), counts in sorted(self.outcomes.items()):
+            verified = counts["effective"] + counts["no_change"]
+            rows.append({
+                "Brand": brand, "ECU": ecu, "Effective": counts["effective"], "No change": counts["no_change"],
+                "Unverified": counts["unverified"],
+                "Success %": round(counts["effective"] / verified * 100, 1) if verified else None,
+            })
+        return rows
+
+    def day_distribution(self, ecu):
+        buckets = sorted(set(self.pre_days[ecu]) | set(self.post_days[ecu]))
+        return [
+            {"Days": f"{b}-{b + DAYS_BUCKET - 1}", "Before reset": self.pre_days[ecu][b], "After reset": self.post_days[ecu][b]}
+            for b in buckets
+        ]
+
+
+@st.cache_resource
+def get_reset_analytics(path):
+    return ResetAnalytics(path)
+
+
+def render_reset_dashboard(path):
+    import pandas as pd
+
+    analytics = get_reset_analytics(path)
+    analytics.update()
+    st.subheader("📈 Reset Effectiveness")
+    if not analytics.outcomes:
+        st.info("🕳️ No counter readings logged yet.")
+        return
+
+    st.dataframe(pd.DataFrame(analytics.success_rates()), hide_index=True)
+    if analytics.anomalies:
+        st.warning(f"⚠️ {len(analytics.anomalies)} reset(s) did not change the counter")
+        st.dataframe(pd.DataFrame(analytics.anomalies[::-1]), hide_index=True)
+
+    ecu = st.radio("Counter distribution", list(ECUS), horizontal=True)
+    distribution = analytics.day_distribution(ecu)
+    if distribution:
+        st.bar_chart(pd.DataFrame(distribution).set_index("Days"))
@@ -0,0 +1,97 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+# Post-reset verification. A single read right after the write can still return the old counter
+# while the ECU commits it, so the counters are polled until they converge instead:
+#   converged  the value is accepted (by default: differs from the pre-reset baseline) and the
+#              same value was read twice in a row
+# Probes on the same socket are read one after another, different ECUs are polled concurrently.
+# The poll interval starts short, doubles while nothing moves and drops back when a value changes.
+
+VERIFY_TIMEOUT = float(os.getenv("RESET_VERIFY_TIMEOUT", "3.0"))
+VERIFY_INTERVAL_MIN = 0.05
+VERIFY_INTERVAL_MAX = 0.4
+
+
+class CounterProbe:
+    __slots__ = ("name", "group", "read", "baseline", "accept")
+
+    def __init__(self, name, group, read, baseline, accept=None):
+        self.name = name
+        self.group = group  # Probes with the same group (socket) never run concurrently
+        self.read = read
+        self.baseline = baseline
+        self.accept = accept or (lambda value, baseline: value != baseline)
+
+
+@dataclass(slots=True)
+class Verification:
+    name: str
+    pre: int | None
+    post: int | None = None
+    converged: bool = False
+    settle_time: float | None = None  # Seconds after the reset until the final value was first read
+    reads: int = 0
+
+
+def _poll_group(probes, start, deadline):
+    results = {p.name: Verification(p.name, p.baseline) for p in probes}
+    first_seen = {}
+    open_probes = list(probes)
+    interval = VERIFY_INTERVAL_MIN
+
+    while open_probes:
+        moved = False
+        for probe in list(open_probes):
+            result = results[probe.name]
+            value = probe.read()
+            now = time.monotonic()
+            result.reads += 1
+            if value != result.post or result.reads == 1:
+                moved = moved or result.reads > 1
+                first_seen[probe.name] = now
+            stable = result.reads > 1 and value == result.post
+            result.post = value
+            if value is not None and stable and probe.accept(value, probe.baseline):
+                result.converged = True
+                result.settle_time = first_seen[probe.name] - start
+                open_probes.remove(probe)
+
+        if not open_probes or time.monotonic() + interval > deadline:
+            break
+        time.sleep(interval)
+        interval = VERIFY_INTERVAL_MIN if moved else min(interval * 2, VERIFY_INTERVAL_MAX)
+
+    return list(results.values())
+
+
+def verify_counters(probes, timeout=VERIFY_TIMEOUT):
+    # Returns {probe name: Verification}; probes that did not converge keep their last read value
+    groups = {}
+    for probe in probes:
+        groups.setdefault(id(probe.group), []).append(probe)
+    if not groups:
+        return {}
+
+    start = time.monotonic()
+    deadline = start + timeout
+    with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+        futures = [pool.submit(_poll_group, group, start, deadline) for group in groups.values()]
+        results = {r.name: r for future in futures for r in future.result()}
+
+    for r in results.values():
+        if r.converged:
+            logging.info(f"{r.name}: {r.pre} -> {r.post} settled after {r.settle_time:.2f}s ({r.reads} reads)")
+        else:
+            logging.warning(f"{r.name}: not converged after {timeout:.1f}s ({r.pre} -> {r.post}, {r.reads} reads)")
+    return results
+
+
+def verification_note(verification):
+    return "; ".join(
+        f"{v.name} settled {v.settle_time:.2f}s" if v.converged else f"{v.name} unchanged"
+        for v in verification.values()
+    )
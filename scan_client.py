@@ -0,0 +1,78 @@
+import os
+import requests
+from scan_records import ModuleResult, from_dict
+
+# Thin client for scan_service.py. When SCAN_SERVICE_URL is set the apps submit their vehicle
+# I/O as jobs to the service instead of running it inside the Streamlit script.
+SCAN_SERVICE_URL = os.getenv("SCAN_SERVICE_URL", "")
+
+
+class ScanServiceError(Exception):
+    pass
+
+
+class ScanServiceClient:
+
+    def __init__(self, base_url=SCAN_SERVICE_URL, poll_wait=10):
+        self.base_url = base_url.rstrip("/")
+        self.poll_wait = poll_wait
+        self.http = requests.Session()
+
+    def _url(self, path):
+        return f"{self.base_url}/api/{path}"
+
+    def submit(self, kind, **params):
+        response = self.http.post(self._url(kind), json=params, timeout=10)
+        if response.status_code != 202:
+            raise ScanServiceError(f"{kind} rejected ({response.status_code}): {response.text}")
+        return response.json()["job_id"]
+
+    def status(self, job_id, since=0, wait=0):
+        response = self.http.get(self._url(f"jobs/{job_id}"), params={"since": since, "wait": wait}, timeout=wait + 10)
+        response.raise_for_status()
+        return response.json()
+
+    def events(self, job_id):
+        # Long-polls the job and yields every progress event; the final snapshot is returned at the end
+        since = 0
+        while True:
+            snapshot = self.status(job_id, since=since, wait=self.poll_wait)
+            yield from snapshot["events"]
+            since = snapshot["next"]
+            if snapshot["status"] in ("finished", "failed"):
+                return snapshot
+
+    def run(self, kind, **params):
+        job_id = self.submit(kind, **params)
+        for _ in self._follow(job_id):
+            pass
+        return self.result
+
+    def scan(self, ticket_id, module_names=None):
+        # Yields the same (event, module, result, elapsed) tuples as scan_stream.scan_modules
+        job_id = self.submit("scan", ticket_id=ticket_id, modules=module_names)
+        for event in self._follow(job_id):
+            if "module" not in event:
+                continue
+            if event["event"] == "done":
+                result = from_dict(ModuleResult, event["entry"])
+            else:
+                result = event.get("error")
+            yield event["event"], event["module"], result, event.get("elapsed")
+
+    def _follow(self, job_id):
+        self.result = None
+        snapshot = yield from self.events(job_id)
+        if snapshot["status"] == "failed":
+            raise ScanServiceError(snapshot["error"])
+        self.result = snapshot["result"]
+
+    def list_sessions(self):
+        response = self.http.get(self._url("sessions"), timeout=30)
+        response.raise_for_status()
+        return response.json()["sessions"]
+
+    def close_session(self, session_id):
+        response = self.http.delete(self._url(f"sessions/{session_id}"), timeout=30)
+        response.raise_for_status()
+
@@ -0,0 +1,137 @@
+from dataclasses import dataclass, fields
+
+# Typed scan output. Records are slotted dataclasses with snake_case fields and None for a value
+# the vehicle did not deliver; the human-facing column names ("VAG Part Number", "Kolom 1", ...)
+# and placeholder strings only appear when records are converted for a table, a sheet or a PDF.
+# LABELS is a plain (unannotated) class attribute, so it is shared by all instances and not a field.
+
+MISSING = "No response"
+
+
+@dataclass(slots=True)
+class ModuleResult:
+    module: str
+    vin: str | None = None
+    part_number: str | None = None
+    software_version: str | None = None
+
+    LABELS = {
+        "module": "Module",
+        "vin": "VIN",
+        "part_number": "VAG Part Number",
+        "software_version": "Software Version",
+    }
+
+
+@dataclass(slots=True)
+class VersionComparison:
+    part_number: str
+    current_version: str
+    available_versions: tuple = ()
+    highest_known_version: str | None = None
+    note: str = ""
+
+    LABELS = {
+        "part_number": "VAG Part Number",
+        "current_version": "Current Version",
+        "available_versions": "Available Versions",
+        "highest_known_version": "Highest Known Version",
+        "note": "Note",
+    }
+
+
+@dataclass(slots=True)
+class ResetResult:
+    # Field order is the column order of cng_reset_sessions.csv
+    timestamp: str
+    ticket_id: str
+    cng_pre_days: int | None = None
+    cng_post_days: int | None = None
+    gateway_pre_days: int | None = None
+    gateway_post_days: int | None = None
+    vin: str | None = None
+    brand_guess: str = "Unknown"
+    reset_period_years: int | None = None
+    note: str = ""
+
+    LABELS = {
+        "timestamp": "timestamp",
+        "ticket_id": "ticket_id",
+        "cng_pre_days": "CNG_pre_days",
+        "cng_post_days": "CNG_post_days",
+        "gateway_pre_days": "Gateway_pre_days",
+        "gateway_post_days": "Gateway_post_days",
+        "vin": "vin",
+        "brand_guess": "brand_guess",
+        "reset_period_years": "reset_period_years",
+        "note": "Kolom 1",
+    }
+
+
+@dataclass(slots=True)
+class DtcRecord:
+    code: str
+    status: int
+
+    LABELS = {"code": "DTC", "status": "Status"}
+
+
+def record_values(record, missing=None):
+    # Field values in declaration order; tuples are joined and None replaced by `missing`
+    values = []
+    for f in fields(record):
+        value = getattr(record, f.name)
+        if isinstance(value, tuple):
+            value = ", ".join(value)
+        values.append(missing if value is None else value)
+    return values
+
+
+def to_row(record, missing=MISSING):
+    # One record as a display dict keyed by the human-facing column names
+    labels = type(record).LABELS
+    return dict(zip((labels[f.name] for f in fields(record)), record_values(record, missing)))
+
+
+def to_columns(records, missing=None, labeled=True):
+    # Column-oriented form of a homogeneous record list: {column: [values...]}, built in one pass
+    if not records:
+        return {}
+    record_type = type(records[0])
+    names = [f.name for f in fields(record_type)]
+    columns = [list(column) for column in zip(*(record_values(r, missing) for r in records))]
+    keys = [record_type.LABELS[name] for name in names] if labeled else names
+    return dict(zip(keys, columns))
+
+
+def to_frame(records, missing=None, labeled=True):
+    import pandas as pd
+
+    return pd.DataFrame(to_columns(records, missing=missing, labeled=labeled))
+
+
+def from_dict(record_type, data):
+    # Rebuilds a record from its field dict (e.g. received as JSON from the scan service)
+    names = {f.name for f in fields(record_type)}
+    values = {k: v for k, v in data.items() if k in names}
+    if "available_versions" in values and isinstance(values["available_versions"], list):
+        values["available_versions"] = tuple(values["available_versions"])
+    return record_type(**values)
+
+
+def as_dict(record):
+    return {f.name: getattr(record, f.name) for f in fields(record)}
+
+
+def report_rows(modules, comparisons=(), missing=MISSING):
+    # Module rows for tables and the PDF, with the version comparison of their part number attached
+    by_part = {c.part_number: c for c in comparisons}
+    rows = []
+    for module in modules:
+        row = to_row(module, missing)
+        comparison = by_part.get(module.part_number)
+        if comparison is not None:
+            for label, value in to_row(comparison, missing).items():
+                row.setdefault(label, value)
+        rows.append(row)
+    return rows
@@ -0,0 +1,133 @@
+import os
+from datetime import datetime
+from functools import lru_cache
+from fpdf import FPDF
+from perf import timed
+from metrics import REPORT_RENDER
+
+# Paginated scan report: rows are written straight onto the page as fixed-height cells, so the
+# cost per row is constant and tables of any length flow over as many pages as they need.
+
+LOGO_PATH = "logo2.png"
+HIDDEN_COLUMNS = ("Timestamp",)
+ROW_HEIGHT = 6
+HEADER_FONT_SIZE = 8
+BODY_FONT_SIZE = 7
+CELL_PADDING = 1.5
+
+
+@lru_cache(maxsize=4)
+def logo_info(path=LOGO_PATH):
+    # (width, height, fpdf image type) read once per process; None without a logo file.
+    # The type comes from the content: logo2.png is a JPEG despite its name.
+    from PIL import Image
+
+    if not os.path.exists(path):
+        return None
+    with Image.open(path) as image:
+        return image.width, image.height, "JPG" if image.format == "JPEG" else image.format
+
+
+def pdf_text(value):
+    # Core PDF fonts are latin-1 only; emoji and other symbols are dropped
+    if value is None:
+        return ""
+    return str(value).encode("latin-1", "ignore").decode("latin-1").strip()
+
+
+class ScanReport(FPDF):
+
+    def __init__(self, title="Scan Report", logo_path=LOGO_PATH):
+        super().__init__(orientation="L", unit="mm", format="A4")
+        self.report_title = pdf_text(title)
+        self.set_title(self.report_title)
+        self.logo_path = logo_path
+        self.set_auto_page_break(False)
+        self.set_margins(10, 10, 10)
+        self._columns = []
+        self._widths = []
+
+    def _place_logo(self, x, y, h):
+        # fpdf embeds an image once per document however often it is placed
+        logo = logo_info(self.logo_path)
+        if logo is None:
+            return 0
+        width, height, image_type = logo
+        self.image(self.logo_path, x=x, y=y, h=h, type=image_type)
+        return h * width / height
+
+    def _column_widths(self, columns, rows):
+        # Widths proportional to the longest value per column, bounded so no column swallows the page
+        self.set_font("Arial", size=BODY_FONT_SIZE)
+        char_w = self.get_string_width("M") * 0.6
+        longest = []
+        for column in columns:
+            length = max([len(pdf_text(column))] + [len(pdf_text(row.get(column))) for row in rows])
+            longest.append(min(max(length, 4), 40) * char_w + 2 * CELL_PADDING)
+        usable = self.w - self.l_margin - self.r_margin
+        scale = usable / sum(longest)
+        return [w * scale for w in longest]
+
+    def _fit(self, text, width):
+        text = pdf_text(text)
+        limit = width - 2 * CELL_PADDING
+        if self.get_string_width(text) <= limit:
+            return text
+        while text and self.get_string_width(text + "...") > limit:
+            text = text[:-1]
+        return text + "..."
+
+    def _table_header(self):
+        self.set_font("Arial", style="B", size=HEADER_FONT_SIZE)
+        self.set_fill_color(220, 225, 235)
+        for column, width in zip(self._columns, self._widths):
+            self.cell(width, ROW_HEIGHT, self._fit(column, width), border=1, fill=True)
+        self.ln(ROW_HEIGHT)
+        self.set_font("Arial", size=BODY_FONT_SIZE)
+
+    def _new_table_page(self):
+        self.add_page()
+        self.set_font("Arial", size=BODY_FONT_SIZE)
+        self.cell(0, 4, f"{self.report_title} - page {self.page_no()}", ln=True, align="R")
+        self._table_header()
+
+    def add_vehicle(self, rows, vin="N/A", modules=(), scanned_at=None):
+        self._columns = [c for c in dict.fromkeys(k for row in rows for k in row) if c not in HIDDEN_COLUMNS]
+        self._widths = self._column_widths(self._columns, rows)
+
+        self.add_page()
+        logo_w = self._place_logo(self.l_margin, self.t_margin, 14)
+        self.set_xy(self.l_margin + logo_w + 5, self.t_margin)
+        self.set_font("Arial", style="B", size=14)
+        self.cell(0, 7, self.report_title, ln=True)
+        self.set_x(self.l_margin + logo_w + 5)
+        self.set_font("Arial", size=9)
+        scanned_at = scanned_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cell(0, 5, pdf_text(f"VIN: {vin}   |   Scanned: {scanned_at}   |   Modules: {len(rows)}"), ln=True)
+        if modules:
+            self.set_x(self.l_margin + logo_w + 5)
+            self.cell(0, 5, self._fit(", ".join(modules), self.w - self.get_x() - self.r_margin), ln=True)
+        self.set_y(max(self.get_y(), self.t_margin + 16))
+        self._table_header()
+
+        bottom = self.h - self.b_margin
+        for index, row in enumerate(rows):
+            if self.get_y() + ROW_HEIGHT > bottom:
+                self._new_table_page()
+            fill = index % 2 == 1
+            if fill:
+                self.set_fill_color(245, 245, 245)
+            for column, width in zip(self._columns, self._widths):
+                self.cell(width, ROW_HEIGHT, self._fit(row.get(column), width), border=1, fill=fill)
+            self.ln(ROW_HEIGHT)
+
+    def to_bytes(self):
+        return self.output(dest="S").encode("latin-1")
+
+
+@timed("PDF render")
+@REPORT_RENDER.time(report="scan")
+def render_scan_report(rows, vin="N/A", modules=(), title="Scan Report"):
+    report = ScanReport(title=title)
+    report.add_vehicle(rows, vin=vin, modules=modules)
+    return report.to_bytes()
@@ -0,0 +1,372 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from tornado import locks, web, websocket
+from tornado.ioloop import IOLoop
+from openobd import *
+from scan_stream import configure_vag_buses, scan_modules
+from scan_records import as_dict
+from uds_codec import READ_ASAM_FILE_ID, READ_ASAM_FILE_VERSION, READ_VIN, decode_dtc_records, decode_text
+from uds_engine import RequestFailure, request_payload
+from session_trace import openobd_client
+from vag_modules import ECM_ID_PAIRS, registry
+from metrics import render as render_metrics
+
+# Standalone vehicle I/O service: the Streamlit apps and CLI scripts submit jobs over HTTP and
+# follow their progress (long-poll or WebSocket) instead of doing the I/O inside a script rerun.
+# Jobs live in the memory of the instance that accepted them: with several instances behind a load
+# balancer, route by job ID (sticky routing) so long-polls and WebSockets reach that instance.
+
+logging.basicConfig(level=logging.INFO)
+
+SERVICE_PORT = int(os.getenv("SCAN_SERVICE_PORT", "8060"))
+MAX_WORKERS = int(os.getenv("SCAN_SERVICE_WORKERS", "8"))
+MAX_FINISHED_JOBS = 200
+
+
+def configure_vag_bus(session, bus_name="VAG_bus"):
+    bus_config = BusConfiguration(
+        bus_name=bus_name,
+        can_bus=CanBus(
+            pin_plus=6,
+            pin_min=14,
+            can_protocol=CanProtocol.CAN_PROTOCOL_ISOTP,
+            can_bit_rate=CanBitRate.CAN_BIT_RATE_500,
+            transceiver=TransceiverSpeed.TRANSCEIVER_SPEED_HIGH,
+        ),
+    )
+    StreamHandler(session.configure_bus).send_and_close([bus_config])
+
+
+# === Operations (run in worker threads) ===
+
+def op_scan(params, emit):
+    modules, aliases = registry.scan_plan(params.get("modules") or None)
+
+    session = openobd_client().start_session_on_ticket(params["ticket_id"])
+    SessionTokenHandler(session)
+    try:
+        buses = configure_vag_buses(session)
+        emit({"event": "bus_configured", "buses": buses})
+        if aliases:
+            emit({"event": "planned", "aliases": aliases})
+        results = []
+        for event, module_name, result, elapsed in scan_modules(session, modules, buses):
+            if event == "done":
+                entry = as_dict(result)
+                results.append(entry)
+                emit({"event": event, "module": module_name, "entry": entry, "elapsed": elapsed})
+            elif event == "failed":
+                emit({"event": event, "module": module_name, "error": str(result), "elapsed": elapsed})
+            else:
+                emit({"event": event, "module": module_name})
+        return {"modules": results}
+    finally:
+        session.finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
+
+
+def _open_ecm(session):
+    for req_id, res_id in ECM_ID_PAIRS:
+        sock = IsotpSocket(session, IsotpChannel(
+            bus_name="VAG_bus",
+            request_id=req_id,
+            response_id=res_id,
+            padding=Padding.PADDING_ENABLED
+        ))
+        try:
+            vin = request_payload(sock, READ_VIN.request, READ_VIN.positive)
+            return sock, decode_text(vin, default="Unknown")
+        except RequestFailure as e:
+            logging.info(f"ECM not on 0x{req_id:X}: {e}")
+            sock.stop_stream()
+    return None, None
+
+
+def _read_optional_text(sock, did):
+    try:
+        return decode_text(request_payload(sock, did.request, did.positive), default=None)
+    except RequestFailure as e:
+        logging.info(f"{did.request} not read: {e}")
+        return None
+
+
+def _dtc_operation(params, emit, clear):
+    session = openobd_client().start_session_on_ticket(params["ticket_id"])
+    SessionTokenHandler(session)
+    sock = None
+    try:
+        configure_vag_bus(session)
+        sock, vin = _open_ecm(session)
+        if not sock:
+            raise RuntimeError("ECM not responding on any known ID pair.")
+        emit({"event": "ecm_connected", "vin": vin})
+        try:
+            request_payload(sock, "1003", "5003")
+        except RequestFailure as e:
+            logging.warning(f"Extended session not entered: {e}")
+        if clear:
+            try:
+                request_payload(sock, "14FFFFFF", "54")
+            except RequestFailure as e:
+                return {"vin": vin, "cleared": False, "failure": e.as_dict()}
+            return {"vin": vin, "cleared": True}
+        payload = request_payload(sock, "190204", "5902")
+        records = decode_dtc_records(payload)
+        return {
+            "vin": vin,
+            "asam_file_id": _read_optional_text(sock, READ_ASAM_FILE_ID),
+            "asam_file_version": _read_optional_text(sock, READ_ASAM_FILE_VERSION),
+            "raw": f"5902{payload.hex().upper()}",
+            "dtcs": [record.code for record in records],
+            "records": [as_dict(record) for record in records],
+        }
+    finally:
+        if sock:
+            sock.stop_stream()
+        session.finish(ServiceResult(result=[Result.RESULT_SUCCESS]))
+
+
+def op_dtc_read(params, emit):
+    return _dtc_operation(params, emit, clear=False)
+
+
+def op_dtc_clear(params, emit):
+    return _dtc_operation(params, emit, clear=True)
+
+
+def op_cng_service_reset(params, emit):
+    import gas_cng
+    return {"success": gas_cng.perform_cng_reset(params["ticket_id"])}
+
+
+def op_brake_service_exit(params, emit):
+    import brake_service
+    return {"success": brake_service.run_brake_exit(params["ticket_id"])}
+
+
+OPERATIONS = {
+    "scan": op_scan,
+    "dtc_read": op_dtc_read,
+    "dtc_clear": op_dtc_clear,
+    "cng_service_reset": op_cng_service_reset,
+    "brake_service_exit": op_brake_service_exit,
+}
+
+
+# === Job bookkeeping ===
+
+class Job:
+
+    def __init__(self, kind, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.status = "queued"
+        self.events = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.changed = locks.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("finished", "failed")
+
+    def snapshot(self, since=0):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "events": self.events[since:],
+            "next": len(self.events),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class ScanService:
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vehicle-io")
+        self.jobs = {}
+        self.loop = None
+
+    def submit(self, kind, params):
+        if kind not in OPERATIONS:
+            raise KeyError(kind)
+        if not str(params.get("ticket_id", "")).isdigit():
+            raise ValueError("Ticket ID must be numeric.")
+        self._prune()
+        job = Job(kind, params)
+        self.jobs[job.id] = job
+        self.executor.submit(self._run, job)
+        return job
+
+    def _notify(self, job):
+        # Called from worker threads; add_callback is the thread-safe way into the IOLoop
+        self.loop.add_callback(job.changed.notify_all)
+
+    def _run(self, job):
+        def emit(event):
+            event["t"] = round(time.time() - job.created_at, 3)
+            job.events.append(event)
+            self._notify(job)
+
+        job.status = "running"
+        self._notify(job)
+        try:
+            job.result = OPERATIONS[job.kind](job.params, emit)
+            job.status = "finished"
+        except Exception as e:
+            logging.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        self._notify(job)
+
+    def _prune(self):
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in sorted(finished, key=lambda j: j.created_at)[:-MAX_FINISHED_JOBS or None]:
+            del self.jobs[job.id]
+
+    async def wait_for_update(self, job, since, wait):
+        if len(job.events) > since or job.finished:
+            return
+        await job.changed.wait(timeout=timedelta(seconds=wait))
+
+    async def list_sessions(self):
+        def _list():
+            session_list = openobd_client().get_session_list()
+            return [{"id": s.id, "state": s.state, "created_at": s.created_at} for s in session_list.sessions]
+        return await IOLoop.current().run_in_executor(self.executor, _list)
+
+    async def interrupt_session(self, session_id):
+        def _interrupt():
+            openobd_client().interrupt_session(session_id=SessionId(value=session_id))
+        await IOLoop.current().run_in_executor(self.executor, _interrupt)
+
+
+# === HTTP / WebSocket handlers ===
+
+class BaseHandler(web.RequestHandler):
+
+    def initialize(self, service):
+        self.service = service
+
+    def write_json(self, data, status=200):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(data, default=str))
+
+    def get_job_or_404(self, job_id):
+        job = self.service.jobs.get(job_id)
+        if job is None:
+            raise web.HTTPError(404, reason=f"Unknown job {job_id}")
+        return job
+
+
+class JobSubmitHandler(BaseHandler):
+
+    def post(self, kind):
+        try:
+            params = json.loads(self.request.body or b"{}")
+            job = self.service.submit(kind, params)
+        except KeyError:
+            raise web.HTTPError(404, reason=f"Unknown operation {kind}")
+        except ValueError as e:
+            return self.write_json({"error": str(e)}, status=400)
+        self.write_json({"job_id": job.id}, status=202)
+
+
+class JobStatusHandler(BaseHandler):
+
+    async def get(self, job_id):
+        job = self.get_job_or_404(job_id)
+        try:
+            since = int(self.get_argument("since", "0"))
+            wait = min(float(self.get_argument("wait", "0")), 30.0)
+        except ValueError:
+            raise web.HTTPError(400, reason="since and wait must be numbers")
+        if wait:
+            await self.service.wait_for_update(job, since, wait)
+        self.write_json(job.snapshot(since))
+
+
+class JobStreamHandler(websocket.WebSocketHandler):
+
+    def initialize(self, service):
+        self.service = service
+
+    async def open(self, job_id):
+        job = self.service.jobs.get(job_id)
+        if job is None:
+            self.close(code=4404, reason="Unknown job")
+            return
+        since = 0
+        while True:
+            await self.service.wait_for_update(job, since, 15)
+            snapshot = job.snapshot(since)
+            since = snapshot["next"]
+            try:
+                await self.write_message(json.dumps(snapshot, default=str))
+            except websocket.WebSocketClosedError:
+                return
+            if job.finished:
+                self.close()
+                return
+
+
+class SessionListHandler(BaseHandler):
+
+    async def get(self):
+        self.write_json({"sessions": await self.service.list_sessions()})
+
+
+class SessionHandler(BaseHandler):
+
+    async def delete(self, session_id):
+        await self.service.interrupt_session(session_id)
+        self.write_json({"closed": session_id})
+
+
+class MetricsHandler(web.RequestHandler):
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(render_metrics())
+
+
+class HealthHandler(BaseHandler):
+
+    def get(self):
+        running = sum(1 for job in self.service.jobs.values() if job.status == "running")
+        self.write_json({"status": "ok", "running_jobs": running, "jobs": len(self.service.jobs)})
+
+
+def make_app(service):
+    args = {"service": service}
+    return web.Application([
+        (r"/api/health", HealthHandler, args),
+        (r"/metrics", MetricsHandler),
+        (r"/api/jobs/([0-9a-f]+)", JobStatusHandler, args),
+        (r"/api/jobs/([0-9a-f]+)/stream", JobStreamHandler, args),
+        (r"/api/sessions", SessionListHandler, args),
+        (r"/api/sessions/([^/]+)", SessionHandler, args),
+        (r"/api/([a-z_]+)", JobSubmitHandler, args),
+    ])
+
+
+async def main():
+    service = ScanService()
+    service.loop = IOLoop.current()
+    make_app(service).listen(SERVICE_PORT)
+    logging.info(f"Scan service listening on :{SERVICE_PORT}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
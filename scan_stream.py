@@ -0,0 +1,314 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from openobd import *
+from bus_limiter import bus_limiter
+from ecu_sweep import sweep_addresses
+from scan_records import ModuleResult
+from uds_codec import (
+    READ_ASAM_FILE_ID, READ_ASAM_FILE_VERSION, READ_SOFTWARE_VERSION, READ_VAG_PART_NUMBER, READ_VIN,
+    decode_text,
+)
+from uds_engine import NO_RESPONSE, RequestFailure, uds_request
+
+IDENTIFICATION_FIELDS = {
+    "vin": READ_VIN,
+    "part_number": READ_VAG_PART_NUMBER,
+    "software_version": READ_SOFTWARE_VERSION,
+}
+# Read in delta scans on top of the identification, for the vehicle snapshot only
+DETAIL_FIELDS = {
+    "asam_file_id": READ_ASAM_FILE_ID,
+    "asam_file_version": READ_ASAM_FILE_VERSION,
+}
+IDENTIFICATION_DIDS = {ModuleResult.LABELS[name]: did.request for name, did in IDENTIFICATION_FIELDS.items()}
+# Diagnostic CAN buses on the OBD connector: name -> (pin_plus, pin_min). Modules are scanned on the
+# primary bus unless their vag_modules entry names another one with "bus", or assign_buses finds
+# them answering only on another configured bus.
+PRIMARY_BUS = "VAG_bus"
+VAG_BUSES = {PRIMARY_BUS: (6, 14), "VAG_bus_3_11": (3, 11)}
+LATENCY_HISTORY_PATH = os.getenv("SCAN_LATENCY_HISTORY", "scan_latency_history.json")
+# SCAN_DEMUX=1: full scans run all modules of a bus concurrently over one stream (uds_demux)
+SCAN_DEMUX = os.getenv("SCAN_DEMUX", "") == "1"
+DEFAULT_MODULE_SECONDS = 3.0
+
+
+class ModuleLatencyHistory:
+    """Per-module scan durations (exponential moving average) used for the scan ETA."""
+
+    def __init__(self, path=LATENCY_HISTORY_PATH, smoothing=0.3):
+        self.path = path
+        self.smoothing = smoothing
+        self._seconds = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._seconds = json.load(f)
+            except Exception as e:
+                logging.warning(f"Could not load scan latency history: {e}")
+
+    def estimate(self, module_name):
+        if module_name in self._seconds:
+            return self._seconds[module_name]
+        if self._seconds:
+            return sum(self._seconds.values()) / len(self._seconds)
+        return DEFAULT_MODULE_SECONDS
+
+    def remaining(self, module_names):
+        return sum(self.estimate(name) for name in module_names)
+
+    def record(self, module_name, seconds):
+        previous = self._seconds.get(module_name)
+        if previous is None:
+            self._seconds[module_name] = seconds
+        else:
+            self._seconds[module_name] = previous + self.smoothing * (seconds - previous)
+
+    def save(self):
+        try:
+            with open(self.path, "w") as f:
+                json.dump(self._seconds, f, indent=1)
+        except Exception as e:
+            logging.warning(f"Could not save scan latency history: {e}")
+
+
+def bus_configuration(bus_name, pins):
+    pin_plus, pin_min = pins
+    return BusConfiguration(
+        bus_name=bus_name,
+        can_bus=CanBus(
+            pin_plus=pin_plus,
+            pin_min=pin_min,
+            can_protocol=CanProtocol.CAN_PROTOCOL_ISOTP,
+            can_bit_rate=CanBitRate.CAN_BIT_RATE_500,
+            transceiver=TransceiverSpeed.TRANSCEIVER_SPEED_HIGH,
+        ),
+    )
+
+
+def configure_vag_buses(openobd_session, buses=VAG_BUSES):
+    # All buses in one configure_bus stream; returns the names of the buses that are usable
+    try:
+        StreamHandler(openobd_session.configure_bus).send_and_close(
+            [bus_configuration(name, pins) for name, pins in buses.items()]
+        )
+        return list(buses)
+    except Exception as e:
+        if list(buses) == [PRIMARY_BUS]:
+            raise
+        logging.warning(f"Could not configure all buses ({e}), falling back to {PRIMARY_BUS} only")
+        StreamHandler(openobd_session.configure_bus).send_and_close(
+            [bus_configuration(PRIMARY_BUS, VAG_BUSES[PRIMARY_BUS])]
+        )
+        return [PRIMARY_BUS]
+
+
+def module_bus(module_info):
+    return module_info.get("bus", PRIMARY_BUS)
+
+
+def module_id_pairs(module_info):
+    # Main (request ID, response ID) pair first, then the module's alternate_ids
+    return [(module_info["request_id"], module_info["response_id"]), *module_info.get("alternate_ids", ())]
+
+
+_vin_buses = {}  # VIN -> {(request_id, response_id): bus name} of every address swept for that car
+_session_buses = weakref.WeakKeyDictionary()  # the same per session, for scans without a known VIN
+_buses_lock = threading.Lock()
+
+
+def _known_buses(openobd_session, vin):
+    with _buses_lock:
+        if vin:
+            return _vin_buses.setdefault(vin, {})
+        return _session_buses.setdefault(openobd_session, {})
+
+
+def assign_buses(openobd_session, modules, buses, vin=None):
+    # Modules on the primary bus that answer a probe on another configured bus but not on the
+    # primary one are moved there. Only the planned addresses are probed, one short probe round per
+    # bus, and only the first time an address is seen for this VIN (or session without a VIN);
+    # modules whose vag_modules entry names their bus are never probed.
+    secondary = [b for b in buses if b != PRIMARY_BUS]
+    unassigned = {name: info for name, info in modules.items()
+                  if module_bus(info) == PRIMARY_BUS and not info.get("fixed_bus")}
+    if not secondary or not unassigned:
+        return modules
+    known = _known_buses(openobd_session, vin)
+    candidates = [ids for ids in dict.fromkeys((info["request_id"], info["response_id"]) for info in unassigned.values())
+                  if ids not in known]
+    if candidates:
+        found = {(req, res): PRIMARY_BUS for req, res, _ in sweep_addresses(openobd_session, PRIMARY_BUS, candidates)}
+        for bus_name in secondary:
+            remaining = [ids for ids in candidates if ids not in found]
+            for req, res, _ in sweep_addresses(openobd_session, bus_name, remaining):
+                found[(req, res)] = bus_name
+        with _buses_lock:
+            known.update({ids: found.get(ids, PRIMARY_BUS) for ids in candidates})
+    assigned = dict(modules)
+    for name, info in unassigned.items():
+        bus_name = known.get((info["request_id"], info["response_id"]))
+        if bus_name in secondary:
+            logging.info(f"{name} answers on {bus_name}")
+            assigned[name] = {**info, "bus": bus_name}
+    return assigned
+
+
+def _read_text(limiter, module_socket, did):
+    # Through uds_engine so NRC 21 reaches the limiter and NRCs are counted; failures raise RequestFailure
+    response = uds_request(module_socket, did.request, limiter=limiter)
+    return decode_text(response.after(did.positive), default=None) or None
+
+
+def read_module_identification(openobd_session, module_name, module_info, bus_name=None, previous=None, details=None):
+    # With `previous` (delta scan) part number and software version are read first as a fingerprint;
+    # when both still match, `previous` itself is returned and nothing else is read. Otherwise the full
+    # identification is read and, if a `details` dict is given, the DETAIL_FIELDS are stored in it.
+    # A module that does not answer on its main ID pair is retried on its alternate_ids; any other
+    # failure (an NRC, no answer on every pair) fails the module with the RequestFailure.
+    bus_name = bus_name or module_bus(module_info)
+    limiter = bus_limiter(openobd_session, bus_name)
+    failure = None
+    for request_id, response_id in module_id_pairs(module_info):
+        channel = IsotpChannel(
+            bus_name=bus_name,
+            request_id=request_id,
+            response_id=response_id,
+            padding=Padding.PADDING_ENABLED,
+        )
+        module_socket = IsotpSocket(openobd_session, channel)
+        try:
+            return _read_identification(limiter, module_socket, module_name, module_info, previous, details)
+        except RequestFailure as e:
+            if e.reason != NO_RESPONSE:
+                raise
+            failure = failure or e
+        finally:
+            module_socket.stop_stream()
+    raise failure
+
+
+def _read_identification(limiter, module_socket, module_name, module_info, previous, details):
+    if previous is not None and previous.part_number and previous.software_version:
+        # A swapped module can carry the same software version under another part number
+        if (_read_text(limiter, module_socket, READ_VAG_PART_NUMBER) == previous.part_number
+                and _read_text(limiter, module_socket, READ_SOFTWARE_VERSION) == previous.software_version):
+            return previous
+
+    if not module_info.get("skip_1003"):
+        uds_request(module_socket, "1003", limiter=limiter)
+
+    result = ModuleResult(module_name)
+    for name, did in IDENTIFICATION_FIELDS.items():
+        setattr(result, name, _read_text(limiter, module_socket, did))
+    if details is not None:
+        for name, did in DETAIL_FIELDS.items():
+            try:
+                details[name] = _read_text(limiter, module_socket, did)
+            except RequestFailure as e:
+                # Snapshot extras only: a module without them is still identified
+                logging.info(f"{module_name}: {name} not read: {e}")
+                details[name] = None
+    return result
+
+
+def read_vehicle_vin(openobd_session, module_info, bus_name=None):
+    # VIN from one module (normally the ECM), used to look up the vehicle snapshot before a delta scan
+    bus_name = bus_name or module_bus(module_info)
+    module_socket = IsotpSocket(openobd_session, IsotpChannel(
+        bus_name=bus_name,
+        request_id=module_info["request_id"],
+        response_id=module_info["response_id"],
+        padding=Padding.PADDING_ENABLED,
+    ))
+    try:
+        return _read_text(bus_limiter(openobd_session, bus_name), module_socket, READ_VIN)
+    except RequestFailure as e:
+        logging.warning(f"VIN not read: {e}")
+        return None
+    finally:
+        module_socket.stop_stream()
+
+
+def _scan_bus(openobd_session, modules, bus_name, snapshot=None, details=None):
+    for module_name, module_info in modules.items():
+        yield "started", module_name, None, None
+        start = time.monotonic()
+        previous = snapshot.get(module_name) if snapshot is not None else None
+        module_details = {} if details is not None else None
+        try:
+            entry = read_module_identification(
+                openobd_session, module_name, module_info, bus_name, previous, module_details
+            )
+        except Exception as e:
+            yield "failed", module_name, e, time.monotonic() - start
+        else:
+            if previous is not None and entry is previous:
+                yield "unchanged", module_name, entry, time.monotonic() - start
+                continue
+            if module_details is not None:
+                details[module_name] = module_details
+            yield "done", module_name, entry, time.monotonic() - start
+
+
+def scan_modules(openobd_session, modules, buses=(PRIMARY_BUS,), snapshot=None, details=None, vin=None):
+    """
+    Scans the given modules and yields an event as soon as each one starts and finishes:
+    ("started", name, None, None), ("done", name, ModuleResult, seconds) or ("failed", name, error, seconds).
+    Modules on the same bus are scanned one by one; different buses are scanned in parallel.
+    Delta scan: with a `snapshot` ({name: ModuleResult} from the previous scan of this vehicle), modules
+    whose fingerprint did not change yield ("unchanged", name, previous ModuleResult, seconds), and the
+    detail DIDs of re-read modules are collected in `details`.
+    With more than one bus configured, modules are first mapped to the bus they answer on (assign_buses,
+    remembered per `vin` when given).
+    """
+    modules = assign_buses(openobd_session, modules, buses, vin)
+    if SCAN_DEMUX and snapshot is None:
+        from uds_demux import scan_modules_demux  # uds_demux builds on this module
+
+        yield from scan_modules_demux(openobd_session, modules, buses)
+        return
+
+    by_bus = {}
+    for module_name, module_info in modules.items():
+        by_bus.setdefault(module_bus(module_info), {})[module_name] = module_info
+
+    for bus_name in [b for b in by_bus if b not in buses]:
+        for module_name in by_bus.pop(bus_name):
+            yield "failed", module_name, RuntimeError(f"Bus {bus_name} is not configured"), 0.0
+
+    if len(by_bus) <= 1:
+        for bus_name, bus_modules in by_bus.items():
+            yield from _scan_bus(openobd_session, bus_modules, bus_name, snapshot, details)
+        return
+
+    events = queue.Queue()
+    stop = threading.Event()
+
+    def scan_bus(bus_name, bus_modules):
+        try:
+            for event in _scan_bus(openobd_session, bus_modules, bus_name, snapshot, details):
+                events.put(event)
+                if stop.is_set():
+                    break
+        finally:
+            events.put(None)
+
+    with ThreadPoolExecutor(max_workers=len(by_bus), thread_name_prefix="bus-scan") as pool:
+        for bus_name, bus_modules in by_bus.items():
+            pool.submit(scan_bus, bus_name, bus_modules)
+        running = len(by_bus)
+        try:
+            while running:
+                event = events.get()
+                if event is None:
+                    running -= 1
+                else:
+                    yield event
+        finally:
+            stop.set()  # Consumer stopped early: let the bus workers finish their current module
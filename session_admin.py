@@ -0,0 +1,66 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import streamlit as st
+from openobd import *
+
+# The session list is shared by every user of this server for a short time, so reruns caused
+# by typing or clicking elsewhere in the app don't each pay an OpenOBD round trip.
+SESSION_LIST_TTL = 15
+MAX_PARALLEL_INTERRUPTS = 8
+
+
+@st.cache_data(ttl=SESSION_LIST_TTL, show_spinner=False)
+def fetch_session_list(_get_openobd):
+    sessions = _get_openobd().get_session_list().sessions
+    return [(s.id, s.state, s.created_at) for s in sessions]
+
+
+def interrupt_sessions(openobd, session_ids):
+    # Interrupts all sessions concurrently and yields (session_id, error) as each one finishes
+    def interrupt(sid):
+        openobd.interrupt_session(session_id=SessionId(value=sid))
+
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_INTERRUPTS, len(session_ids))) as pool:
+        futures = {pool.submit(interrupt, sid): sid for sid in session_ids}
+        for future in as_completed(futures):
+            yield futures[future], future.exception()
+
+
+def render_exit_session_expander(get_openobd, title="🚪 Exit Session OpenOBD (if stuck...)"):
+    with st.expander(title):
+        if st.button("🔄 Refresh session list"):
+            fetch_session_list.clear()
+
+        try:
+            sessions = fetch_session_list(get_openobd)
+        except Exception as e:
+            st.error(f"❌ Could not load OpenOBD sessions: {e}")
+            sessions = []
+
+        if not sessions:
+            st.success("✅ No active OpenOBD sessions.")
+        else:
+            st.warning("⚠️ Active OpenOBD sessions detected:")
+            session_display = {
+                f"{i + 1}. ID: {sid} | State: {state} | Created: {created_at}": sid
+                for i, (sid, state, created_at) in enumerate(sessions)
+            }
+            selected_display = st.multiselect("Select session(s) to close:", options=list(session_display))
+
+            if selected_display and st.button(f"Close {len(selected_display)} session(s)"):
+                selected_ids = [session_display[display] for display in selected_display]
+                status = {sid: st.empty() for sid in selected_ids}
+                for sid in selected_ids:
+                    status[sid].info(f"⏳ Closing session {sid}...")
+
+                for sid, error in interrupt_sessions(get_openobd(), selected_ids):
+                    if error:
+                        logging.error(f"Failed to close session {sid}: {error}")
+                        status[sid].error(f"❌ Failed to close session {sid}: {error}")
+                    else:
+                        status[sid].success(f"✅ Session {sid} closed.")
+                fetch_session_list.clear()
+
+        if st.button("Logout and Exit"):
+            st.success("👋 Logged out. Application will now exit.")
+            st.stop()
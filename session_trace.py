@@ -0,0 +1,312 @@
+import heapq
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from datetime import datetime
+from openobd import *
+from metrics import MeteredOpenOBD
+from openobd_protocol.Messages import Empty_pb2 as grpcEmpty
+from openobd_protocol.Session.Messages import Session_pb2 as grpcSession
+from openobd_protocol.SessionController.Messages import SessionController_pb2 as grpcSessionController
+
+# Record and replay of OpenOBD sessions at the gRPC stream level, below IsotpSocket and the UDS
+# engine, so every app records and replays without code changes of its own:
+#   SESSION_RECORD=1          every session is wrapped and its ISO-TP traffic written to TRACE_DIR
+#   SESSION_REPLAY=<trace>    no vehicle: sessions answer from the trace, at SESSION_REPLAY_SPEED
+#                             (1 = recorded timing, 10 = ten times faster, 0 = no delays)
+# Trace format: b"VTRC" + version, then one record per ISO-TP message:
+#   <QBHIIH  microseconds since start, direction, stream, request id, response id, payload length
+# followed by the payload bytes.
+
+TRACE_DIR = os.getenv("SESSION_TRACE_DIR", "traces")
+RECORD_SESSIONS = os.getenv("SESSION_RECORD", "") == "1"
+REPLAY_TRACE = os.getenv("SESSION_REPLAY", "")
+REPLAY_SPEED = float(os.getenv("SESSION_REPLAY_SPEED", "1.0"))
+
+MAGIC = b"VTRC\x01"
+RECORD = struct.Struct("<QBHIIH")
+OUTGOING = 0
+INCOMING = 1
+
+
+class TraceRecorder:
+
+    def __init__(self, path):
+        self.path = path
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._streams = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+
+    def new_stream(self):
+        with self._lock:
+            self._streams += 1
+            return self._streams
+
+    def record(self, stream_id, direction, message):
+        payload = bytes.fromhex(message.payload)
+        micros = int((time.monotonic() - self._start) * 1_000_000)
+        header = RECORD.pack(micros, direction, stream_id, message.channel.request_id,
+                             message.channel.response_id, len(payload))
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(header + payload)
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_trace(path):
+    # Yields (seconds, direction, stream_id, request_id, response_id, payload_hex)
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a session trace")
+        while header := f.read(RECORD.size):
+            micros, direction, stream_id, request_id, response_id, length = RECORD.unpack(header)
+            yield micros / 1_000_000, direction, stream_id, request_id, response_id, f.read(length).hex().upper()
+
+
+# === Recording ===
+
+class _RecordedResponses:
+    # Incoming side of a recorded stream; StreamHandler needs cancel() on it
+
+    def __init__(self, responses, recorder, stream_id):
+        self._responses = responses
+        self._recorder = recorder
+        self._stream_id = stream_id
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        message = next(self._responses)
+        self._recorder.record(self._stream_id, INCOMING, message)
+        return message
+
+    def cancel(self):
+        self._responses.cancel()
+
+
+class RecordingSession:
+
+    def __init__(self, session, recorder):
+        self._session = session
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def open_isotp_stream(self, isotp_messages):
+        stream_id = self.recorder.new_stream()
+
+        def outgoing():
+            for message in isotp_messages:
+                self.recorder.record(stream_id, OUTGOING, message)
+                yield message
+
+        return _RecordedResponses(self._session.open_isotp_stream(outgoing()), self.recorder, stream_id)
+
+    def finish(self, service_result):
+        try:
+            return self._session.finish(service_result)
+        finally:
+            self.recorder.close()
+            logging.info(f"Session trace written to {self.recorder.path}")
+
+
+class RecordingOpenOBD:
+
+    def __init__(self, client, trace_dir=TRACE_DIR):
+        self._client = client
+        self.trace_dir = trace_dir
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def start_session_on_ticket(self, ticket_id):
+        session = self._client.start_session_on_ticket(ticket_id)
+        path = os.path.join(self.trace_dir, f"{ticket_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.vtrace")
+        return RecordingSession(session, TraceRecorder(path))
+
+
+# === Replay ===
+
+class ReplayTrace:
+    """Recorded exchanges per channel: request payload -> responses with their delay after the request."""
+
+    def __init__(self, path):
+        self.path = path
+        self._exchanges = defaultdict(list)  # (request_id, response_id) -> [(request, [(delay, response)])]
+        self._last = {}  # (channel, request) -> responses, replayed again once the recorded ones run out
+        self._lock = threading.Lock()
+        open_exchange = {}  # (stream, request_id, response_id) -> exchange awaiting its responses
+        for seconds, direction, stream_id, request_id, response_id, payload in read_trace(path):
+            channel = (request_id, response_id)
+            # One stream can carry several ECUs (uds_demux), so responses go to the last request
+            # on the same stream and channel
+            key = (stream_id, request_id, response_id)
+            if direction == OUTGOING:
+                exchange = (payload, [], seconds)
+                self._exchanges[channel].append(exchange)
+                open_exchange[key] = exchange
+            elif key in open_exchange:
+                request, responses, sent_at = open_exchange[key]
+                responses.append((seconds - sent_at, payload))
+
+    def answer(self, channel, request):
+        # Responses to the first unused recorded exchange of this request on this channel
+        with self._lock:
+            exchanges = self._exchanges.get(channel, [])
+            for i, (recorded, responses, _) in enumerate(exchanges):
+                if recorded == request:
+                    del exchanges[i]
+                    self._last[channel, request] = responses
+                    return responses
+            return self._last.get((channel, request), [])
+
+
+class _ReplayResponses:
+    # Requests are read in a thread of their own and their recorded responses scheduled by due time,
+    # so requests to several ECUs on one stream (uds_demux) are answered concurrently
+
+    def __init__(self, trace, requests, speed):
+        self._trace = trace
+        self._speed = speed
+        self._due = []  # heap of (due, seq, channel, payload)
+        self._seq = 0
+        self._requests_done = False
+        self._cancelled = False
+        self._condition = threading.Condition()
+        threading.Thread(target=self._read_requests, args=(requests,), name="replay-requests", daemon=True).start()
+
+    def _read_requests(self, requests):
+        try:
+            for message in requests:
+                channel = (message.channel.request_id, message.channel.response_id)
+                responses = self._trace.answer(channel, message.payload.upper())
+                sent_at = time.monotonic()
+                with self._condition:
+                    for delay, payload in responses:
+                        due = sent_at + delay / self._speed if self._speed > 0 else sent_at
+                        self._seq += 1
+                        heapq.heappush(self._due, (due, self._seq, message.channel, payload))
+                    self._condition.notify_all()
+        finally:
+            with self._condition:
+                self._requests_done = True
+                self._condition.notify_all()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._condition:
+            while not self._cancelled:
+                if self._due:
+                    due, _, channel, payload = self._due[0]
+                    wait = due - time.monotonic()
+                    if wait <= 0:
+                        heapq.heappop(self._due)
+                        return IsotpMessage(channel=channel, payload=payload)
+                    self._condition.wait(wait)
+                elif self._requests_done:
+                    break
+                else:
+                    self._condition.wait()
+            raise StopIteration
+
+    def cancel(self):
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify_all()
+
+
+class _IdleStream:
+    # Session token stream of a replayed session: never yields, ends on cancel
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self._cancelled.wait()
+        raise StopIteration
+
+    def cancel(self):
+        self._cancelled.set()
+
+
+class ReplaySession:
+
+    def __init__(self, trace, speed=REPLAY_SPEED):
+        self.trace = trace
+        self.speed = speed
+
+    def id(self):
+        return f"replay:{os.path.basename(self.trace.path)}"
+
+    def update_session_token(self, session_token):
+        pass
+
+    def authenticate(self, request: grpcEmpty.EmptyMessage | None = None) -> grpcSession.SessionToken:
+        return grpcSession.SessionToken(value="replay")
+
+    def open_session_token_stream(self, request: grpcEmpty.EmptyMessage | None = None) -> Iterator[grpcSession.SessionToken]:
+        return _IdleStream()
+
+    def configure_bus(self, bus_configurations: Iterator[BusConfiguration]) -> grpcEmpty.EmptyMessage:
+        for _ in bus_configurations:
+            pass
+        return grpcEmpty.EmptyMessage()
+
+    def open_isotp_stream(self, isotp_messages: Iterator[IsotpMessage]) -> Iterator[IsotpMessage]:
+        return _ReplayResponses(self.trace, isotp_messages, self.speed)
+
+    def finish(self, service_result):
+        return grpcEmpty.EmptyMessage()
+
+
+class ReplayOpenOBD:
+    """Stands in for OpenOBD: every session replays the same trace."""
+
+    def __init__(self, path, speed=REPLAY_SPEED):
+        self.path = path
+        self.speed = speed
+
+    def start_session_on_ticket(self, ticket_id):
+        return ReplaySession(ReplayTrace(self.path), self.speed)
+
+    def get_session_list(self):
+        return grpcSessionController.SessionInfoList()
+
+    def interrupt_session(self, session_id):
+        return None
+
+
+def openobd_client(**kwargs):
+    # OpenOBD client for the apps: the real one, recording, or replaying a trace (see the env vars
+    # above); sessions are always counted in the metrics
+    if REPLAY_TRACE:
+        logging.info(f"Replaying session trace {REPLAY_TRACE} at speed {REPLAY_SPEED}")
+        return MeteredOpenOBD(ReplayOpenOBD(REPLAY_TRACE, REPLAY_SPEED))
+    client = OpenOBD(**kwargs)
+    return MeteredOpenOBD(RecordingOpenOBD(client) if RECORD_SESSIONS else client)
+
+
+if __name__ == "__main__":
+    # python session_trace.py <trace>: prints the recorded exchanges
+    for seconds, direction, stream_id, request_id, response_id, payload in read_trace(sys.argv[1]):
+        arrow = "->" if direction == OUTGOING else "<-"
+        print(f"{seconds:10.3f}s  #{stream_id:<3} {request_id:08X}/{response_id:08X} {arrow} {payload}")
@@ -0,0 +1,107 @@
+import json
+import os
+from dataclasses import is_dataclass
+from datetime import datetime
+import pandas as pd
+import streamlit as st
+from pytz import timezone
+from metrics import SHEETS_LATENCY
+from perf import timed
+from scan_records import to_frame
+
+# Google Sheets helpers shared by the scanner apps. The Sheets stack is imported on first use;
+# credentials and the client are created once per server process through st.cache_resource.
+
+
+@st.cache_resource
+def load_google_credentials():
+    google_credentials_str = os.getenv("GOOGLE_DRIVE_CREDENTIALS")
+    if not google_credentials_str:
+        st.error("❌ ERROR: Missing Google Drive Credentials! Set 'GOOGLE_DRIVE_CREDENTIALS' in Replit Secrets.")
+        st.stop()
+    return json.loads(google_credentials_str)
+
+
+@st.cache_resource
+def authenticate_google_drive():
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    scopes = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+    credentials = ServiceAccountCredentials.from_json_keyfile_dict(load_google_credentials(), scopes)
+    return gspread.authorize(credentials)
+
+
+def get_google_sheet(sheet_name, worksheet_name):
+    import gspread
+
+    try:
+        client = authenticate_google_drive()
+        sheet = client.open(sheet_name).worksheet(worksheet_name)
+        return sheet
+    except gspread.exceptions.WorksheetNotFound:
+        st.warning(f"⚠ Worksheet '{worksheet_name}' not found. Creating it...")
+        sheet = client.open(sheet_name).add_worksheet(title=worksheet_name, rows="1000", cols="20")
+        return sheet
+    except Exception as e:
+        st.error(f"❌ ERROR accessing Google Sheets: {e}")
+        st.stop()
+
+
+@timed("Sheets write")
+@SHEETS_LATENCY.time(operation="save")
+def save_data_to_google_sheets(data, sheet_name, worksheet_name):
+    # data: scan records (scan_records) or plain dicts; the caller's entries are left untouched
+    from gspread_dataframe import set_with_dataframe, get_as_dataframe
+
+    try:
+        if not data:
+            return
+        timestamp = datetime.now(timezone("Europe/Brussels")).strftime("%Y-%m-%d %H:%M:%S")
+        df_new = to_frame(data, missing="N/A") if is_dataclass(data[0]) else pd.DataFrame(data).fillna("N/A")
+        df_new["Timestamp"] = timestamp
+        sheet = get_google_sheet(sheet_name, worksheet_name)
+        existing_data = get_as_dataframe(sheet, evaluate_formulas=True, header=0)
+        existing_data.dropna(how="all", inplace=True)
+        combined_data = pd.concat([existing_data, df_new], ignore_index=True)
+        set_with_dataframe(sheet, combined_data)
+        st.success(f"✅ Data saved to {worksheet_name}")
+    except Exception as e:
+        st.error(f"❌ ERROR saving data to {worksheet_name}: {e}")
+
+
+@SHEETS_LATENCY.time(operation="load_sheet3")
+def load_sheet3_db(sheet_name, worksheet_name):
+    try:
+        sheet = get_google_sheet(sheet_name, worksheet_name)
+        # Keep versions as text: "0010" must not become 10
+        db = pd.DataFrame(sheet.get_all_records(numericise_ignore=["all"]))
+        db.fillna("", inplace=True)
+        return db
+    except Exception as e:
+        st.error(f"❌ ERROR loading Sheet3 database: {e}")
+        return pd.DataFrame()
+
+
+@timed("Sheets write")
+@SHEETS_LATENCY.time(operation="append_sheet3")
+def append_new_sheet3_versions(sheet_name, worksheet_name, new_versions):
+    # new_versions: [(part_number, version)] first seen in this scan; appended, never rewritten
+    if not new_versions:
+        st.info("✅ Sheet3 already contains all entries. No update needed.")
+        return
+
+    st.info("➕ Updating Sheet3 with new entries...")
+    sheet3 = get_google_sheet(sheet_name, worksheet_name)
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    header = sheet3.row_values(1)
+    rows = []
+    if not header:
+        # Empty sheet: write the header with the first rows, the readers take row 1 as column names
+        header = ["VAG Part Number", "Available Versions", "Timestamp"]
+        rows.append(header)
+    for part_no, version in new_versions:
+        values = {"VAG Part Number": part_no, "Available Versions": version, "Timestamp": timestamp}
+        rows.append([values.get(column, "") for column in header])
+    sheet3.append_rows(rows, value_input_option="RAW")
+    st.success("✅ Sheet3 updated.")
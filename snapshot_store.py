@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+from scan_records import ModuleResult, as_dict, from_dict
+
+# Last known identification of every module per VIN, one JSON file per vehicle, plus a JSON-lines
+# log of what changed between scans. Delta scans use the snapshot to skip modules whose software
+# version is unchanged and only log (and upload) the differences.
+
+SNAPSHOT_DIR = os.getenv("VEHICLE_SNAPSHOT_DIR", "vehicle_snapshots")
+COMPARED_FIELDS = ("part_number", "software_version", "vin", "asam_file_id", "asam_file_version")
+
+
+def diff_modules(previous, current, failed=()):
+    # previous/current: {module: {field: value}}; returns a list of change dicts
+    changes = []
+    for module, entry in current.items():
+        before = previous.get(module)
+        if before is None:
+            changes.append({"module": module, "change": "added", "field": None, "before": None, "after": None})
+            continue
+        for field in COMPARED_FIELDS:
+            if field in entry and field in before and entry[field] != before[field]:
+                changes.append({"module": module, "change": "changed", "field": field,
+                                "before": before[field], "after": entry[field]})
+    for module in failed:
+        if module in previous:
+            changes.append({"module": module, "change": "no_response", "field": None, "before": None, "after": None})
+    return changes
+
+
+class SnapshotStore:
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, vin, suffix):
+        return os.path.join(self.root, f"{''.join(c for c in vin if c.isalnum())}{suffix}")
+
+    def load(self, vin):
+        path = self._path(vin, ".json")
+        if not vin or not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def module_results(snapshot):
+        # {module: ModuleResult} for scan_modules(snapshot=...)
+        if not snapshot:
+            return {}
+        return {name: from_dict(ModuleResult, entry) for name, entry in snapshot["modules"].items()}
+
+    def save(self, vin, results, details, scanned_at, failed=()):
+        # Merges this scan into the vehicle snapshot and logs the diff; returns the diff
+        with self._lock:
+            snapshot = self.load(vin) or {"vin": vin, "modules": {}}
+            previous = snapshot["modules"]
+            current = {}
+            for result in results:
+                entry = dict(previous.get(result.module, {}))
+                entry.update(as_dict(result))
+                entry.update(details.get(result.module, {}))
+                current[result.module] = entry
+
+            changes = diff_modules(previous, current, failed)
+            snapshot["modules"] = {**previous, **current}
+            snapshot["scanned_at"] = scanned_at
+
+            path = self._path(vin, ".json")
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(snapshot, f, indent=1)
+            os.replace(f"{path}.tmp", path)
+            if changes:
+                with open(self._path(vin, ".diffs.jsonl"), "a") as f:
+                    f.write(json.dumps({"scanned_at": scanned_at, "changes": changes}) + "\n")
+            return changes
+
+    def diffs(self, vin, limit=20):
+        path = self._path(vin, ".diffs.jsonl")
+        if not vin or not os.path.exists(path):
+            return []
+        with open(path) as f:
+            lines = f.readlines()[-limit:]
+        return [json.loads(line) for line in reversed(lines)]
@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from openobd import *
+
+# TesterPresent with suppressPosRspMsgIndicationBit set: the ECU resets its S3 timer and sends nothing back
+TESTER_PRESENT_SUPPRESSED = "3E80"
+DEFAULT_INTERVAL = float(os.getenv("TESTER_PRESENT_INTERVAL", "2.0"))
+
+
+class _KeepAliveEntry:
+    __slots__ = ("socket", "channel", "lock", "last_activity", "last_use", "idle_timeout", "on_expire")
+
+    def __init__(self, socket, channel, idle_timeout=None, on_expire=None):
+        self.socket = socket
+        self.channel = channel
+        self.lock = threading.Lock()
+        self.last_activity = time.monotonic()
+        self.last_use = self.last_activity  # Last real request or touch(); keep-alives do not count
+        self.idle_timeout = idle_timeout
+        self.on_expire = on_expire
+
+
+class TesterPresentScheduler:
+    """
+    Keeps extended diagnostic sessions (1003) alive while a flow is busy with slow work.
+
+    Every registered socket gets a suppressed 3E80 once it has been idle for `interval` seconds.
+    Real requests must go through `busy(sock)` so the keep-alive never interleaves with them.
+    With `idle_timeout`, a socket not used for that long is unregistered and `on_expire()` is called,
+    so a session held for a user who walked away does not stay open forever.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self._entries = {}
+        self._entries_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def register(self, sock, channel, idle_timeout=None, on_expire=None):
+        with self._entries_lock:
+            self._entries[id(sock)] = _KeepAliveEntry(sock, channel, idle_timeout, on_expire)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tester-present", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def unregister(self, sock):
+        with self._entries_lock:
+            entry = self._entries.pop(id(sock), None)
+        if entry:
+            # Wait for a keep-alive that may be on the wire right now
+            with entry.lock:
+                pass
+
+    def touch(self, sock):
+        # Counts as use for the idle timeout without sending anything
+        with self._entries_lock:
+            entry = self._entries.get(id(sock))
+        if entry:
+            entry.last_use = time.monotonic()
+
+    def is_registered(self, sock):
+        with self._entries_lock:
+            return id(sock) in self._entries
+
+    @contextmanager
+    def busy(self, sock):
+        with self._entries_lock:
+            entry = self._entries.get(id(sock))
+        if entry is None:
+            yield
+            return
+        with entry.lock:
+            try:
+                yield
+            finally:
+                # Any request resets the ECU's S3 timer as well
+                entry.last_activity = entry.last_use = time.monotonic()
+
+    def stop_stream(self, sock):
+        self.unregister(sock)
+        sock.stop_stream()
+
+    def _send_tester_present(self, entry):
+        if entry.socket.stream_handler.stream_finished:
+            raise OpenOBDStreamStoppedException("Socket stream already stopped.")
+        message = IsotpMessage(channel=entry.channel, payload=TESTER_PRESENT_SUPPRESSED)
+        entry.socket.stream_handler.send(message)
+        entry.last_activity = time.monotonic()
+
+    def _run(self):
+        while True:
+            with self._entries_lock:
+                if not self._entries:
+                    self._thread = None
+                    return
+                entries = list(self._entries.values())
+
+            next_due = self.interval
+            for entry in entries:
+                if entry.idle_timeout and time.monotonic() - entry.last_use > entry.idle_timeout:
+                    self._expire(entry)
+                    continue
+                remaining = entry.last_activity + self.interval - time.monotonic()
+                if remaining > 0:
+                    next_due = min(next_due, remaining)
+                    continue
+                if not entry.lock.acquire(blocking=False):
+                    # A real request is in flight, it keeps the session alive by itself
+                    continue
+                try:
+                    self._send_tester_present(entry)
+                except Exception as e:
+                    logging.warning(f"TesterPresent stopped for {entry.channel.request_id:03X}: {e}")
+                    with self._entries_lock:
+                        self._entries.pop(id(entry.socket), None)
+                finally:
+                    entry.lock.release()
+
+            self._wakeup.wait(max(0.05, next_due))
+            self._wakeup.clear()
+
+    def _expire(self, entry):
+        logging.info(f"Keep-alive for {entry.channel.request_id:03X} idle for {entry.idle_timeout:.0f}s, releasing it")
+        self.unregister(entry.socket)
+        if entry.on_expire:
+            # Own thread: closing a stream can block, the other sockets still need their keep-alives
+            threading.Thread(target=self._call_on_expire, args=(entry,), name="tester-present-expire", daemon=True).start()
+
+    def _call_on_expire(self, entry):
+        try:
+            entry.on_expire()
+        except Exception as e:
+            logging.error(f"Idle expiry for {entry.channel.request_id:03X} failed: {e}")
+
+
+# Shared by every flow in the process (Streamlit keeps imported modules across reruns)
+keepalive = TesterPresentScheduler()
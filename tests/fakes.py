@@ -0,0 +1,42 @@
+import queue
+import threading
+from openobd import IsotpMessage
+
+
+class FakeVehicle:
+    """Session stand-in: ECUs by (request_id, response_id) answer request payloads after `delay` seconds."""
+
+    def __init__(self, ecus, delays=None):
+        self.ecus = ecus  # (request_id, response_id) -> {request: [responses]}
+        self.delays = delays or {}
+
+    def open_isotp_stream(self, requests):
+        return _FakeResponses(self, requests)
+
+
+class _FakeResponses:
+
+    def __init__(self, vehicle, requests):
+        self._vehicle = vehicle
+        self._queue = queue.Queue()
+        threading.Thread(target=self._answer, args=(requests,), daemon=True).start()
+
+    def _answer(self, requests):
+        for message in requests:
+            channel = (message.channel.request_id, message.channel.response_id)
+            answers = self._vehicle.ecus.get(channel, {}).get(message.payload.upper(), [])
+            for payload in answers:
+                response = IsotpMessage(channel=message.channel, payload=payload)
+                threading.Timer(self._vehicle.delays.get(channel, 0.0), self._queue.put, (response,)).start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        message = self._queue.get()
+        if message is None:
+            raise StopIteration
+        return message
+
+    def cancel(self):
+        self._queue.put(None)
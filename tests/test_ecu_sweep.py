@@ -0,0 +1,18 @@
+import time
+
+from ecu_sweep import sweep_addresses
+from fakes import FakeVehicle
+from scan_stream import PRIMARY_BUS
+
+CANDIDATES = [(request_id, request_id + 0x6A) for request_id in range(0x700, 0x740)]
+
+
+def test_sweep_finds_responders_without_waiting_on_stream_close():
+    vehicle = FakeVehicle({(0x714, 0x77E): {"3E00": ["7E00"]}, (0x70E, 0x778): {"3E00": ["7F3E11"]}})
+    start = time.monotonic()
+    responders = sweep_addresses(vehicle, PRIMARY_BUS, CANDIDATES, timeout=0.1)
+    elapsed = time.monotonic() - start
+
+    assert [(request_id, answer) for request_id, _, answer in responders] == [(0x70E, "7F3E11"), (0x714, "7E00")]
+    # 64 candidates in two rounds of 32 probes of at most 0.1 s each
+    assert elapsed < 2.0
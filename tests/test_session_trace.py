@@ -0,0 +1,42 @@
+from fakes import FakeVehicle
+from scan_stream import PRIMARY_BUS
+from session_trace import RecordingSession, ReplayOpenOBD, TraceRecorder
+from uds_demux import scan_modules_demux
+
+MODULES = {
+    "01_Engine": {"request_id": 0x7E0, "response_id": 0x7E8},
+    "09_Central Electrics": {"request_id": 0x70E, "response_id": 0x778},
+    "17_Dashboard": {"request_id": 0x714, "response_id": 0x77E},
+}
+
+
+def ecu_answers(part_number, software_version):
+    return {
+        "1003": ["5003003201F4"],
+        "22F190": ["62F190" + b"WVWZZZ1KZ8W000001".hex().upper()],
+        "22F187": ["62F187" + part_number.encode().hex().upper()],
+        "22F189": ["62F189" + software_version.encode().hex().upper()],
+    }
+
+
+def scan(session):
+    events = scan_modules_demux(session, MODULES, (PRIMARY_BUS,))
+    return {name: (kind, result) for kind, name, result, _ in events if kind != "started"}
+
+
+def test_replay_of_a_demux_trace_matches_each_module(tmp_path):
+    ecus, delays = {}, {}
+    for i, info in enumerate(MODULES.values()):
+        ids = (info["request_id"], info["response_id"])
+        ecus[ids] = ecu_answers(f"5Q0907{i}", f"00{i}0")
+        delays[ids] = 0.01 * (len(MODULES) - i)  # later requests are answered first
+    path = str(tmp_path / "demux.vtrace")
+    recording = RecordingSession(FakeVehicle(ecus, delays), TraceRecorder(path))
+    recorded = scan(recording)
+    recording.recorder.close()
+
+    replayed = scan(ReplayOpenOBD(path, speed=0).start_session_on_ticket("T1"))
+
+    assert {kind for kind, _ in recorded.values()} == {"done"}
+    assert replayed == recorded
+    assert recorded["17_Dashboard"][1].part_number == "5Q09072"
@@ -0,0 +1,182 @@
+from functools import lru_cache
+from scan_records import DtcRecord
+
+# UDS response codec. openobd hands responses over as hex strings; they are converted to bytes
+# exactly once here and every decoder below works on memoryview slices of those bytes, so a
+# response is never re-sliced or re-converted as a string.
+
+NEGATIVE_RESPONSE = 0x7F
+POSITIVE_OFFSET = 0x40
+
+# Bytes a positive response echoes back after its SID (sub-function, DID, routine id)
+ECHO_LENGTH = {
+    0x50: 1,  # DiagnosticSessionControl
+    0x51: 1,  # ECUReset
+    0x54: 0,  # ClearDiagnosticInformation
+    0x59: 1,  # ReadDTCInformation
+    0x62: 2,  # ReadDataByIdentifier
+    0x6E: 2,  # WriteDataByIdentifier
+    0x71: 3,  # RoutineControl
+    0x7E: 1,  # TesterPresent
+}
+DID_SERVICES = (0x62, 0x6E, 0x71)
+
+NRC_NAMES = {
+    0x10: "generalReject",
+    0x11: "serviceNotSupported",
+    0x12: "subFunctionNotSupported",
+    0x13: "incorrectMessageLengthOrInvalidFormat",
+    0x14: "responseTooLong",
+    0x21: "busyRepeatRequest",
+    0x22: "conditionsNotCorrect",
+    0x24: "requestSequenceError",
+    0x31: "requestOutOfRange",
+    0x33: "securityAccessDenied",
+    0x35: "invalidKey",
+    0x72: "generalProgrammingFailure",
+    0x78: "requestCorrectlyReceivedResponsePending",
+    0x7E: "subFunctionNotSupportedInActiveSession",
+    0x7F: "serviceNotSupportedInActiveSession",
+}
+
+DID_VIN = 0xF190
+DID_VAG_PART_NUMBER = 0xF187
+DID_SOFTWARE_VERSION = 0xF189
+DID_SERIAL_NUMBER = 0xF18C
+DID_ASAM_FILE_ID = 0xF19E
+DID_ASAM_FILE_VERSION = 0xF1A2
+DID_SERVICE_INTERVAL = 0x0C38
+
+
+class UdsResponse:
+    __slots__ = ("raw", "sid", "request_sid", "nrc", "echo", "payload")
+
+    def __init__(self, raw):
+        view = memoryview(raw)
+        self.raw = raw
+        self.sid = raw[0]
+        if self.sid == NEGATIVE_RESPONSE:
+            self.request_sid = raw[1] if len(raw) > 1 else None
+            self.nrc = raw[2] if len(raw) > 2 else None
+            self.echo = view[0:0]
+            self.payload = view[0:0]
+        else:
+            echo_end = 1 + ECHO_LENGTH.get(self.sid, 0)
+            self.request_sid = self.sid - POSITIVE_OFFSET
+            self.nrc = None
+            self.echo = view[1:echo_end]
+            self.payload = view[echo_end:]
+
+    @property
+    def positive(self):
+        return self.sid != NEGATIVE_RESPONSE
+
+    @property
+    def did(self):
+        if self.sid in DID_SERVICES and len(self.echo) >= 2:
+            return int.from_bytes(self.echo[-2:], "big")
+        return None
+
+    @property
+    def nrc_name(self):
+        if self.nrc is None:
+            return None
+        return NRC_NAMES.get(self.nrc, f"NRC 0x{self.nrc:02X}")
+
+    def after(self, expected_prefix):
+        # Payload following an expected positive prefix ("62F190", "50", ...), or None on mismatch
+        prefix = prefix_bytes(expected_prefix)
+        if not self.raw.startswith(prefix):
+            return None
+        return memoryview(self.raw)[len(prefix):]
+
+    def __repr__(self):
+        return self.raw.hex().upper()
+
+
+def parse_response(response):
+    # Accepts the hex string openobd returns (or raw bytes); None for an empty or malformed response
+    if not response:
+        return None
+    if isinstance(response, str):
+        try:
+            raw = bytes.fromhex(response)
+        except ValueError:
+            return None
+    else:
+        raw = bytes(response)
+    return UdsResponse(raw) if raw else None
+
+
+@lru_cache(maxsize=256)
+def prefix_bytes(expected_prefix):
+    return bytes.fromhex(expected_prefix)
+
+
+class DidRequest:
+    __slots__ = ("did", "request", "request_bytes", "positive")
+
+    def __init__(self, did):
+        self.did = did
+        self.request_bytes = bytes((0x22, did >> 8, did & 0xFF))
+        self.request = self.request_bytes.hex().upper()
+        self.positive = f"62{did:04X}"
+
+
+@lru_cache(maxsize=None)
+def read_did_request(did):
+    return DidRequest(did)
+
+
+READ_VIN = read_did_request(DID_VIN)
+READ_VAG_PART_NUMBER = read_did_request(DID_VAG_PART_NUMBER)
+READ_SOFTWARE_VERSION = read_did_request(DID_SOFTWARE_VERSION)
+READ_SERIAL_NUMBER = read_did_request(DID_SERIAL_NUMBER)
+READ_ASAM_FILE_ID = read_did_request(DID_ASAM_FILE_ID)
+READ_ASAM_FILE_VERSION = read_did_request(DID_ASAM_FILE_VERSION)
+READ_SERVICE_INTERVAL = read_did_request(DID_SERVICE_INTERVAL)
+
+
+# === Decoders (bytes / memoryview in, values out) ===
+
+def decode_text(payload, default=""):
+    # ASCII/UTF-8 identification strings, padded with NULs or spaces by most ECUs
+    if payload is None:
+        return default
+    try:
+        return str(payload, "utf-8").strip("\x00").strip()
+    except UnicodeDecodeError:
+        return default
+
+
+def decode_counter(payload):
+    # Service counters are the last two bytes, big endian
+    if payload is None or len(payload) < 2:
+        return None
+    return int.from_bytes(payload[-2:], "big")
+
+
+def format_dtc(b1, b2, b3):
+    return f"{'PCBU'[b1 >> 6]}{b1 & 0x3F:02X}{b2:02X}{b3:02X}"
+
+
+def decode_dtc_records(payload):
+    # Payload of 59 02: <availability mask> then 4-byte records (3 DTC bytes + status byte)
+    if payload is None:
+        return []
+    return [
+        DtcRecord(format_dtc(payload[i], payload[i + 1], payload[i + 2]), payload[i + 3])
+        for i in range(1, len(payload) - 3, 4)
+    ]
+
+
+def decode_dtcs(payload):
+    return [record.code for record in decode_dtc_records(payload)]
+
+
+def decode_identification(response):
+    # Text of a ReadDataByIdentifier response, with the labels the scan tables use for failures
+    parsed = parse_response(response)
+    if parsed is None or not parsed.positive:
+        return "No response"
+    return decode_text(parsed.payload, default="N/A")
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from openobd import *
+from bus_limiter import bus_limiter, isotp_frames
+from metrics import record_nrc, record_uds_request
+from scan_records import ModuleResult
+from scan_stream import IDENTIFICATION_FIELDS, PRIMARY_BUS, module_bus, module_id_pairs
+from uds_codec import decode_text, parse_response
+from uds_engine import (
+    BUSY_BACKOFF, BUSY_BACKOFF_MAX, BUSY_RETRIES, MAX_PENDING, NO_RESPONSE, NRC_BUSY, NRC_RESPONSE_PENDING,
+    P2_STAR_TIMEOUT, P2_TIMEOUT, PENDING_TIMEOUT, STREAM_CLOSED, RequestFailure, failure_reason,
+)
+
+# Asynchronous UDS over a single ISO-TP stream per bus. Every IsotpMessage carries its own channel,
+# so one stream can serve all ECUs on a bus: requests from any number of coroutines are written to
+# it, and a reader thread routes each incoming message to the waiting request by (request ID,
+# response ID). One request per ECU is in flight at a time (ISO-TP is request/response per channel);
+# different ECUs are served concurrently, up to DEMUX_MAX_OUTSTANDING, and every attempt waits for
+# the bus limiter of the session and bus like all other request paths. Timing and NRC handling
+# (78 responsePending, 21 busyRepeatRequest, permanent NRCs) follow uds_engine.uds_request.
+
+DEMUX_MAX_OUTSTANDING = int(os.getenv("DEMUX_MAX_OUTSTANDING", "64"))
+READER_POLL = 0.5
+
+
+class IsotpDemux:
+    """Create inside the event loop; `async with IsotpDemux(session, bus) as demux: await demux.request(...)`."""
+
+    def __init__(self, session, bus_name=PRIMARY_BUS, max_outstanding=DEMUX_MAX_OUTSTANDING):
+        self.bus_name = bus_name
+        self._loop = asyncio.get_running_loop()
+        self._inboxes = {}  # (request_id, response_id) -> asyncio.Queue of payloads, None = stream gone
+        self._locks = {}  # (request_id, response_id) -> asyncio.Lock
+        self._slots = asyncio.Semaphore(max_outstanding)
+        self._limiter = bus_limiter(session, bus_name)
+        self._closed = threading.Event()
+        self._failed = False
+        self._stream = StreamHandler(session.open_isotp_stream, outgoing_stream=True)
+        self._reader = threading.Thread(target=self._read, name=f"demux-{bus_name}", daemon=True)
+        self._reader.start()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        try:
+            # Every request has been answered or given up: nothing left to flush
+            self._stream.stop_stream(send_remaining_messages=False)
+        except Exception as e:
+            logging.debug(f"Demux stream on {self.bus_name} already stopped: {e}")
+        await asyncio.to_thread(self._reader.join, READER_POLL * 2)
+
+    # === Receive side (reader thread -> event loop) ===
+
+    def _read(self):
+        while not self._closed.is_set():
+            try:
+                message = self._stream.receive(timeout=READER_POLL)
+            except OpenOBDStreamTimeoutException:
+                continue
+            except Exception as e:
+                if not self._closed.is_set():
+                    logging.warning(f"Demux stream on {self.bus_name} ended: {e}")
+                self._loop.call_soon_threadsafe(self._fail_all)
+                return
+            key = (message.channel.request_id, message.channel.response_id)
+            self._loop.call_soon_threadsafe(self._deliver, key, message.payload)
+
+    def _deliver(self, key, payload):
+        inbox = self._inboxes.get(key)
+        if inbox is not None:
+            inbox.put_nowait(payload)
+
+    def _fail_all(self):
+        self._failed = True
+        for inbox in self._inboxes.values():
+            inbox.put_nowait(None)
+
+    # === Send side ===
+
+    async def request(self, request_id, response_id, command, p2=P2_TIMEOUT, p2_star=P2_STAR_TIMEOUT,
+                      busy_retries=BUSY_RETRIES):
+        # Returns the final positive UdsResponse or raises RequestFailure
+        key = (request_id, response_id)
+        inbox = self._inboxes.setdefault(key, asyncio.Queue())
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        channel = IsotpChannel(
+            bus_name=self.bus_name,
+            request_id=request_id,
+            response_id=response_id,
+            padding=Padding.PADDING_ENABLED,
+        )
+        async with lock, self._slots:
+            start = time.monotonic()
+            try:
+                response = await self._exchange(channel, inbox, command, p2, p2_star, busy_retries)
+            except RequestFailure as e:
+                record_uds_request(channel, command, e.elapsed if e.response is not None else None, e.reason)
+                raise
+        record_uds_request(channel, command, time.monotonic() - start, "positive")
+        return response
+
+    async def _exchange(self, channel, inbox, command, p2, p2_star, busy_retries):
+        request_sid = int(command[:2], 16)
+        frames = isotp_frames(len(command) // 2)
+        start = time.monotonic()
+        backoff = BUSY_BACKOFF
+        attempts = 0
+        pending = 0
+
+        while True:
+            attempts += 1
+            response = None
+            latency = None
+            # BusLimiter blocks; waiting for it in a worker thread keeps the event loop free
+            await asyncio.to_thread(self._limiter.acquire, frames)
+            sent = time.monotonic()
+            try:
+                while not inbox.empty():
+                    inbox.get_nowait()  # Late answers to an earlier request
+                if self._failed or self._closed.is_set():
+                    raise RequestFailure(STREAM_CLOSED, command, attempts=attempts, elapsed=time.monotonic() - start)
+                try:
+                    self._stream.send(IsotpMessage(channel=channel, payload=command))
+                except OpenOBDStreamStoppedException:
+                    raise RequestFailure(STREAM_CLOSED, command, attempts=attempts, elapsed=time.monotonic() - start)
+
+                deadline = time.monotonic() + p2
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        reason = PENDING_TIMEOUT if response is not None else NO_RESPONSE
+                        raise RequestFailure(reason, command, response, attempts, pending, time.monotonic() - start)
+                    try:
+                        payload = await asyncio.wait_for(inbox.get(), remaining)
+                    except asyncio.TimeoutError:
+                        continue
+                    if payload is None:
+                        raise RequestFailure(STREAM_CLOSED, command, response, attempts, pending, time.monotonic() - start)
+
+                    candidate = parse_response(payload)
+                    if candidate is None or candidate.request_sid != request_sid:
+                        continue
+                    response = candidate
+                    if latency is None:
+                        latency = time.monotonic() - sent
+                    if response.positive:
+                        return response
+                    record_nrc(command, response.nrc)
+                    if response.nrc == NRC_RESPONSE_PENDING and pending < MAX_PENDING:
+                        pending += 1
+                        deadline = time.monotonic() + p2_star
+                        continue
+                    break
+            finally:
+                self._limiter.release(latency, busy=response is not None and response.nrc == NRC_BUSY)
+
+            if response.nrc == NRC_BUSY and attempts <= busy_retries:
+                logging.info(f"{command} on 0x{channel.request_id:X}: busyRepeatRequest, retrying in {backoff:.1f}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, BUSY_BACKOFF_MAX)
+                continue
+            raise RequestFailure(failure_reason(response.nrc), command, response, attempts, pending,
+                                 time.monotonic() - start)
+
+
+# === Scanning ===
+
+async def identify_module(demux, module_name, module_info):
+    # Same result and failures as scan_stream.read_module_identification: alternate_ids are tried
+    # when a pair does not answer at all, any other RequestFailure fails the module
+    failure = None
+    for ids in module_id_pairs(module_info):
+        try:
+            return await _identify(demux, ids, module_name, module_info)
+        except RequestFailure as e:
+            if e.reason != NO_RESPONSE:
+                raise
+            failure = failure or e
+    raise failure
+
+
+async def _identify(demux, ids, module_name, module_info):
+    if not module_info.get("skip_1003"):
+        await demux.request(*ids, "1003")
+    result = ModuleResult(module_name)
+    for name, did in IDENTIFICATION_FIELDS.items():
+        response = await demux.request(*ids, did.request)
+        setattr(result, name, decode_text(response.after(did.positive), default=None) or None)
+    return result
+
+
+async def _scan(openobd_session, modules, buses, emit):
+    by_bus = {}
+    for module_name, module_info in modules.items():
+        by_bus.setdefault(module_bus(module_info), {})[module_name] = module_info
+
+    async def scan_one(demux, module_name, module_info):
+        emit(("started", module_name, None, None))
+        start = time.monotonic()
+        try:
+            result = await identify_module(demux, module_name, module_info)
+        except Exception as e:
+            emit(("failed", module_name, e, time.monotonic() - start))
+        else:
+            emit(("done", module_name, result, time.monotonic() - start))
+
+    async def scan_bus(bus_name, bus_modules):
+        async with IsotpDemux(openobd_session, bus_name) as demux:
+            await asyncio.gather(*(scan_one(demux, name, info) for name, info in bus_modules.items()))
+
+    for bus_name in [b for b in by_bus if b not in buses]:
+        for module_name in by_bus.pop(bus_name):
+            emit(("failed", module_name, RuntimeError(f"Bus {bus_name} is not configured"), 0.0))
+    await asyncio.gather(*(scan_bus(bus_name, bus_modules) for bus_name, bus_modules in by_bus.items()))
+
+
+def scan_modules_demux(openobd_session, modules, buses=(PRIMARY_BUS,)):
+    # Same events as scan_stream.scan_modules (no delta scan), with every module of a bus in flight
+    # at once over one stream; the event loop runs in its own thread so this stays a plain generator.
+    # `modules` as given by scan_modules, already mapped to their buses (assign_buses).
+    events = queue.Queue()
+
+    def run():
+        try:
+            asyncio.run(_scan(openobd_session, modules, buses, events.put))
+        except Exception as e:
+            logging.error(f"Demux scan failed: {e}")
+        finally:
+            events.put(None)
+
+    threading.Thread(target=run, name="demux-scan", daemon=True).start()
+    while (event := events.get()) is not None:
+        yield event
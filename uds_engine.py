@@ -0,0 +1,195 @@
+import logging
+import os
+import time
+from openobd import *
+from uds_codec import parse_response
+from bus_limiter import isotp_frames
+from metrics import record_nrc, record_uds_request
+from perf import phase
+from tester_present import keepalive
+
+# NRC-aware request engine. Unlike IsotpSocket.request it owns the response timing:
+#   7F xx 78 (responsePending)  -> keep listening, the deadline is extended to P2* on every 78
+#   7F xx 21 (busyRepeatRequest) -> resend after an exponential backoff
+#   permanent NRCs (31, 33, ...) -> fail immediately, never retried
+# A request is sent once per attempt and never resent because of a 78, so a write or routine
+# that takes long to execute is not triggered twice. Every failure is a RequestFailure carrying
+# a reason code the callers can show or log. With a bus limiter every attempt waits for its turn
+# on the bus and reports its latency (or NRC 21) back to it.
+
+P2_TIMEOUT = float(os.getenv("UDS_P2_TIMEOUT", "2.0"))
+P2_STAR_TIMEOUT = float(os.getenv("UDS_P2_STAR_TIMEOUT", "5.0"))
+BUSY_RETRIES = int(os.getenv("UDS_BUSY_RETRIES", "5"))
+BUSY_BACKOFF = 0.1
+BUSY_BACKOFF_MAX = 2.0
+MAX_PENDING = 60
+
+NRC_BUSY = 0x21
+NRC_RESPONSE_PENDING = 0x78
+PERMANENT_NRCS = {0x11, 0x12, 0x13, 0x31, 0x33, 0x35, 0x36, 0x7E, 0x7F}
+
+# Reason codes
+NO_RESPONSE = "no_response"
+PENDING_TIMEOUT = "pending_timeout"
+BUSY = "busy"
+NEGATIVE_RESPONSE = "negative_response"
+PERMANENT_NEGATIVE_RESPONSE = "permanent_negative_response"
+UNEXPECTED_RESPONSE = "unexpected_response"
+STREAM_CLOSED = "stream_closed"
+
+
+class RequestFailure(Exception):
+
+    def __init__(self, reason, command, response=None, attempts=1, pending=0, elapsed=0.0):
+        self.reason = reason
+        self.command = command
+        self.response = response
+        self.attempts = attempts
+        self.pending = pending
+        self.elapsed = elapsed
+        super().__init__(str(self))
+
+    @property
+    def nrc(self):
+        return self.response.nrc if self.response is not None else None
+
+    @property
+    def nrc_name(self):
+        return self.response.nrc_name if self.response is not None else None
+
+    @property
+    def permanent(self):
+        return self.reason == PERMANENT_NEGATIVE_RESPONSE
+
+    @property
+    def summary(self):
+        # Short form for the UI: "permanent_negative_response: requestOutOfRange"
+        return f"{self.reason}: {self.nrc_name}" if self.nrc is not None else self.reason
+
+    def as_dict(self):
+        return {
+            "reason": self.reason, "command": self.command, "nrc": self.nrc, "nrc_name": self.nrc_name,
+            "response": repr(self.response) if self.response is not None else None,
+            "attempts": self.attempts, "pending": self.pending, "elapsed": round(self.elapsed, 3),
+        }
+
+    def __str__(self):
+        detail = f" {self.nrc_name} (0x{self.nrc:02X})" if self.nrc is not None else ""
+        return (f"{self.command}: {self.reason}{detail} after {self.attempts} attempt(s), "
+                f"{self.pending} pending, {self.elapsed:.2f}s")
+
+
+def uds_request(sock, command, p2=P2_TIMEOUT, p2_star=P2_STAR_TIMEOUT, busy_retries=BUSY_RETRIES, limiter=None):
+    # Returns the final positive UdsResponse or raises RequestFailure
+    start = time.monotonic()
+    try:
+        response = _exchange(sock, command, p2, p2_star, busy_retries, limiter)
+    except RequestFailure as e:
+        record_uds_request(sock._channel, command, e.elapsed if e.response is not None else None, e.reason)
+        raise
+    record_uds_request(sock._channel, command, time.monotonic() - start, "positive")
+    return response
+
+
+def _exchange(sock, command, p2, p2_star, busy_retries, limiter):
+    request_sid = int(command[:2], 16)
+    # IsotpSocket keeps its channel private; the engine needs it to drive the stream itself
+    message = IsotpMessage(channel=sock._channel, payload=command)
+    frames = isotp_frames(len(command) // 2)
+    start = time.monotonic()
+    backoff = BUSY_BACKOFF
+    attempts = 0
+    pending = 0
+
+    while True:
+        attempts += 1
+        response = None
+        latency = None
+        if limiter:
+            limiter.acquire(frames)
+        sent = time.monotonic()
+        try:
+            try:
+                sock.stream_handler.send(message, flush_incoming_messages=True)
+            except OpenOBDStreamStoppedException:
+                raise RequestFailure(STREAM_CLOSED, command, attempts=attempts, elapsed=time.monotonic() - start)
+
+            deadline = time.monotonic() + p2
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    reason = PENDING_TIMEOUT if response is not None else NO_RESPONSE
+                    raise RequestFailure(reason, command, response, attempts, pending, time.monotonic() - start)
+                try:
+                    incoming = sock.stream_handler.receive(timeout=remaining)
+                except OpenOBDStreamTimeoutException:
+                    continue
+                except OpenOBDStreamStoppedException:
+                    raise RequestFailure(STREAM_CLOSED, command, response, attempts, pending, time.monotonic() - start)
+
+                candidate = parse_response(incoming.payload)
+                if candidate is None or candidate.request_sid != request_sid:
+                    continue  # Not an answer to this request (late response, tester present, ...)
+                response = candidate
+                if latency is None:
+                    latency = time.monotonic() - sent
+                if response.positive:
+                    return response
+                record_nrc(command, response.nrc)
+                if response.nrc == NRC_RESPONSE_PENDING and pending < MAX_PENDING:
+                    pending += 1
+                    deadline = time.monotonic() + p2_star
+                    continue
+                break
+        finally:
+            if limiter:
+                limiter.release(latency, busy=response is not None and response.nrc == NRC_BUSY)
+
+        if response.nrc == NRC_BUSY and attempts <= busy_retries:
+            logging.info(f"{command}: busyRepeatRequest, retrying in {backoff:.1f}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, BUSY_BACKOFF_MAX)
+            continue
+
+        raise RequestFailure(failure_reason(response.nrc), command, response, attempts, pending, time.monotonic() - start)
+
+
+def failure_reason(nrc):
+    # Reason code for a final negative response, once retries and pending extensions are used up
+    if nrc == NRC_BUSY:
+        return BUSY
+    if nrc == NRC_RESPONSE_PENDING:
+        return PENDING_TIMEOUT
+    if nrc in PERMANENT_NRCS:
+        return PERMANENT_NEGATIVE_RESPONSE
+    return NEGATIVE_RESPONSE
+
+
+def request_payload(sock, command, expected_prefix, **options):
+    # Payload after expected_prefix (memoryview); a positive answer with another prefix is a failure too
+    start = time.monotonic()
+    response = uds_request(sock, command, **options)
+    payload = response.after(expected_prefix)
+    if payload is None:
+        raise RequestFailure(UNEXPECTED_RESPONSE, command, response, elapsed=time.monotonic() - start)
+    return payload
+
+
+def send_request(sock, command, expected_prefix, log=None, **options):
+    # request_payload for the apps: the payload or None, failures are logged instead of raised.
+    # Waits for a registered keepalive to be idle; log(line) additionally gets every exchange.
+    try:
+        with phase("ECU I/O"), keepalive.busy(sock):
+            payload = request_payload(sock, command, expected_prefix, **options)
+        logging.info(f"Response: {expected_prefix}{payload.hex().upper()}")
+        if log:
+            log(f"{command} => {expected_prefix}{payload.hex().upper()}")
+        return payload
+    except RequestFailure as e:
+        logging.warning(f"Request failed: {e}")
+        if log:
+            log(f"{command} => {e.reason} {e.as_dict()}")
+        return None
+    except Exception as e:
+        logging.error(f"Request failed: {e}")
+        return None
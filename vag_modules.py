@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+from scan_stream import PRIMARY_BUS
+
+# Module registry for the VAG Module Scanner (final_gui.py), info_re, gui_scan_vag and the scan service.
+# The modules live in vag_modules.json (VAG_MODULES_PATH), one entry per module:
+#   request_id / response_id   hex strings, 11 or 29 bit
+#   skip_1003                  no extended session before reading (the module rejects 1003)
+#   bus                        scan_stream.VAG_BUSES name, PRIMARY_BUS (pins 6/14) when absent
+#   alternate_ids              [[request, response], ...] tried when the main pair does not answer
+# "platforms" maps a VIN platform code (vag_vehicle.guess_vag_platform) to an overlay of changed
+# fields, added modules, or null for modules the platform does not have.
+
+MODULES_PATH = os.getenv("VAG_MODULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vag_modules.json"))
+ID_FIELDS = ("request_id", "response_id")
+
+
+def _normalize(name, entry):
+    module = {key: int(value, 16) if key in ID_FIELDS and isinstance(value, str) else value
+              for key, value in entry.items()}
+    for key in ID_FIELDS:
+        if not isinstance(module.get(key), int):
+            raise ValueError(f"Module {name}: missing or invalid {key}")
+    module["fixed_bus"] = bool(module.get("bus"))  # Named in the entry: scan_stream.assign_buses leaves it
+    module["bus"] = module.get("bus") or PRIMARY_BUS  # Explicit and implicit primary bus index alike
+    module["skip_1003"] = bool(module.get("skip_1003", False))
+    module["alternate_ids"] = [tuple(int(i, 16) if isinstance(i, str) else i for i in pair)
+                               for pair in module.get("alternate_ids", [])]
+    return module
+
+
+class ModuleRegistry:
+
+    def __init__(self, modules, platforms=None):
+        self.modules = {name: _normalize(name, entry) for name, entry in modules.items()}
+        self.platforms = platforms or {}
+        self.by_address = {}  # (bus, request_id) -> [names]; more than one name is a duplicate address
+        self.by_response = {}  # (bus, response_id) -> name, alternate IDs included
+        self.by_code = {}  # "15" -> ["15_SRS_Airbag", "15_SRS"]
+        for name, module in self.modules.items():
+            bus = module["bus"]
+            for request_id, response_id in self.id_pairs(name):
+                self.by_address.setdefault((bus, request_id), []).append(name)
+                self.by_response.setdefault((bus, response_id), name)
+            self.by_code.setdefault(name.split("_")[0], []).append(name)
+
+    @classmethod
+    def load(cls, path=MODULES_PATH):
+        with open(path) as f:
+            data = json.load(f)
+        registry = cls(data["modules"], data.get("platforms"))
+        for (bus, request_id), names in registry.duplicates().items():
+            # Module logger: logging.warning() here would configure the root logger before the apps do
+            logging.getLogger(__name__).warning(
+                f"Modules {', '.join(names)} share request ID 0x{request_id:X}; scanned once")
+        return registry
+
+    def id_pairs(self, name):
+        module = self.modules[name]
+        return [(module["request_id"], module["response_id"]), *module["alternate_ids"]]
+
+    def duplicates(self):
+        return {address: names for address, names in self.by_address.items() if len(names) > 1}
+
+    def module_for_response(self, response_id, bus=PRIMARY_BUS):
+        return self.by_response.get((bus, response_id))
+
+    def for_platform(self, platform):
+        # Registry with the platform overlay applied; the registry itself when there is none
+        overlay = self.platforms.get(platform)
+        if not overlay:
+            return self
+        modules = {name: dict(entry) for name, entry in self.modules.items()}
+        for name, change in overlay.items():
+            if change is None:
+                modules.pop(name, None)
+            else:
+                modules[name] = {**modules.get(name, {}), **change}
+        return ModuleRegistry(modules)
+
+    def scan_plan(self, names=None, platform=None):
+        # {name: module} to scan, each address once: returns (plan, {scanned name: [skipped names]})
+        registry = self.for_platform(platform) if platform else self
+        plan = {}
+        aliases = {}
+        planned = {}  # (bus, request_id) -> name
+        for name in registry.modules if names is None else names:
+            module = registry.modules.get(name)
+            if module is None:
+                continue
+            address = (module["bus"], module["request_id"])
+            if address in planned:
+                aliases.setdefault(planned[address], []).append(name)
+                continue
+            planned[address] = name
+            plan[name] = module
+        return plan, aliases
+
+
+registry = ModuleRegistry.load()
+all_modules = registry.modules
+ECM_ID_PAIRS = registry.id_pairs("01_ECM")
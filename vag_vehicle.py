@@ -0,0 +1,26 @@
+# VIN helpers shared by the reset tools and the fleet analytics
+
+VAG_WMI_BRANDS = {
+    "WVW": "Volkswagen", "WV1": "Volkswagen Commercial",
+    "WAU": "Audi", "TRU": "Audi (Hungary)",
+    "SKZ": "Skoda", "TMB": "Skoda",
+    "VSS": "SEAT", "3VW": "Volkswagen (Mexico)",
+    "9BW": "Volkswagen (Brazil)"
+}
+
+
+def guess_vag_brand(vin):
+    if not vin or len(vin) < 3:
+        return "Unknown"
+    return VAG_WMI_BRANDS.get(vin[:3].upper(), "Unknown")
+
+
+def is_valid_vin(vin):
+    return bool(vin) and len(vin) == 17 and vin.isalnum()
+
+
+def guess_vag_platform(vin):
+    # VAG encodes the model/platform code in VIN positions 7-8 (e.g. "1K" Golf 5, "5G" Golf 7)
+    if not is_valid_vin(vin):
+        return "Unknown"
+    return vin[6:8].upper()
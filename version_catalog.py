@@ -0,0 +1,85 @@
+import re
+from bisect import insort
+from functools import lru_cache
+
+# Known software versions per VAG part number (Sheet3), indexed once per scan. Each part keeps its
+# versions sorted by VAG version order and its latest version precomputed, so comparing a module
+# against the catalog is a dict lookup plus one key comparison.
+
+NEWER = "newer"
+OLDER = "older"
+CURRENT = "current"
+UNKNOWN = "unknown"
+
+_TOKENS = re.compile(r"\d+|[A-Z]+")
+
+
+@lru_cache(maxsize=4096)
+def version_key(version):
+    # Series releases are plain numbers ("0010" < "0815" < "9985") and rank above letter-coded
+    # engineering/pre-series releases ("H07", "X123"), which are ordered naturally among themselves
+    text = str(version).strip().upper()
+    if text.isdigit():
+        return (1, int(text), ())
+    tokens = tuple((0, int(t), "") if t.isdigit() else (1, 0, t) for t in _TOKENS.findall(text))
+    return (0, 0, tokens)
+
+
+def normalize_version(version):
+    text = str(version).strip().upper()
+    if text.endswith(".0") and text[:-2].isdigit():
+        text = text[:-2]  # Sheets hands numeric cells back as floats
+    return text
+
+
+class VersionCatalog:
+
+    def __init__(self):
+        self._versions = {}
+        self._latest = {}
+
+    @classmethod
+    def from_frame(cls, frame, part_column="VAG Part Number", version_column="Available Versions"):
+        catalog = cls()
+        if frame is None or frame.empty or part_column not in frame or version_column not in frame:
+            return catalog
+        pairs = frame[[part_column, version_column]].astype(str).drop_duplicates()
+        for part_number, version in pairs.itertuples(index=False):
+            catalog.observe(part_number, version)
+        return catalog
+
+    def observe(self, part_number, version):
+        # Adds a version seen for a part; True when it was not known yet
+        part_number = str(part_number).strip()
+        version = normalize_version(version)
+        if not part_number or not version or version in ("NAN", "NONE"):
+            return False
+        versions = self._versions.setdefault(part_number, [])
+        if version in versions:
+            return False
+        insort(versions, version, key=version_key)
+        self._latest[part_number] = versions[-1]
+        return True
+
+    def versions(self, part_number):
+        return list(self._versions.get(str(part_number).strip(), ()))
+
+    def latest(self, part_number):
+        return self._latest.get(str(part_number).strip())
+
+    def compare(self, part_number, version):
+        latest = self.latest(part_number)
+        if latest is None or not version:
+            return UNKNOWN
+        current_key, latest_key = version_key(normalize_version(version)), version_key(latest)
+        if current_key > latest_key:
+            return NEWER
+        if current_key < latest_key:
+            return OLDER
+        return CURRENT
+
+    def __contains__(self, part_number):
+        return str(part_number).strip() in self._versions
+
+    def __len__(self):
+        return len(self._versions)